@@ -6,7 +6,7 @@ from app.core.models import Company, Task, TaskStatus, TaskType, TaskOrgao
 from app.core.competencia import fmt_comp
 from app.core.br_docs import only_digits, format_cnpj, sanitize_ie
 
-from .sqlite import _connect
+from .sqlite import _connect, fts_prefix_query
 
 
 class UserRepository:
@@ -60,11 +60,10 @@ class CompanyRepository:
             q += " AND TRIM(regime) = TRIM(?) COLLATE NOCASE"
             params.append(regime)
 
-        s = (query or "").strip()
-        if s:
-            q += " AND (nome LIKE ? OR cnpj LIKE ?)"
-            like = f"%{s}%"
-            params.extend([like, like])
+        match = fts_prefix_query(query)
+        if match:
+            q += " AND id IN (SELECT rowid FROM empresas_fts WHERE empresas_fts MATCH ?)"
+            params.append(match)
 
         q += " ORDER BY nome COLLATE NOCASE"
         rows = cur.execute(q, params).fetchall()
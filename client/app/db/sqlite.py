@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import re
 import sqlite3
 from pathlib import Path
 from typing import List, Dict, Optional, Any
@@ -136,6 +137,49 @@ def _normalize_pdf_paths(cur) -> None:
             continue
 
 
+def _digits_sql(expr: str) -> str:
+    return f"REPLACE(REPLACE(REPLACE(REPLACE(COALESCE({expr}, ''), '.', ''), '/', ''), '-', ''), ' ', '')"
+
+
+def _ensure_empresas_fts(cur) -> None:
+    """Índice FTS5 (sem acentos, com prefixo) para a busca de empresas, mantido por triggers."""
+    values = "{ref}.id, {ref}.nome, " + _digits_sql("{ref}.cnpj") + ", COALESCE({ref}.ie, '') || ' ' || " + _digits_sql("{ref}.ie")
+    exists = cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'empresas_fts'").fetchone()
+    if not exists:
+        cur.execute(
+            "CREATE VIRTUAL TABLE empresas_fts USING fts5("
+            "nome, cnpj, ie, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+        )
+        cur.execute(f"INSERT INTO empresas_fts (rowid, nome, cnpj, ie) SELECT {values.format(ref='empresas')} FROM empresas")
+    insert = f"INSERT INTO empresas_fts (rowid, nome, cnpj, ie) VALUES ({values.format(ref='NEW')});"
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_empresas_fts_ins AFTER INSERT ON empresas BEGIN {insert} END")
+    cur.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_empresas_fts_upd AFTER UPDATE OF nome, cnpj, ie ON empresas "
+        f"BEGIN DELETE FROM empresas_fts WHERE rowid = OLD.id; {insert} END"
+    )
+    cur.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_empresas_fts_del AFTER DELETE ON empresas "
+        "BEGIN DELETE FROM empresas_fts WHERE rowid = OLD.id; END"
+    )
+
+
+def fts_prefix_query(text: str) -> Optional[str]:
+    """Converte o texto digitado em uma consulta FTS5 por prefixo (termos em AND).
+
+    CNPJ/IE com pontuação viram um único termo só com dígitos.
+    """
+    raw = (text or "").strip()
+    if not raw:
+        return None
+    if re.fullmatch(r"[\d./\-\s]+", raw):
+        digits = re.sub(r"\D", "", raw)
+        return f'"{digits}"*' if digits else None
+    tokens = re.findall(r"\w+", raw)
+    if not tokens:
+        return None
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
 def init_db():
     conn = _connect()
     cur = conn.cursor()
@@ -181,6 +225,16 @@ def init_db():
     _ensure_tarefas_pdf_column(cur)
     _ensure_tarefas_pdf_blob_column(cur)
     _normalize_pdf_paths(cur)
+    _ensure_empresas_fts(cur)
+    # Indice de cobertura para os contadores de Relatorios (count_by_status / companies_with_status)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tarefas_user_status ON tarefas (user_id, status, company_id)"
+    )
+    # Tarefas da empresa ja na ordem da lista (competencia DESC, titulo), sem ordenar em B-tree temporario
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tarefas_user_company_competencia "
+        "ON tarefas (user_id, company_id, competencia DESC, titulo COLLATE NOCASE)"
+    )
     cur.execute(
         "UPDATE empresas SET user_id = ? WHERE user_id IS NULL",
         (int(default_user_id),),
@@ -248,11 +302,10 @@ def empresas_list(*, query: str = "", regime: Optional[str] = None) -> List[Dict
         q += " AND regime = ?"
         params.append(regime)
 
-    s = (query or "").strip()
-    if s:
-        q += " AND (nome LIKE ? OR cnpj LIKE ?)"
-        like = f"%{s}%"
-        params.extend([like, like])
+    match = fts_prefix_query(query)
+    if match:
+        q += " AND id IN (SELECT rowid FROM empresas_fts WHERE empresas_fts MATCH ?)"
+        params.append(match)
 
     q += " ORDER BY nome COLLATE NOCASE"
     rows = cur.execute(q, params).fetchall()
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from .br_docs import normalize_competencia
+from .db import DONE_STATUSES, _connect, create_rollup_tables, get_data_dir, rebuild_task_rollup
+
+# Anos fechados saem do app.db para <data_dir>/archive/fiscal-<ano>.db, com as mesmas tabelas.
+# As leituras anexam esses arquivos (somente leitura) quando o filtro de competencia pede um ano arquivado.
+ARCHIVE_DIRNAME = "archive"
+ARCHIVE_INDEX_KEY = "archive_index"
+# Tabelas movidas junto com a tarefa; tarefas por ultimo (as outras referenciam task_id)
+ARCHIVED_TABLES = ("task_logs", "task_comments", "classificacoes", "email_logs", "tarefas")
+_ARCHIVE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_tarefas_competencia ON tarefas (competencia, company_id)",
+    # ordem de TaskRepository.list/iter_export, como na base quente
+    "CREATE INDEX IF NOT EXISTS idx_tarefas_competencia_desc ON tarefas (competencia DESC, titulo COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS idx_task_logs_task ON task_logs (task_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_task_comments_task ON task_comments (task_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_classificacoes_task ON classificacoes (task_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_email_logs_task ON email_logs (task_id)",
+)
+# SQLITE_MAX_ATTACHED padrao e 10
+MAX_ATTACHED = 9
+
+
+def archive_path(year: int) -> Path:
+    path = get_data_dir() / ARCHIVE_DIRNAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path / f"fiscal-{int(year)}.db"
+
+
+def _year_match(year: int, column: str = "competencia") -> str:
+    # AAAAMM e o formato gravado; MM/AAAA aparece em dados digitados a mao
+    return f"({column} GLOB '{int(year)}[01][0-9]' OR {column} GLOB '[01][0-9]/{int(year)}')"
+
+
+def archive_index(conn: Optional[sqlite3.Connection] = None) -> Dict[int, Dict[str, object]]:
+    own = conn is None
+    conn = conn or _connect()
+    row = conn.execute("SELECT value FROM app_settings WHERE key = ?", (ARCHIVE_INDEX_KEY,)).fetchone()
+    if own:
+        conn.close()
+    if not row:
+        return {}
+    try:
+        return {int(k): v for k, v in json.loads(row[0]).items()}
+    except (TypeError, ValueError):
+        return {}
+
+
+def years_for_filter(
+    competencia: Optional[str] = None,
+    competencia_from: Optional[str] = None,
+    competencia_to: Optional[str] = None,
+) -> List[int]:
+    """Anos arquivados que o filtro alcanca. Sem filtro de competencia a consulta fica so na base quente."""
+    if not (competencia or competencia_from or competencia_to):
+        return []
+    years = sorted(archive_index())
+    if not years:
+        return []
+    if competencia:
+        key = normalize_competencia(competencia)
+        return [int(key[:4])] if key and int(key[:4]) in years else []
+    low = normalize_competencia(competencia_from or "") or str(competencia_from or "")
+    high = normalize_competencia(competencia_to or "") or str(competencia_to or "")
+    return [
+        y
+        for y in years
+        if (not competencia_from or str(y) >= low[:4]) and (not competencia_to or str(y) <= high[:4])
+    ]
+
+
+def attach_archives(conn: sqlite3.Connection, years: Sequence[int]) -> List[str]:
+    """Anexa os arquivos dos anos (somente leitura) e devolve os nomes de schema (arc_<ano>)."""
+    if len(years) > MAX_ATTACHED:
+        raise ValueError(f"Periodo abrange mais de {MAX_ATTACHED} anos arquivados; reduza o filtro de competencia")
+    schemas = []
+    for year in years:
+        path = archive_path(year)
+        if not path.is_file():
+            continue
+        name = f"arc_{int(year)}"
+        conn.execute(f"ATTACH DATABASE ? AS {name}", (path.as_uri() + "?mode=ro",))
+        schemas.append(name)
+    return schemas
+
+
+def open_archive_for_task(task_id: int) -> Optional[sqlite3.Connection]:
+    """Conexao somente leitura com o arquivo que guarda a tarefa (None se ela nao foi arquivada)."""
+    for year, info in sorted(archive_index().items(), reverse=True):
+        if not int(info.get("min_id") or 0) <= int(task_id) <= int(info.get("max_id") or 0):
+            continue
+        path = archive_path(year)
+        if not path.is_file():
+            continue
+        conn = sqlite3.connect(path.as_uri() + "?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        if conn.execute("SELECT 1 FROM tarefas WHERE id = ?", (int(task_id),)).fetchone():
+            return conn
+        conn.close()
+    return None
+
+
+def _table_columns(conn: sqlite3.Connection, schema: str, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+
+def _prepare_archive(conn: sqlite3.Connection) -> None:
+    # Mesma definicao das tabelas quentes; colunas novas (ALTER TABLE) sao acrescentadas em arquivos antigos
+    for table in ARCHIVED_TABLES:
+        row = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        existing = _table_columns(conn, "arc", table)
+        if not existing:
+            conn.execute(row[0].replace(f"CREATE TABLE {table}", f"CREATE TABLE arc.{table}", 1))
+            continue
+        for col in conn.execute(f"PRAGMA main.table_info({table})").fetchall():
+            if col[1] not in existing:
+                conn.execute(f"ALTER TABLE arc.{table} ADD COLUMN {col[1]} {col[2]}")
+    for stmt in _ARCHIVE_INDEXES:
+        conn.execute(stmt.replace("IF NOT EXISTS ", "IF NOT EXISTS arc."))
+    # rollup recalculado depois da copia (rebuild_task_rollup no arquivo)
+    create_rollup_tables(conn.cursor(), "arc")
+
+
+def upgrade_archives() -> List[int]:
+    """Cria indices que faltam e recalcula o rollup gravado com a chave antiga nos arquivos.
+
+    Roda nas migracoes de inicializacao; devolve os anos cujo rollup foi recalculado.
+    """
+    upgraded = []
+    for year in sorted(archive_index()):
+        path = archive_path(year)
+        if not path.is_file():
+            continue
+        arc = sqlite3.connect(str(path))
+        try:
+            cur = arc.cursor()
+            for stmt in _ARCHIVE_INDEXES:
+                cur.execute(stmt)
+            if create_rollup_tables(cur):
+                rebuild_task_rollup(cur)
+                upgraded.append(year)
+            arc.commit()
+        finally:
+            arc.close()
+    return upgraded
+
+
+def archive_year(year: int, *, force: bool = False, dry_run: bool = False, vacuum: bool = False) -> Dict[str, object]:
+    """Move as tarefas de um ano fechado (e logs, comentarios, classificacoes, e-mails) para o arquivo do ano.
+
+    Por padrao so arquiva ano anterior ao atual sem tarefa em aberto; force ignora as tarefas em aberto.
+    """
+    year = int(year)
+    if year >= date.today().year:
+        raise ValueError("So anos anteriores ao atual podem ser arquivados")
+    done = DONE_STATUSES
+    conn = _connect()
+    try:
+        ids_where = _year_match(year)
+        open_tasks = conn.execute(
+            f"SELECT COUNT(*) FROM tarefas WHERE {ids_where} AND status NOT IN ({', '.join('?' for _ in done)})",
+            done,
+        ).fetchone()[0]
+        if open_tasks and not force:
+            raise ValueError(f"{open_tasks} tarefa(s) de {year} ainda em aberto; conclua ou use force")
+        counts = {
+            "tarefas": conn.execute(f"SELECT COUNT(*) FROM tarefas WHERE {ids_where}").fetchone()[0],
+        }
+        summary: Dict[str, object] = {"year": year, "open_tasks": int(open_tasks), "dry_run": dry_run, "moved": counts}
+        if dry_run or not counts["tarefas"]:
+            return summary
+
+        # FKs das tabelas arquivadas apontam para empresas/usuarios, que ficam so na base quente
+        conn.execute("PRAGMA foreign_keys=OFF")
+        conn.execute("ATTACH DATABASE ? AS arc", (str(archive_path(year)),))
+        conn.execute("CREATE TEMP TABLE archive_ids (id INTEGER PRIMARY KEY)")
+
+        def copy_rows() -> None:
+            for table in ARCHIVED_TABLES:
+                cols = ", ".join(_table_columns(conn, "main", table))
+                key = "id" if table == "tarefas" else "task_id"
+                conn.execute(
+                    f"INSERT OR REPLACE INTO arc.{table} ({cols}) "
+                    f"SELECT {cols} FROM main.{table} WHERE {key} IN (SELECT id FROM temp.archive_ids)"
+                )
+
+        # 1) copia e grava o arquivo; a base quente ainda tem tudo
+        conn.execute("BEGIN IMMEDIATE")
+        _prepare_archive(conn)
+        conn.execute(f"INSERT INTO temp.archive_ids SELECT id FROM main.tarefas WHERE {ids_where}")
+        copy_rows()
+        conn.commit()
+        arc = sqlite3.connect(str(archive_path(year)))
+        # Rollup proprio do arquivo: relatorios de anos arquivados somam esta tabela
+        rebuild_task_rollup(arc.cursor())
+        arc.commit()
+        arc.close()
+
+        # 2) apaga da base quente so o que esta no arquivo; linhas filhas criadas no intervalo sao copiadas de novo.
+        # Em WAL o commit entre bancos anexados nao e atomico, por isso o arquivo ja foi gravado no passo 1.
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM temp.archive_ids WHERE id NOT IN (SELECT id FROM arc.tarefas)")
+        copy_rows()
+        for table in ARCHIVED_TABLES:
+            key = "id" if table == "tarefas" else "task_id"
+            counts[table] = conn.execute(
+                f"SELECT COUNT(*) FROM main.{table} WHERE {key} IN (SELECT id FROM temp.archive_ids)"
+            ).fetchone()[0]
+        # O arquivo continua referenciando os PDFs: o trigger de DELETE desconta, aqui devolvemos
+        conn.execute(
+            """
+            UPDATE main.pdf_blobs
+            SET refcount = refcount + (
+                SELECT COUNT(*) FROM main.tarefas t
+                WHERE t.pdf_sha256 = pdf_blobs.sha256 AND t.id IN (SELECT id FROM temp.archive_ids)
+            )
+            WHERE sha256 IN (
+                SELECT pdf_sha256 FROM main.tarefas WHERE id IN (SELECT id FROM temp.archive_ids)
+            )
+            """
+        )
+        for table in ARCHIVED_TABLES:
+            key = "id" if table == "tarefas" else "task_id"
+            conn.execute(f"DELETE FROM main.{table} WHERE {key} IN (SELECT id FROM temp.archive_ids)")
+        stats = conn.execute("SELECT MIN(id), MAX(id), COUNT(*) FROM arc.tarefas").fetchone()
+        index = archive_index(conn)
+        index[year] = {
+            "min_id": int(stats[0]),
+            "max_id": int(stats[1]),
+            "tarefas": int(stats[2]),
+            "archived_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        conn.execute(
+            """
+            INSERT INTO main.app_settings (key, value, updated_at) VALUES (?, ?, datetime('now'))
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            """,
+            (ARCHIVE_INDEX_KEY, json.dumps({str(k): v for k, v in sorted(index.items())})),
+        )
+        conn.commit()
+        conn.execute("DETACH DATABASE arc")
+        if vacuum:
+            conn.execute("VACUUM")
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return summary
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .db import DB_PATH, get_data_dir
+from .repositories import SettingsRepository
+
+# Copia online do app.db pela API de backup do SQLite, em passos curtos com pausa entre eles
+# para nao segurar o banco. Cada geracao vira <data_dir>/backups/app-AAAAMMDD-HHMMSS.db.gz.
+BACKUP_DIRNAME = "backups"
+BACKUP_PREFIX = "app-"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+PAGES_PER_STEP = max(1, _env_int("FISCAL_BACKUP_PAGES_PER_STEP", 1024))
+STEP_SLEEP_S = max(0.0, _env_float("FISCAL_BACKUP_STEP_SLEEP_MS", 20) / 1000)
+KEEP_GENERATIONS = max(1, _env_int("FISCAL_BACKUP_KEEP", 7))
+# Cada escrita de outra conexao reinicia a copia; depois de tantos reinicios o resto vai num passo so
+# (em WAL esse passo e uma leitura de snapshot e nao bloqueia quem escreve)
+MAX_RESTARTS = 3
+# Um backup "running" mais velho que isso e de um processo que morreu
+STALE_AFTER = timedelta(hours=6)
+
+_LOCK = threading.Lock()
+
+
+def backup_dir() -> Path:
+    path = get_data_dir() / BACKUP_DIRNAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _generations() -> List[Path]:
+    # mais nova primeiro
+    return sorted(backup_dir().glob(f"{BACKUP_PREFIX}*.db.gz"), key=lambda p: (p.stat().st_mtime, p.name), reverse=True)
+
+
+def list_generations() -> List[Dict[str, object]]:
+    items = []
+    for path in _generations():
+        stat = path.stat()
+        created = datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds")
+        items.append({"file": path.name, "bytes": stat.st_size, "created_at": created})
+    return items
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy_online(
+    target: Path, pages: int, sleep_s: float, progress: Optional[Callable[[Dict[str, int]], None]]
+) -> Dict[str, int]:
+    stats = {"steps": 0, "restarts": 0, "pages": 0, "single_step": 0}
+    last = {"remaining": -1}
+
+    def on_step(status: int, remaining: int, total: int) -> None:
+        stats["steps"] += 1
+        stats["pages"] = total
+        # remaining voltou a crescer: outra conexao escreveu e o SQLite recomecou a copia
+        if 0 <= last["remaining"] < remaining:
+            stats["restarts"] += 1
+            if stats["restarts"] >= MAX_RESTARTS:
+                raise _TooManyRestarts()
+        last["remaining"] = remaining
+        if progress:
+            progress({"remaining": remaining, "total": total, **stats})
+        if remaining and sleep_s:
+            # pausa fora do passo: nenhum lock do banco de origem fica preso aqui
+            time.sleep(sleep_s)
+
+    src = sqlite3.connect(DB_PATH, uri=True)
+    try:
+        dst = sqlite3.connect(str(target))
+        try:
+            src.backup(dst, pages=pages, progress=on_step)
+            # a copia herda o modo WAL da origem; o arquivo de backup deve ser autocontido
+            dst.execute("PRAGMA journal_mode=DELETE")
+            return stats
+        except _TooManyRestarts:
+            pass
+        finally:
+            dst.close()
+        target.unlink(missing_ok=True)
+        stats["single_step"] = 1
+        dst = sqlite3.connect(str(target))
+        try:
+            src.backup(dst, pages=-1)
+            dst.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            dst.close()
+        return stats
+    finally:
+        src.close()
+
+
+def _verify(path: Path) -> str:
+    conn = sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    return "; ".join(str(r[0]) for r in rows[:10])
+
+
+def _compress(path: Path, level: int) -> Path:
+    target = path.with_name(path.name + ".gz")
+    tmp = target.with_name(target.name + ".tmp")
+    with path.open("rb") as src, gzip.open(tmp, "wb", compresslevel=level) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp, target)
+    path.unlink()
+    return target
+
+
+def _prune(keep: int) -> List[str]:
+    removed = []
+    for path in _generations()[keep:]:
+        path.unlink(missing_ok=True)
+        removed.append(path.name)
+    return removed
+
+
+def _sync_files(source: Path, target: Path, pattern: str) -> int:
+    # PDFs (nome = sha256) e arquivos anuais nao mudam depois de escritos: copia so o que falta ou mudou
+    copied = 0
+    if not source.is_dir():
+        return copied
+    for path in source.rglob(pattern):
+        if path.name.startswith(".tmp-"):
+            continue
+        dest = target / path.relative_to(source)
+        stat = path.stat()
+        if dest.exists() and dest.stat().st_size == stat.st_size and dest.stat().st_mtime >= stat.st_mtime:
+            continue
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(path, dest)
+        copied += 1
+    return copied
+
+
+def run_backup(
+    *,
+    pages_per_step: int = PAGES_PER_STEP,
+    sleep_s: float = STEP_SLEEP_S,
+    keep: int = KEEP_GENERATIONS,
+    compress_level: int = 6,
+    with_files: bool = True,
+    progress: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> Dict[str, object]:
+    """Gera uma geracao de backup: copia online, integrity_check na copia, gzip e rotacao.
+
+    with_files tambem espelha o armazenamento de PDFs e os arquivos anuais em backups/ (incremental).
+    """
+    if not _LOCK.acquire(blocking=False):
+        raise RuntimeError("Backup ja em andamento")
+    settings = SettingsRepository()
+    try:
+        # _LOCK so cobre este processo; entre workers/CLI quem reserva e o upsert condicional em backup_status
+        now = datetime.now()
+        if not settings.claim_backup(
+            now.isoformat(timespec="seconds"), (now - STALE_AFTER).isoformat(timespec="seconds")
+        ):
+            raise RuntimeError("Backup ja em andamento")
+        started = time.perf_counter()
+        stamp = f"{BACKUP_PREFIX}{datetime.now():%Y%m%d-%H%M%S}"
+        target = backup_dir() / f"{stamp}.db"
+        seq = 1
+        while target.exists() or target.with_name(target.name + ".gz").exists():
+            target = backup_dir() / f"{stamp}-{seq}.db"
+            seq += 1
+        result: Dict[str, object] = {"file": None, "ok": False}
+        try:
+            copy_stats = _copy_online(target, max(1, int(pages_per_step)), max(0.0, float(sleep_s)), progress)
+            copy_s = time.perf_counter() - started
+            integrity = _verify(target)
+            if integrity != "ok":
+                target.unlink(missing_ok=True)
+                raise RuntimeError(f"integrity_check falhou na copia: {integrity}")
+            db_bytes = target.stat().st_size
+            final = _compress(target, compress_level)
+            files = {}
+            if with_files:
+                data_dir = get_data_dir()
+                files = {
+                    "pdfs": _sync_files(data_dir / "pdfs", backup_dir() / "pdfs", "*.pdf"),
+                    "archive": _sync_files(data_dir / "archive", backup_dir() / "archive", "*.db"),
+                }
+            result = {
+                "ok": True,
+                "file": final.name,
+                "db_bytes": db_bytes,
+                "gz_bytes": final.stat().st_size,
+                "copy_s": round(copy_s, 3),
+                "elapsed_s": round(time.perf_counter() - started, 3),
+                "integrity": integrity,
+                "files_copied": files,
+                "pruned": _prune(max(1, int(keep))),
+                **copy_stats,
+            }
+            return result
+        except Exception as exc:
+            target.unlink(missing_ok=True)
+            result = {"ok": False, "error": str(exc), "elapsed_s": round(time.perf_counter() - started, 3)}
+            raise
+        finally:
+            result["finished_at"] = datetime.now().isoformat(timespec="seconds")
+            settings.set_backup_status({"running": False, "last": result})
+    finally:
+        _LOCK.release()
+
+
+def start_backup_thread(**kwargs: object) -> bool:
+    """Dispara run_backup em segundo plano (endpoint admin). False se ja ha um backup neste processo."""
+    if _LOCK.locked():
+        return False
+
+    def worker() -> None:
+        try:
+            run_backup(**kwargs)  # type: ignore[arg-type]
+        except Exception:
+            pass  # resultado e erro ficam em backup_status
+
+    threading.Thread(target=worker, name="fiscal-backup", daemon=True).start()
+    return True
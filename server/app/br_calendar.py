@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import FrozenSet
+
+# Feriados nacionais e dias uteis: vencimentos da sincronizacao mensal e janela do resumo diario (app.digest).
+
+
+def easter_sunday(year: int) -> date:
+    # Meeus/Jones/Butcher
+    a = year % 19
+    b = year // 100
+    c = year % 100
+    d = b // 4
+    e = b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i = c // 4
+    k = c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    day = ((h + l - 7 * m + 114) % 31) + 1
+    return date(year, month, day)
+
+
+@lru_cache(maxsize=16)
+def br_holidays(year: int) -> FrozenSet[date]:
+    easter = easter_sunday(year)
+    fixed = {
+        date(year, 1, 1),
+        date(year, 4, 21),
+        date(year, 5, 1),
+        date(year, 9, 7),
+        date(year, 10, 12),
+        date(year, 11, 2),
+        date(year, 11, 15),
+        date(year, 12, 25),
+    }
+    movable = {
+        easter - timedelta(days=48),  # carnaval (seg)
+        easter - timedelta(days=47),  # carnaval (ter)
+        easter - timedelta(days=2),   # sexta-feira santa
+        easter + timedelta(days=60),  # corpus christi
+    }
+    return frozenset(fixed | movable)
+
+
+def is_business_day(dt: date) -> bool:
+    return dt.weekday() < 5 and dt not in br_holidays(dt.year)
+
+
+def prev_business_day(dt: date, holidays: FrozenSet[date]) -> date:
+    out = dt
+    while out.weekday() >= 5 or out in holidays:
+        out -= timedelta(days=1)
+    return out
+
+
+def add_business_days(dt: date, days: int) -> date:
+    """Data `days` dias uteis depois de dt (fim de semana e feriado nao contam)."""
+    out = dt
+    left = max(0, int(days))
+    while left:
+        out += timedelta(days=1)
+        if is_business_day(out):
+            left -= 1
+    return out
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import re
+from typing import Optional
+
+
+_DIGITS_RE = re.compile(r"\D+")
+
+
+def only_digits(value: str) -> str:
+    return _DIGITS_RE.sub("", value or "")
+
+
+def normalize_cnpj(value: str) -> Optional[str]:
+    digits = only_digits(value)
+    return digits if len(digits) == 14 else None
+
+
+_CNPJ_WEIGHTS_1 = (5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+_CNPJ_WEIGHTS_2 = (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+
+
+def _cnpj_check_digit(digits: str, weights: tuple) -> str:
+    rest = sum(int(d) * w for d, w in zip(digits, weights)) % 11
+    return "0" if rest < 2 else str(11 - rest)
+
+
+def is_valid_cnpj(value: str) -> bool:
+    digits = only_digits(value)
+    if len(digits) != 14 or digits == digits[0] * 14:
+        return False
+    first = _cnpj_check_digit(digits[:12], _CNPJ_WEIGHTS_1)
+    second = _cnpj_check_digit(digits[:12] + first, _CNPJ_WEIGHTS_2)
+    return digits[12:] == first + second
+
+
+def normalize_competencia(value: str) -> Optional[str]:
+    """AAAAMM a partir de AAAAMM ou MM/AAAA (formato digitado a mao)."""
+    raw = (value or "").strip()
+    if re.fullmatch(r"\d{4}(0[1-9]|1[0-2])", raw):
+        return raw
+    m = re.fullmatch(r"(0[1-9]|1[0-2])[/-](\d{4})", raw)
+    return f"{m.group(2)}{m.group(1)}" if m else None
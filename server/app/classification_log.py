@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import date
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from .db import get_data_dir
+
+# Segmentos JSONL append-only em <data_dir>/classificacoes. Cada processo escreve no seu
+# proprio segmento (pid no nome), rotacionado por dia e por tamanho.
+LOG_DIRNAME = "classificacoes"
+SEGMENT_PREFIX = "classificacoes"
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    return raw.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+MAX_SEGMENT_BYTES = max(1, _env_int("FISCAL_CLASSIFICATION_LOG_MAX_MB", 16)) * 1024 * 1024
+COMPRESS_CLOSED = _env_flag("FISCAL_CLASSIFICATION_LOG_GZIP", True)
+# Compatibilidade: um JSON por upload, como antes (desligado por padrao)
+WRITE_JSON_FILES = _env_flag("FISCAL_CLASSIFICATION_JSON_FILES", False)
+
+_RX_SEGMENT = re.compile(rf"^{SEGMENT_PREFIX}-(\d{{8}})-(\d+)-(\d+)\.jsonl(\.gz)?$")
+
+
+def _log_dir() -> Path:
+    path = get_data_dir() / LOG_DIRNAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _gzip_segment(path: Path) -> None:
+    target = path.with_name(path.name + ".gz")
+    tmp = target.with_name(target.name + ".tmp")
+    with path.open("rb") as src, gzip.open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp, target)
+    path.unlink()
+
+
+class SegmentLog:
+    def __init__(self, directory: Path, max_bytes: int = MAX_SEGMENT_BYTES, compress: bool = COMPRESS_CLOSED):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._fh = None
+        self._name: Optional[str] = None
+        self._day: Optional[str] = None
+        self._size = 0
+
+    def _open_next(self, day: str) -> None:
+        pid = os.getpid()
+        seq = 0
+        for path in self.directory.glob(f"{SEGMENT_PREFIX}-{day}-{pid}-*.jsonl*"):
+            m = _RX_SEGMENT.match(path.name)
+            if m:
+                seq = max(seq, int(m.group(3)) + 1)
+        name = f"{SEGMENT_PREFIX}-{day}-{pid}-{seq:04d}.jsonl"
+        self._fh = (self.directory / name).open("ab")
+        self._name = name
+        self._day = day
+        self._size = self._fh.tell()
+
+    def _close_current(self) -> None:
+        if self._fh is None:
+            return
+        self._fh.close()
+        closed = self.directory / str(self._name)
+        self._fh = None
+        self._name = None
+        if self.compress:
+            threading.Thread(target=_gzip_segment, args=(closed,), daemon=True).start()
+
+    def append(self, entry: Dict[str, Any]) -> Tuple[str, int]:
+        """Grava uma linha e devolve (segmento, offset) para o indice por tarefa."""
+        line = (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        day = date.today().strftime("%Y%m%d")
+        with self._lock:
+            if self._fh is not None and (self._day != day or self._size + len(line) > self.max_bytes):
+                self._close_current()
+            if self._fh is None:
+                self._open_next(day)
+            offset = self._size
+            self._fh.write(line)
+            self._fh.flush()
+            self._size += len(line)
+            return str(self._name), offset
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_current()
+
+
+_LOG: Optional[SegmentLog] = None
+_LOG_LOCK = threading.Lock()
+
+
+def _get_log() -> SegmentLog:
+    global _LOG
+    with _LOG_LOCK:
+        if _LOG is None:
+            _LOG = SegmentLog(_log_dir())
+        return _LOG
+
+
+def record_classification(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Acrescenta a classificacao ao log; com FISCAL_CLASSIFICATION_JSON_FILES grava tambem o JSON avulso."""
+    segment, offset = _get_log().append(data)
+    ref: Dict[str, Any] = {"log_segment": segment, "log_offset": offset, "json_path": None}
+    if WRITE_JSON_FILES:
+        from .classifier import save_classification_json
+
+        ref["json_path"] = save_classification_json(data)
+    return ref
+
+
+def _open_segment(segment: str) -> Optional[BinaryIO]:
+    # O .gz surge (os.replace) antes do .jsonl sumir: tentar .gz, depois o original, depois .gz de novo
+    # cobre a compressao acontecendo em paralelo.
+    base = _log_dir() / segment
+    gz = base.with_name(base.name + ".gz")
+    for path in (gz, base, gz):
+        try:
+            return gzip.open(path, "rb") if path is gz else path.open("rb")  # type: ignore[return-value]
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def read_entry(segment: str, offset: int) -> Optional[Dict[str, Any]]:
+    return read_entries([(segment, offset)])[0]
+
+
+def read_entries(refs: List[Tuple[str, int]]) -> List[Optional[Dict[str, Any]]]:
+    """Le varias entradas agrupando por segmento (um open por arquivo, offsets em ordem).
+
+    O resultado segue a ordem de refs; entrada ausente (segmento apagado) vem como None.
+    """
+    by_segment: Dict[str, List[Tuple[int, int]]] = {}
+    for idx, (segment, offset) in enumerate(refs):
+        by_segment.setdefault(segment, []).append((int(offset), idx))
+    found: Dict[int, Dict[str, Any]] = {}
+    for segment, items in by_segment.items():
+        fh = _open_segment(segment)
+        if fh is None:
+            continue
+        with fh:
+            # em .gz o seek descomprime ate o offset; offsets em ordem fazem um unico passe
+            for offset, idx in sorted(items):
+                fh.seek(offset)
+                try:
+                    found[idx] = json.loads(fh.readline().decode("utf-8"))
+                except ValueError:
+                    continue
+    return [found.get(i) for i in range(len(refs))]
+
+
+def iter_segments() -> Iterator[Path]:
+    for path in sorted(_log_dir().iterdir()):
+        if _RX_SEGMENT.match(path.name):
+            yield path
+
+
+def compress_closed_segments() -> int:
+    """Comprime segmentos de dias anteriores que ficaram abertos (processo encerrado antes de rotacionar)."""
+    today = date.today().strftime("%Y%m%d")
+    done = 0
+    for path in iter_segments():
+        m = _RX_SEGMENT.match(path.name)
+        if m and not m.group(4) and m.group(1) < today:
+            _gzip_segment(path)
+            done += 1
+    return done
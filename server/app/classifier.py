@@ -1,14 +1,25 @@
 from __future__ import annotations
 
 import json
+import os
 import re
+import sqlite3
+import threading
+import time
 import unicodedata
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Callable, Iterable, List, Tuple
 
-from .db import get_data_dir
+from .db import CLASSIFIER_VERSION_KEY, _connect, get_data_dir, get_db_path
+
+
+_RX_NON_ALNUM = re.compile(r"[^A-Z0-9]+")
+_RX_SPACES = re.compile(r"\s+")
+_RX_COMPETENCIA_SEP = re.compile(r"\b(\d{2})[-/](\d{4})\b")
+_RX_COMPETENCIA_JOINED = re.compile(r"\b(\d{2})(\d{4})\b")
+_RX_NAME_PARTS = re.compile(r"\s*-\s*")
 
 
 def _normalize(text: str) -> str:
@@ -16,22 +27,51 @@ def _normalize(text: str) -> str:
     text = unicodedata.normalize("NFD", text)
     text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
     text = text.upper()
-    text = re.sub(r"[^A-Z0-9]+", " ", text)
-    text = re.sub(r"\s+", " ", text).strip()
+    text = _RX_NON_ALNUM.sub(" ", text)
+    text = _RX_SPACES.sub(" ", text).strip()
     return text
 
 
 def _parse_competencia(raw: str) -> Optional[str]:
     if not raw:
         return None
-    m = re.search(r"\b(\d{2})[-/](\d{4})\b", raw)
+    m = _RX_COMPETENCIA_SEP.search(raw)
     if not m:
-        m = re.search(r"\b(\d{2})(\d{4})\b", raw)
+        m = _RX_COMPETENCIA_JOINED.search(raw)
     if not m:
         return None
     return f"{m.group(1)}/{m.group(2)}"
 
 
+_RX_PLAIN_SEQUENCE = re.compile(r"(?:\\b|\\s\+|[A-Z0-9]+)+")
+_RX_LITERAL = re.compile(r"[A-Z0-9]+")
+
+
+class _PriorityTable:
+    """Lista ordenada de regex compiladas uma vez; a primeira que casa vence.
+
+    Regex que sao so literais separados por \\b/\\s+ ganham uma ancora (o maior literal):
+    se ela nao aparece no texto a regex nem roda. O resultado e o mesmo do loop com re.search.
+    """
+
+    def __init__(self, alternatives: List[str]):
+        self._entries: List[Tuple[Optional[str], "re.Pattern[str]"]] = []
+        for rx in alternatives:
+            anchor = None
+            literals = _RX_LITERAL.findall(rx) if _RX_PLAIN_SEQUENCE.fullmatch(rx) else []
+            if literals:
+                anchor = max(literals, key=len)
+            self._entries.append((anchor, re.compile(rx)))
+
+    def first(self, text: str) -> Optional[int]:
+        for idx, (anchor, compiled) in enumerate(self._entries):
+            if anchor is not None and anchor not in text:
+                continue
+            if compiled.search(text):
+                return idx
+        return None
+
+
 @dataclass(frozen=True)
 class Pattern:
     name: str
@@ -82,18 +122,161 @@ PATTERNS: List[Pattern] = [
 ]
 
 
+class PatternMatcher:
+    """PATTERNS compilado uma vez; a prioridade continua sendo a ordem da lista."""
+
+    def __init__(self, patterns: List[Pattern]):
+        self.patterns = list(patterns)
+        owners: List[int] = []
+        alternatives: List[str] = []
+        for idx, pat in enumerate(self.patterns):
+            for rx in pat.patterns:
+                owners.append(idx)
+                alternatives.append(rx)
+        self._owners = owners
+        self._table = _PriorityTable(alternatives)
+
+    def match(self, text_norm: str) -> Optional[Pattern]:
+        hit = self._table.first(text_norm)
+        return self.patterns[self._owners[hit]] if hit is not None else None
+
+
+_MATCHER = PatternMatcher(PATTERNS)
+_MATCHER_LOCK = threading.Lock()
+# So o contador de consultas: o caminho rapido de _current_matcher nao espera a recompilacao
+_STATS_LOCK = threading.Lock()
+_MATCHER_VERSION: Optional[int] = None
+_MATCHER_CHECKED_AT = 0.0
+# Intervalo minimo entre consultas da versao no banco (lotes chamam o matcher milhares de vezes)
+PATTERNS_CHECK_SECONDS = max(0.0, float(os.environ.get("FISCAL_PATTERNS_CHECK_SECONDS", "2") or 0))
+_RELOAD_STATS: Dict[str, Any] = {
+    "source": "builtin",
+    "version": None,
+    "patterns": len(PATTERNS),
+    "compile_ms": None,
+    "loaded_at": None,
+    "reloads": 0,
+    "lookups": 0,
+    "errors": [],
+}
+
+
+def compile_pattern_rows(rows: Iterable[Dict[str, Any]]) -> Tuple[List[Pattern], List[str]]:
+    """Converte linhas de classifier_patterns em Pattern; regex invalida descarta a linha e vira erro."""
+    patterns: List[Pattern] = []
+    errors: List[str] = []
+    for row in rows:
+        try:
+            raw = row.get("patterns")
+            regexes = json.loads(raw) if isinstance(raw, str) else list(raw or [])
+            if not regexes or not all(isinstance(rx, str) and rx for rx in regexes):
+                raise ValueError("lista de regex vazia")
+            for rx in regexes:
+                re.compile(rx)
+        except (TypeError, ValueError, re.error) as exc:
+            errors.append(f"{row.get('name')}: {exc}")
+            continue
+        patterns.append(
+            Pattern(
+                str(row["name"]),
+                str(row["tipo"]),
+                str(row["grupo"]),
+                str(row["orgao"]),
+                str(row["tributo"]),
+                row.get("subgrupo") or None,
+                regexes,
+            )
+        )
+    return patterns, errors
+
+
+def _stored_version() -> Optional[int]:
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT value FROM app_settings WHERE key = ?", (CLASSIFIER_VERSION_KEY,)).fetchone()
+    finally:
+        conn.close()
+    return int(row["value"]) if row and row["value"] is not None else None
+
+
+def _load_stored_patterns() -> List[Dict[str, Any]]:
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            """
+            SELECT name, tipo, grupo, orgao, tributo, subgrupo, patterns
+            FROM classifier_patterns WHERE active = 1 ORDER BY position, id
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+
+def _current_matcher() -> PatternMatcher:
+    global _MATCHER, _MATCHER_VERSION, _MATCHER_CHECKED_AT
+    with _STATS_LOCK:
+        _RELOAD_STATS["lookups"] += 1
+    now = time.monotonic()
+    if now - _MATCHER_CHECKED_AT < PATTERNS_CHECK_SECONDS:
+        return _MATCHER
+    with _MATCHER_LOCK:
+        if now - _MATCHER_CHECKED_AT < PATTERNS_CHECK_SECONDS:
+            return _MATCHER
+        _MATCHER_CHECKED_AT = now
+        if not Path(get_db_path()).exists():
+            return _MATCHER
+        try:
+            version = _stored_version()
+            if version is None or version == _MATCHER_VERSION:
+                return _MATCHER
+            started = time.perf_counter()
+            patterns, errors = compile_pattern_rows(_load_stored_patterns())
+            matcher = PatternMatcher(patterns)
+        except sqlite3.Error:
+            # Banco ainda sem a tabela (ou indisponivel): segue com o matcher atual
+            return _MATCHER
+        _MATCHER = matcher
+        _MATCHER_VERSION = version
+        _RELOAD_STATS.update(
+            source="db",
+            version=version,
+            patterns=len(patterns),
+            compile_ms=round((time.perf_counter() - started) * 1000, 3),
+            loaded_at=datetime.now().isoformat(timespec="seconds"),
+            reloads=int(_RELOAD_STATS["reloads"]) + 1,
+            errors=errors,
+        )
+        return _MATCHER
+
+
+def current_patterns() -> List[Pattern]:
+    return list(_current_matcher().patterns)
+
+
+def matcher_stats() -> Dict[str, Any]:
+    """Estado do matcher deste processo (versao carregada, tempo da ultima compilacao, recargas)."""
+    _current_matcher()
+    return {**_RELOAD_STATS, "errors": list(_RELOAD_STATS["errors"])}
+
+
+_RX_ACTION_APURACAO = re.compile(r"\bAPUR")
+_RX_ACTION_GUIA = re.compile(r"\bGUIA\b|\bGR\b|\bGA\b|\bDARE\b|\bDAE\b|\bDUA\b|\bGRPR\b|\bDARF\b|\bGNRE\b|\bDAS\b")
+_SUBTIPO_KEYS = ["GRPR", "GR", "GA", "DARE", "DAE", "DUA", "DCTFWEB", "GNRE", "DARF"]
+_SUBTIPO_TABLE = _PriorityTable([rf"\b{key}\b" for key in _SUBTIPO_KEYS])
+_RX_SUBTIPO_PIS = re.compile(r"\bDARF\s+PIS\b")
+_RX_SUBTIPO_COFINS = re.compile(r"\bDARF\s+COFINS\b")
+_RX_TRIMESTRE = re.compile(r"\b([1-4])\s+TRIMESTRE\b")
+
+
 def _match_pattern(text_norm: str) -> Optional[Pattern]:
-    for pat in PATTERNS:
-        for rx in pat.patterns:
-            if re.search(rx, text_norm):
-                return pat
-    return None
+    return _current_matcher().match(text_norm)
 
 
 def _infer_action(text_norm: str, tipo: Optional[str]) -> Optional[str]:
-    if re.search(r"\bAPUR", text_norm):
+    if _RX_ACTION_APURACAO.search(text_norm):
         return "APURACAO"
-    if re.search(r"\bGUIA\b|\bGR\b|\bGA\b|\bDARE\b|\bDAE\b|\bDUA\b|\bGRPR\b|\bDARF\b|\bGNRE\b|\bDAS\b", text_norm):
+    if _RX_ACTION_GUIA.search(text_norm):
         return "GUIA"
     if tipo == "ACS":
         return "ENTREGA"
@@ -101,44 +284,56 @@ def _infer_action(text_norm: str, tipo: Optional[str]) -> Optional[str]:
 
 
 def _infer_subtipo(text_norm: str) -> Optional[str]:
-    for key in ["GRPR", "GR", "GA", "DARE", "DAE", "DUA", "DCTFWEB", "GNRE", "DARF"]:
-        if re.search(rf"\b{key}\b", text_norm):
-            return key
-    if re.search(r"\bDARF\s+PIS\b", text_norm):
+    hit = _SUBTIPO_TABLE.first(text_norm)
+    if hit is not None:
+        return _SUBTIPO_KEYS[hit]
+    if _RX_SUBTIPO_PIS.search(text_norm):
         return "PIS"
-    if re.search(r"\bDARF\s+COFINS\b", text_norm):
+    if _RX_SUBTIPO_COFINS.search(text_norm):
         return "COFINS"
     return None
 
 
 def _infer_trimestre(text_norm: str) -> Optional[str]:
-    m = re.search(r"\b([1-4])\s+TRIMESTRE\b", text_norm)
+    m = _RX_TRIMESTRE.search(text_norm)
     if not m:
         return None
     return f"TRIMESTRE_{m.group(1)}"
 
 
+_Inferred = Tuple[Optional[Pattern], Optional[str], Optional[str]]
+
+
+def _infer(tarefa_norm: str) -> _Inferred:
+    pattern = _match_pattern(tarefa_norm)
+    acao = _infer_action(tarefa_norm, pattern.tipo if pattern else None)
+    subtipo = _infer_subtipo(tarefa_norm)
+    trimestre = _infer_trimestre(tarefa_norm)
+    if trimestre and ((pattern.subgrupo if pattern else None) or "").startswith("TRIMESTRAL"):
+        subtipo = trimestre
+    return pattern, acao, subtipo
+
+
 def classify_filename(filename: str) -> Dict[str, Any]:
+    return _classify(filename, _infer)
+
+
+def _classify(filename: str, infer: Callable[[str], _Inferred]) -> Dict[str, Any]:
     name = Path(filename).stem
-    parts = [p.strip() for p in re.split(r"\s*-\s*", name) if p.strip()]
+    parts = [p.strip() for p in _RX_NAME_PARTS.split(name) if p.strip()]
     competencia_raw = parts[0] if len(parts) >= 2 else ""
     tarefa_raw = parts[1] if len(parts) >= 2 else (parts[0] if parts else "")
     empresa = " - ".join(parts[2:]) if len(parts) >= 3 else ""
 
     competencia = _parse_competencia(competencia_raw) or _parse_competencia(name)
     tarefa_norm = _normalize(tarefa_raw)
-    pattern = _match_pattern(tarefa_norm)
+    pattern, acao, subtipo = infer(tarefa_norm)
 
     tipo = pattern.tipo if pattern else None
     grupo = pattern.grupo if pattern else None
     subgrupo = pattern.subgrupo if pattern else None
     orgao = pattern.orgao if pattern else None
     tributo = pattern.tributo if pattern else None
-    acao = _infer_action(tarefa_norm, tipo)
-    subtipo = _infer_subtipo(tarefa_norm)
-    trimestre = _infer_trimestre(tarefa_norm)
-    if trimestre and (subgrupo or "").startswith("TRIMESTRAL"):
-        subtipo = trimestre
 
     confianca = 0.0
     if pattern:
@@ -162,6 +357,19 @@ def classify_filename(filename: str) -> Dict[str, Any]:
     }
 
 
+def classify_many(filenames: Iterable[str]) -> List[Dict[str, Any]]:
+    """Classifica um lote; o mesmo trecho de tarefa so passa pelo matcher uma vez por lote."""
+    cache: Dict[str, _Inferred] = {}
+
+    def infer(tarefa_norm: str) -> _Inferred:
+        hit = cache.get(tarefa_norm)
+        if hit is None:
+            hit = cache[tarefa_norm] = _infer(tarefa_norm)
+        return hit
+
+    return [_classify(name, infer) for name in filenames]
+
+
 def save_classification_json(data: Dict[str, Any]) -> str:
     base_dir = get_data_dir() / "classificacoes"
     base_dir.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from .classifier import _infer_action, _normalize, current_patterns
+
+if TYPE_CHECKING:
+    # text_scan importa CONTENT_PROFILES deste modulo
+    from .text_scan import ScanResult
+
+# Termos (ja normalizados, sem acento e sem stopwords) e codigos de receita por padrao do
+# classificador. A chave e Pattern.name: o resultado herda tipo/grupo/orgao/subgrupo do padrao.
+CONTENT_PROFILES: Dict[str, Dict[str, Any]] = {
+    "DARF PIS": {"terms": {"PIS": 2.0, "PASEP": 2.0, "DARF": 0.5}, "codes": ["8109", "6912"]},
+    "DARF COFINS": {"terms": {"COFINS": 2.5, "DARF": 0.5}, "codes": ["2172", "5856"]},
+    "DARF IRPJ": {"terms": {"IRPJ": 2.5, "IMPOSTO RENDA PESSOA JURIDICA": 1.5, "DARF": 0.5}, "codes": ["2089", "2362"]},
+    "DARF CSLL": {"terms": {"CSLL": 2.5, "CONTRIBUICAO SOCIAL LUCRO": 1.5, "DARF": 0.5}, "codes": ["2372", "2484"]},
+    "DARF IRRF": {"terms": {"IRRF": 2.5, "RETIDO FONTE": 1.5, "DARF": 0.5}, "codes": ["0561", "1708", "0588", "3208"]},
+    "DARF CSRF": {"terms": {"CSRF": 2.5, "RETENCAO PIS COFINS CSLL": 1.5, "DARF": 0.5}, "codes": ["5952"]},
+    "DARF IPI": {"terms": {"IPI": 2.5, "PRODUTOS INDUSTRIALIZADOS": 1.5, "DARF": 0.5}, "codes": ["5123"]},
+    "DARF INSS": {"terms": {"INSS": 2.0, "PREVIDENCIARIA": 1.0, "DARF": 0.5}, "codes": []},
+    "ICMS": {"terms": {"ICMS": 2.0}, "codes": []},
+    "ICMS ST": {"terms": {"ICMS": 2.0, "SUBSTITUICAO TRIBUTARIA": 2.5, "ICMS ST": 2.0}, "codes": []},
+    "ICMS DIFAL": {"terms": {"ICMS": 2.0, "DIFAL": 2.5, "DIFERENCIAL ALIQUOTA": 2.5}, "codes": []},
+    "ISS": {"terms": {"ISS": 2.0, "ISSQN": 2.5, "SERVICOS QUALQUER NATUREZA": 2.0}, "codes": []},
+    "SPED FISCAL": {"terms": {"SPED FISCAL": 2.0, "EFD ICMS IPI": 2.5}, "codes": []},
+    "SPED CONTRIBUIÇÕES": {"terms": {"SPED CONTRIBUICOES": 2.0, "EFD CONTRIBUICOES": 2.5}, "codes": []},
+    "REINF": {"terms": {"REINF": 2.5}, "codes": []},
+    "MIT - DCTFWEB": {"terms": {"DCTFWEB": 2.5, "MIT": 1.0}, "codes": []},
+    "DESTDA": {"terms": {"DESTDA": 2.5}, "codes": []},
+    "DIME": {"terms": {"DIME": 2.5}, "codes": []},
+    "DAPI": {"terms": {"DAPI": 2.5}, "codes": []},
+    "GIA": {"terms": {"GIA": 2.5}, "codes": []},
+}
+
+CODE_WEIGHT = 3.0
+# Codigo de 4 digitos so pesa inteiro quando o documento fala em codigo/receita
+CODE_CONTEXT = {"RECEITA", "CODIGO"}
+MIN_SCORE = 2.0
+# Abaixo disso o conteudo nao substitui o resultado do nome do arquivo
+MIN_CONFIDENCE = 0.5
+# O nome casado vale 0.9/0.95 e o conteudo chega no maximo a 0.9: contra um nome que aponta outro
+# tributo, o conteudo so vence com codigo de receita e folga grande sobre o segundo padrao, e a
+# classificacao vai para revisao (FONTE_DIVERGENTE)
+STRONG_MARGIN = 0.6
+FONTE_DIVERGENTE = "divergente"
+# Campos que dependem do texto do PDF: o nome do arquivo sozinho nao refaz essas classificacoes
+CONTENT_FONTES = ("conteudo", "nome+conteudo", FONTE_DIVERGENTE)
+# Pontuacao do text_scan: uma data DD/MM/AAAA solta (vencimento, emissao) nao basta para a competencia
+MIN_COMPETENCIA_SCORE = 1.0
+
+_STOPWORDS = {"DE", "DA", "DO", "DOS", "E", "A", "O", "NA", "NO", "EM", "SOBRE", "PARA"}
+_RX_TOKEN = re.compile(r"[A-Z0-9]+")
+
+
+def _tokens(text: str) -> List[str]:
+    # Versao rapida do _normalize para textos grandes: a faixa ASCII basta para o vocabulario
+    ascii_text = unicodedata.normalize("NFD", text or "").encode("ascii", "ignore").decode("ascii")
+    return [t for t in _RX_TOKEN.findall(ascii_text.upper()) if t not in _STOPWORDS]
+
+
+def _build_index() -> Tuple[Dict[str, List[Tuple[str, float]]], Dict[str, List[str]], Dict[str, List[str]]]:
+    # termo -> [(padrao, peso)], codigo -> [padrao], primeira palavra -> termos compostos
+    term_index: Dict[str, List[Tuple[str, float]]] = {}
+    code_index: Dict[str, List[str]] = {}
+    heads: Dict[str, List[str]] = {}
+    for name, profile in CONTENT_PROFILES.items():
+        for term, weight in profile["terms"].items():
+            key = " ".join(_tokens(term))
+            term_index.setdefault(key, []).append((name, float(weight)))
+            words = key.split()
+            if len(words) > 1:
+                heads.setdefault(words[0], []).append(key)
+        for code in profile["codes"]:
+            code_index.setdefault(code, []).append(name)
+    return term_index, code_index, heads
+
+
+_TERM_INDEX, _CODE_INDEX, _HEADS = _build_index()
+
+
+def score_text(text: str) -> Dict[str, Dict[str, Any]]:
+    """Pontuacao por padrao: soma de peso * (1 + ln(ocorrencias)) dos termos e codigos presentes."""
+    tokens = _tokens(text)
+    if not tokens:
+        return {}
+    counts = Counter(tokens)
+    # termos compostos: so olha as posicoes cuja palavra inicia algum termo
+    for i, tok in enumerate(tokens):
+        for term in _HEADS.get(tok, ()):
+            n = term.count(" ") + 1
+            if " ".join(tokens[i : i + n]) == term:
+                counts[term] += 1
+    code_weight = CODE_WEIGHT if CODE_CONTEXT.intersection(counts) else CODE_WEIGHT / 2
+    scores: Dict[str, Dict[str, Any]] = {}
+    for term in _TERM_INDEX.keys() & counts.keys():
+        boost = 1.0 + math.log(counts[term])
+        for name, weight in _TERM_INDEX[term]:
+            entry = scores.setdefault(name, {"score": 0.0, "termos": [], "codigos": []})
+            entry["score"] += weight * boost
+            entry["termos"].append(term)
+    for code in _CODE_INDEX.keys() & counts.keys():
+        for name in _CODE_INDEX[code]:
+            entry = scores.setdefault(name, {"score": 0.0, "termos": [], "codigos": []})
+            entry["score"] += code_weight
+            entry["codigos"].append(code)
+    return scores
+
+
+def _competencia(scan: "ScanResult") -> Optional[str]:
+    best = scan.best_competencia()
+    if best is None:
+        return None
+    score = max(c.score for c in scan.competencias if c.value == best)
+    # MM/AAAA, o formato de classify_filename
+    return f"{best[4:]}/{best[:4]}" if score >= MIN_COMPETENCIA_SCORE else None
+
+
+def classify_text(text: str, scan: Optional["ScanResult"] = None) -> Optional[Dict[str, Any]]:
+    """Melhor padrao e competencia (MM/AAAA) do texto extraido do PDF, ou None quando o texto nao decide nenhum.
+
+    scan e o scan_text do mesmo texto, quando quem chama ja o tem (o upload usa nas checagens de inconsistencia).
+    """
+    if text and scan is None:
+        from .text_scan import scan_text
+
+        scan = scan_text(text)
+    competencia = _competencia(scan) if text else None
+    scores = score_text(text)
+    patterns = {p.name: p for p in current_patterns()}
+    ranked = sorted(
+        ((name, entry) for name, entry in scores.items() if name in patterns),
+        key=lambda item: (-item[1]["score"], item[0]),
+    )
+    if not ranked or ranked[0][1]["score"] < MIN_SCORE:
+        if not competencia:
+            return None
+        # so a competencia: padrao fica com o nome do arquivo
+        return {
+            "pattern": None, "tipo": None, "grupo": None, "subgrupo": None, "orgao": None, "tributo": None,
+            "competencia": competencia, "score": 0.0, "margem": 0.0, "confianca": 0.0, "termos": [], "codigos": [],
+        }
+    name, best = ranked[0]
+    s1 = float(best["score"])
+    s2 = float(ranked[1][1]["score"]) if len(ranked) > 1 else 0.0
+    margin = (s1 - s2) / s1
+    strength = min(1.0, s1 / 6.0)
+    pattern = patterns[name]
+    return {
+        "pattern": name,
+        "tipo": pattern.tipo,
+        "grupo": pattern.grupo,
+        "subgrupo": pattern.subgrupo,
+        "orgao": pattern.orgao,
+        "tributo": pattern.tributo,
+        "competencia": competencia,
+        "score": round(s1, 3),
+        "margem": round(margin, 3),
+        "confianca": round(0.9 * (0.5 * margin + 0.5 * strength), 3),
+        "termos": sorted(best["termos"]),
+        "codigos": sorted(best["codigos"]),
+    }
+
+
+def merge_content(classification: Dict[str, Any], content: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Junta o resultado do nome do arquivo com o do conteudo; vence a maior confianca.
+
+    Conteudo mais confiante substitui os campos do padrao e a competencia; senao so preenche a competencia
+    que o nome nao trouxe. Conteudo forte (codigo de receita e STRONG_MARGIN) que discorda do nome tambem
+    vence, com fonte FONTE_DIVERGENTE.
+    """
+    merged = dict(classification)
+    merged["fonte"] = "nome" if merged.get("tributo") else None
+    if not content:
+        return merged
+    merged["conteudo"] = {
+        k: content[k] for k in ("tributo", "competencia", "confianca", "score", "margem", "termos", "codigos")
+    }
+    name_conf = float(merged.get("confianca") or 0)
+    content_conf = float(content["confianca"])
+    overrides = (
+        bool(merged.get("tributo"))
+        and bool(content["tributo"])
+        and merged["tributo"] != content["tributo"]
+        and bool(content["codigos"])
+        and float(content["margem"]) >= STRONG_MARGIN
+    )
+    wins = bool(content["tributo"]) and content_conf >= MIN_CONFIDENCE and (content_conf > name_conf or overrides)
+    if content["competencia"] and (wins or not merged.get("competencia")):
+        merged["competencia"] = content["competencia"]
+    if merged.get("tributo") and merged["tributo"] == content["tributo"]:
+        merged["fonte"] = "nome+conteudo"
+        merged["confianca"] = round(min(0.99, max(name_conf, content_conf) + 0.04), 3)
+        return merged
+    if not wins:
+        return merged
+    for key in ("tipo", "grupo", "subgrupo", "orgao", "tributo", "confianca"):
+        merged[key] = content[key]
+    merged["acao"] = merged.get("acao") or _infer_action(_normalize(merged.get("raw_text") or ""), content["tipo"])
+    merged["fonte"] = FONTE_DIVERGENTE if overrides else "conteudo"
+    return merged
+
+
+def review_status(tributo: Optional[str], fonte: Optional[str]) -> str:
+    """Status automatico: sem tributo, ou com nome e conteudo em conflito, vai para revisao."""
+    return "ok" if tributo and fonte != FONTE_DIVERGENTE else "needs_review"
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import json
 import os
 import sqlite3
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Callable, List, Optional
 
 
 def _default_data_dir() -> Path:
@@ -24,16 +26,120 @@ def get_db_path() -> str:
 
 
 def get_data_dir() -> Path:
-    data_dir = _default_data_dir()
+    override = os.environ.get("FISCAL_DATA_DIR")
+    data_dir = Path(override) if override else _default_data_dir()
     data_dir.mkdir(parents=True, exist_ok=True)
     return data_dir
 
 
 DB_PATH = get_db_path()
+# Espera por lock de escrita antes de devolver "database is locked"
+BUSY_TIMEOUT_S = max(0.0, float(os.environ.get("FISCAL_DB_BUSY_TIMEOUT_MS", "5000") or 0) / 1000)
+
+
+# Observadores de consultas (sql, parametros, segundos, linhas, conexao), chamados quando o comando termina:
+# apos o fetch para SELECT, ja que o SQLite so percorre a tabela enquanto as linhas sao lidas.
+# app.metrics conta consultas por requisicao; app.slow_queries guarda as lentas com o plano.
+QueryObserver = Callable[[str, object, float, int, sqlite3.Connection], None]
+_QUERY_OBSERVERS: List[QueryObserver] = []
+
+
+def add_query_observer(observer: QueryObserver) -> None:
+    if observer not in _QUERY_OBSERVERS:
+        _QUERY_OBSERVERS.append(observer)
+
+
+class _TimedCursor(sqlite3.Cursor):
+    # [sql, parametros, segundos ate aqui, linhas] do comando ainda nao reportado
+    _pending: Optional[list] = None
+
+    def _finish(self) -> None:
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        for observer in _QUERY_OBSERVERS:
+            try:
+                observer(pending[0], pending[1], pending[2], pending[3], self.connection)
+            except Exception:
+                pass
+
+    def _run(self, method: Callable[..., sqlite3.Cursor], sql: str, params: object, *args: object) -> "_TimedCursor":
+        self._finish()
+        if not _QUERY_OBSERVERS:
+            return method(*args)  # type: ignore[return-value]
+        started = time.perf_counter()
+        try:
+            method(*args)
+        finally:
+            self._pending = [sql, params, time.perf_counter() - started, 0]
+            if self.description is None:
+                # sem linhas para ler (INSERT/UPDATE/DDL ou erro): ja terminou
+                self._pending[3] = max(0, self.rowcount)
+                self._finish()
+        return self
+
+    def _fetch(self, method: Callable[..., object], *args: object) -> object:
+        pending = self._pending
+        if pending is None:
+            return method(*args)
+        started = time.perf_counter()
+        result = method(*args)
+        pending[2] += time.perf_counter() - started
+        if isinstance(result, list):
+            pending[3] += len(result)
+        elif result is not None:
+            pending[3] += 1
+        self._finish()
+        return result
+
+    def execute(self, sql: str, parameters: object = (), /) -> "_TimedCursor":  # type: ignore[override]
+        return self._run(super().execute, sql, parameters, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: object, /) -> "_TimedCursor":  # type: ignore[override]
+        return self._run(super().executemany, sql, None, sql, seq_of_parameters)
+
+    def executescript(self, sql_script: str, /) -> "_TimedCursor":  # type: ignore[override]
+        return self._run(super().executescript, sql_script, None, sql_script)
+
+    def fetchone(self) -> object:
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size: int = -1) -> list:  # type: ignore[override]
+        return self._fetch(super().fetchmany, size if size >= 0 else self.arraysize)  # type: ignore[return-value]
+
+    def fetchall(self) -> list:  # type: ignore[override]
+        return self._fetch(super().fetchall)  # type: ignore[return-value]
+
+    def close(self) -> None:
+        self._finish()
+        super().close()
+
+    def __del__(self) -> None:
+        # cursor iterado com "for row in cur" ou descartado sem fetch
+        self._finish()
+
+
+class _TimedConnection(sqlite3.Connection):
+    # Os atalhos conn.execute* do modulo C nao passam por cursor(); aqui passam, e tudo cai em _TimedCursor
+    def cursor(self, factory: Callable[..., sqlite3.Cursor] = _TimedCursor) -> sqlite3.Cursor:  # type: ignore[override]
+        return super().cursor(factory)
 
+    def execute(self, sql: str, parameters: object = (), /) -> sqlite3.Cursor:  # type: ignore[override]
+        return self.cursor().execute(sql, parameters)  # type: ignore[arg-type]
 
-def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+    def executemany(self, sql: str, seq_of_parameters: object, /) -> sqlite3.Cursor:  # type: ignore[override]
+        return self.cursor().executemany(sql, seq_of_parameters)  # type: ignore[arg-type]
+
+    def executescript(self, sql_script: str, /) -> sqlite3.Cursor:  # type: ignore[override]
+        return self.cursor().executescript(sql_script)
+
+
+def _connect(*, check_same_thread: bool = True) -> sqlite3.Connection:
+    # uri=True permite anexar arquivos de anos arquivados em modo somente leitura (app.archive).
+    # check_same_thread=False so para cursor lido aos poucos por threads do pool (exportacao em streaming)
+    conn = sqlite3.connect(
+        DB_PATH, uri=True, timeout=BUSY_TIMEOUT_S, factory=_TimedConnection, check_same_thread=check_same_thread
+    )
     conn.row_factory = sqlite3.Row
     try:
         conn.execute("PRAGMA foreign_keys=ON")
@@ -42,9 +148,339 @@ def _connect() -> sqlite3.Connection:
     return conn
 
 
+# Status que nao contam como "em aberto" (relatorios, arquivamento, resumo de vencimentos)
+DONE_STATUSES = ("CONCLUIDA", "ENVIADA", "DISPENSADA")
+
+# Chave do rollup: as dimensoes que o relatorio agrupa e filtra. O responsavel (user_id) vem por ultimo: quase
+# sempre e um so por empresa, entao quase nao aumenta a tabela, e o agrupamento padrao (sem ele) segue a ordem da
+# chave. Vencimento fica fora: com ele a tabela tinha quase uma linha por tarefa. "Atrasada" depende da data da
+# leitura e nao pode ser congelada pelo trigger, entao sai de task_rollup_due, que so conta tarefas em aberto com
+# vencimento, separadas pela data.
+ROLLUP_KEY = ("competencia", "company_id", "tipo", "orgao", "status", "user_id")
+ROLLUP_DUE_KEY = (*ROLLUP_KEY, "vencimento")
+ROLLUP_TABLES = ("task_rollup", "task_rollup_due")
+
+_DONE_SQL = ", ".join(f"'{s}'" for s in DONE_STATUSES)
+
+ROLLUP_AGGREGATE_SQL = """
+    SELECT COALESCE(competencia, '') AS competencia, company_id, tipo, orgao, status, user_id,
+           COUNT(*) AS total,
+           SUM(CASE WHEN pdf_sha256 IS NOT NULL OR pdf_blob IS NOT NULL THEN 1 ELSE 0 END) AS with_pdf
+    FROM tarefas
+    GROUP BY 1, 2, 3, 4, 5, 6
+"""
+
+ROLLUP_DUE_AGGREGATE_SQL = f"""
+    SELECT COALESCE(competencia, '') AS competencia, company_id, tipo, orgao, status, user_id, vencimento,
+           COUNT(*) AS total
+    FROM tarefas
+    WHERE status NOT IN ({_DONE_SQL}) AND COALESCE(vencimento, '') <> ''
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+"""
+
+
+def _rollup_key_values(ref: str, key: tuple = ROLLUP_KEY) -> str:
+    return ", ".join(f"COALESCE({ref}.{k}, '')" if k == "competencia" else f"{ref}.{k}" for k in key)
+
+
+def _rollup_key_match(ref: str, key: tuple = ROLLUP_KEY) -> str:
+    return " AND ".join(
+        f"{k} = COALESCE({ref}.{k}, '')" if k == "competencia" else f"{k} = {ref}.{k}" for k in key
+    )
+
+
+def _rollup_trigger_body(old: bool, new: bool) -> str:
+    stmts = []
+    if old:
+        # Em task_rollup_due so existe linha para tarefa em aberto com vencimento: nos outros casos o UPDATE nao acha nada
+        stmts.append(
+            f"""
+            UPDATE task_rollup
+            SET total = total - 1, with_pdf = with_pdf - (OLD.pdf_sha256 IS NOT NULL OR OLD.pdf_blob IS NOT NULL)
+            WHERE {_rollup_key_match("OLD")};
+            DELETE FROM task_rollup WHERE {_rollup_key_match("OLD")} AND total <= 0;
+            UPDATE task_rollup_due SET total = total - 1 WHERE {_rollup_key_match("OLD", ROLLUP_DUE_KEY)};
+            DELETE FROM task_rollup_due WHERE {_rollup_key_match("OLD", ROLLUP_DUE_KEY)} AND total <= 0;
+            """
+        )
+    if new:
+        stmts.append(
+            f"""
+            INSERT INTO task_rollup ({", ".join(ROLLUP_KEY)}, total, with_pdf)
+            VALUES ({_rollup_key_values("NEW")}, 1, NEW.pdf_sha256 IS NOT NULL OR NEW.pdf_blob IS NOT NULL)
+            ON CONFLICT ({", ".join(ROLLUP_KEY)}) DO UPDATE SET
+                total = total + 1,
+                with_pdf = with_pdf + excluded.with_pdf;
+            INSERT INTO task_rollup_due ({", ".join(ROLLUP_DUE_KEY)}, total)
+            SELECT {_rollup_key_values("NEW", ROLLUP_DUE_KEY)}, 1
+            WHERE NEW.status NOT IN ({_DONE_SQL}) AND COALESCE(NEW.vencimento, '') <> ''
+            ON CONFLICT ({", ".join(ROLLUP_DUE_KEY)}) DO UPDATE SET total = total + 1;
+            """
+        )
+    return "".join(stmts)
+
+
+def rebuild_task_rollup(cur: sqlite3.Cursor) -> int:
+    cur.execute("DELETE FROM task_rollup")
+    cur.execute(
+        f"INSERT INTO task_rollup ({', '.join(ROLLUP_KEY)}, total, with_pdf) {ROLLUP_AGGREGATE_SQL}"
+    )
+    cur.execute("DELETE FROM task_rollup_due")
+    cur.execute(f"INSERT INTO task_rollup_due ({', '.join(ROLLUP_DUE_KEY)}, total) {ROLLUP_DUE_AGGREGATE_SQL}")
+    row = cur.execute("SELECT COUNT(*) FROM task_rollup").fetchone()
+    return int(row[0] if row else 0)
+
+
+def create_rollup_tables(cur: sqlite3.Cursor, schema: str = "main") -> bool:
+    """Cria task_rollup/task_rollup_due em schema; True se criou (ou recriou uma chave antiga) e precisa de rebuild."""
+    current = [r[1] for r in cur.execute(f"PRAGMA {schema}.table_info(task_rollup)").fetchall()]
+    due = cur.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'task_rollup_due'").fetchone()
+    fresh = current != [*ROLLUP_KEY, "total", "with_pdf"] or not due
+    if fresh:
+        # chave antiga: recriada e recalculada
+        cur.execute(f"DROP TABLE IF EXISTS {schema}.task_rollup")
+        cur.execute(f"DROP TABLE IF EXISTS {schema}.task_rollup_due")
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {schema}.task_rollup (
+            competencia TEXT NOT NULL,
+            company_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            orgao TEXT NOT NULL,
+            status TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            with_pdf INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (competencia, company_id, tipo, orgao, status, user_id)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {schema}.task_rollup_due (
+            competencia TEXT NOT NULL,
+            company_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            orgao TEXT NOT NULL,
+            status TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            vencimento TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (competencia, company_id, tipo, orgao, status, user_id, vencimento)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.idx_task_rollup_company ON task_rollup (company_id, competencia)"
+    )
+    # painel do colaborador (summary com user_id)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_task_rollup_user ON task_rollup (user_id, competencia)")
+    cur.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.idx_task_rollup_due_user ON task_rollup_due (user_id, competencia)"
+    )
+    return fresh
+
+
+def _ensure_task_rollup(cur: sqlite3.Cursor) -> None:
+    fresh = create_rollup_tables(cur)
+    # Recria os triggers a cada inicializacao para acompanhar mudancas de definicao.
+    triggers = {
+        "trg_tarefas_rollup_ins": ("AFTER INSERT ON tarefas", False, True),
+        "trg_tarefas_rollup_del": ("AFTER DELETE ON tarefas", True, False),
+        "trg_tarefas_rollup_upd": (
+            "AFTER UPDATE OF competencia, company_id, tipo, orgao, status, user_id, vencimento, pdf_blob, pdf_sha256 "
+            "ON tarefas",
+            True,
+            True,
+        ),
+    }
+    for name, (event, old, new) in triggers.items():
+        _recreate_trigger(cur, name, event, _rollup_trigger_body(old, new))
+    if fresh:
+        rebuild_task_rollup(cur)
+
+
+FTS_TOKENIZE = "unicode61 remove_diacritics 2"
+
+
+# CNPJ/IE chegam formatados ou nao; no indice ficam so os digitos.
+def _sql_digits(expr: str) -> str:
+    return f"REPLACE(REPLACE(REPLACE(REPLACE(COALESCE({expr}, ''), '.', ''), '/', ''), '-', ''), ' ', '')"
+
+
+def _ensure_fts(cur: sqlite3.Cursor, name: str, columns: List[str], backfill_sql: str) -> None:
+    current = [r[1] for r in cur.execute(f"PRAGMA table_info({name});").fetchall()]
+    if current == columns:
+        return
+    cur.execute(f"DROP TABLE IF EXISTS {name}")
+    cur.execute(
+        f"CREATE VIRTUAL TABLE {name} USING fts5({', '.join(columns)}, "
+        f"tokenize = '{FTS_TOKENIZE}', prefix = '2 3 4')"
+    )
+    cur.execute(backfill_sql)
+
+
+def _recreate_trigger(cur: sqlite3.Cursor, name: str, event: str, body: str) -> None:
+    cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+    cur.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+
+def _ensure_search_index(cur: sqlite3.Cursor) -> None:
+    empresas_values = (
+        "{ref}.id, {ref}.nome, " + _sql_digits("{ref}.cnpj") + ", "
+        "COALESCE({ref}.ie, '') || ' ' || " + _sql_digits("{ref}.ie")
+    )
+    _ensure_fts(
+        cur,
+        "empresas_fts",
+        ["nome", "cnpj", "ie"],
+        "INSERT INTO empresas_fts (rowid, nome, cnpj, ie) SELECT "
+        + empresas_values.format(ref="empresas")
+        + " FROM empresas",
+    )
+    insert_empresa = (
+        "INSERT INTO empresas_fts (rowid, nome, cnpj, ie) VALUES ("
+        + empresas_values.format(ref="NEW")
+        + ");"
+    )
+    _recreate_trigger(cur, "trg_empresas_fts_ins", "AFTER INSERT ON empresas", insert_empresa)
+    _recreate_trigger(
+        cur,
+        "trg_empresas_fts_upd",
+        "AFTER UPDATE OF nome, cnpj, ie ON empresas",
+        "DELETE FROM empresas_fts WHERE rowid = OLD.id; " + insert_empresa,
+    )
+    _recreate_trigger(
+        cur, "trg_empresas_fts_del", "AFTER DELETE ON empresas", "DELETE FROM empresas_fts WHERE rowid = OLD.id;"
+    )
+
+    # company_key ("c<id>") deixa o MATCH restrito a uma empresa sem varrer o historico dela
+    _ensure_fts(
+        cur,
+        "tarefas_fts",
+        ["titulo", "tributo", "company_key"],
+        "INSERT INTO tarefas_fts (rowid, titulo, tributo, company_key) "
+        "SELECT id, titulo, COALESCE(tributo, ''), 'c' || company_id FROM tarefas",
+    )
+    insert_tarefa = (
+        "INSERT INTO tarefas_fts (rowid, titulo, tributo, company_key) "
+        "VALUES (NEW.id, NEW.titulo, COALESCE(NEW.tributo, ''), 'c' || NEW.company_id);"
+    )
+    _recreate_trigger(cur, "trg_tarefas_fts_ins", "AFTER INSERT ON tarefas", insert_tarefa)
+    _recreate_trigger(
+        cur,
+        "trg_tarefas_fts_upd",
+        "AFTER UPDATE OF titulo, tributo, company_id ON tarefas",
+        "DELETE FROM tarefas_fts WHERE rowid = OLD.id; " + insert_tarefa,
+    )
+    _recreate_trigger(
+        cur, "trg_tarefas_fts_del", "AFTER DELETE ON tarefas", "DELETE FROM tarefas_fts WHERE rowid = OLD.id;"
+    )
+
+
+def _ensure_pdf_blobs(cur: sqlite3.Cursor) -> None:
+    # Arquivos de app.pdf_store; refcount mantido por trigger a partir de tarefas.pdf_sha256.
+    # Linha com refcount 0 fica ate o pdf-gc apagar o arquivo.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pdf_blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+        ) WITHOUT ROWID
+        """
+    )
+    incr = (
+        "INSERT INTO pdf_blobs (sha256, refcount, updated_at) VALUES (NEW.pdf_sha256, 1, datetime('now')) "
+        "ON CONFLICT(sha256) DO UPDATE SET refcount = refcount + 1, updated_at = excluded.updated_at;"
+    )
+    decr = (
+        "UPDATE pdf_blobs SET refcount = refcount - 1, updated_at = datetime('now') "
+        "WHERE sha256 = OLD.pdf_sha256;"
+    )
+    _recreate_trigger(
+        cur, "trg_tarefas_pdf_ins", "AFTER INSERT ON tarefas WHEN NEW.pdf_sha256 IS NOT NULL", incr
+    )
+    _recreate_trigger(
+        cur, "trg_tarefas_pdf_del", "AFTER DELETE ON tarefas WHEN OLD.pdf_sha256 IS NOT NULL", decr
+    )
+    _recreate_trigger(
+        cur,
+        "trg_tarefas_pdf_upd",
+        "AFTER UPDATE OF pdf_sha256 ON tarefas WHEN OLD.pdf_sha256 IS NOT NEW.pdf_sha256",
+        f"{decr} "
+        "INSERT INTO pdf_blobs (sha256, refcount, updated_at) SELECT NEW.pdf_sha256, 1, datetime('now') "
+        "WHERE NEW.pdf_sha256 IS NOT NULL "
+        "ON CONFLICT(sha256) DO UPDATE SET refcount = refcount + 1, updated_at = excluded.updated_at;",
+    )
+
+
+CLASSIFIER_VERSION_KEY = "classifier_patterns_version"
+
+
+def bump_classifier_version(cur: sqlite3.Cursor) -> int:
+    """Incrementa a versao dos padroes (os workers comparam so esse numero); uma vez por transacao de escrita."""
+    cur.execute(
+        "INSERT INTO app_settings (key, value, updated_at) VALUES (?, '1', datetime('now')) "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1, updated_at = excluded.updated_at",
+        (CLASSIFIER_VERSION_KEY,),
+    )
+    row = cur.execute("SELECT value FROM app_settings WHERE key = ?", (CLASSIFIER_VERSION_KEY,)).fetchone()
+    return int(row[0])
+
+
+def _ensure_classifier_patterns(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS classifier_patterns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            grupo TEXT NOT NULL,
+            orgao TEXT NOT NULL,
+            tributo TEXT NOT NULL,
+            subgrupo TEXT,
+            patterns TEXT NOT NULL,
+            active INTEGER NOT NULL DEFAULT 1,
+            updated_at TEXT DEFAULT (datetime('now'))
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_classifier_patterns_position ON classifier_patterns (position, id)")
+    # Os triggers por linha incrementavam a versao a cada linha de uma troca em lote; quem escreve na tabela
+    # chama bump_classifier_version uma vez na transacao
+    for event in ("insert", "update", "delete"):
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_classifier_patterns_{event}")
+    if cur.execute("SELECT 1 FROM app_settings WHERE key = ?", (CLASSIFIER_VERSION_KEY,)).fetchone():
+        return
+    # Primeira execucao: a tabela nasce com a lista embutida no classificador
+    from .classifier import PATTERNS
+
+    cur.executemany(
+        """
+        INSERT INTO classifier_patterns (position, name, tipo, grupo, orgao, tributo, subgrupo, patterns)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (pos, p.name, p.tipo, p.grupo, p.orgao, p.tributo, p.subgrupo, json.dumps(p.patterns))
+            for pos, p in enumerate(PATTERNS)
+        ],
+    )
+    bump_classifier_version(cur)
+
+
 def init_db() -> None:
     conn = _connect()
     cur = conn.cursor()
+    # Banco novo nasce com auto_vacuum incremental (app.maintenance devolve paginas livres aos poucos);
+    # bancos antigos so mudam com VACUUM, via manage db-maintenance --convert-auto-vacuum.
+    if cur.execute("PRAGMA page_count").fetchone()[0] == 0:
+        cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL: leitores (relatorios, backup online) nao bloqueiam escritas. FISCAL_DB_WAL=0 mantem o journal classico.
+    if os.environ.get("FISCAL_DB_WAL", "1").strip().lower() not in {"0", "false", "no", "off"}:
+        cur.execute("PRAGMA journal_mode=WAL")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS usuarios (
@@ -63,6 +499,9 @@ def init_db() -> None:
         cur.execute("ALTER TABLE usuarios ADD COLUMN role TEXT NOT NULL DEFAULT 'collab'")
     if "is_default" not in cols:
         cur.execute("ALTER TABLE usuarios ADD COLUMN is_default INTEGER NOT NULL DEFAULT 0")
+    if "email" not in cols:
+        # destino do resumo diario de vencimentos (app.digest)
+        cur.execute("ALTER TABLE usuarios ADD COLUMN email TEXT")
     # garante senha padrao para registros antigos
     cur.execute("UPDATE usuarios SET senha = '1234' WHERE senha IS NULL OR senha = ''")
     cur.execute(
@@ -93,6 +532,28 @@ def init_db() -> None:
         cur.execute("ALTER TABLE empresas ADD COLUMN email_principal TEXT")
     if "emails_extra" not in cols_emp:
         cur.execute("ALTER TABLE empresas ADD COLUMN emails_extra TEXT")
+    if "cnpj_digits" not in cols_emp:
+        cur.execute("ALTER TABLE empresas ADD COLUMN cnpj_digits TEXT")
+        # Backfill unico; a partir daqui o repositorio grava a coluna junto com o cnpj.
+        digits = _sql_digits("cnpj")
+        cur.execute(
+            f"""
+            UPDATE empresas
+            SET cnpj_digits = CASE
+                WHEN length({digits}) = 14 AND {digits} NOT GLOB '*[^0-9]*' THEN {digits}
+            END
+            """
+        )
+    try:
+        cur.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_empresas_cnpj_digits
+            ON empresas (cnpj_digits) WHERE cnpj_digits IS NOT NULL
+            """
+        )
+    except sqlite3.IntegrityError:
+        # Base legada com CNPJ duplicado: mantem a busca indexada sem a restricao.
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_empresas_cnpj_digits ON empresas (cnpj_digits)")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS tarefas (
@@ -116,6 +577,35 @@ def init_db() -> None:
     cols_task = [r[1] for r in cur.execute("PRAGMA table_info(tarefas);").fetchall()]
     if "vencimento" not in cols_task:
         cur.execute("ALTER TABLE tarefas ADD COLUMN vencimento TEXT")
+    # PDF no armazenamento por conteudo (app.pdf_store); pdf_blob fica so para linhas ainda nao migradas
+    if "pdf_sha256" not in cols_task:
+        cur.execute("ALTER TABLE tarefas ADD COLUMN pdf_sha256 TEXT")
+    # Relatorios leem task_rollup; o indice de cobertura antigo so pesava nas gravacoes
+    cur.execute("DROP INDEX IF EXISTS idx_tarefas_report")
+    # Listagens ja na ordem da tela (competencia DESC, titulo): sem ordenar em B-tree temporario.
+    # O plano de cada consulta dos repositorios fica registrado em bench/plan_snapshots (python -m bench.plans).
+    # competencia DESC tambem aqui: a exportacao sem filtro (GET /exports/tasks.csv) percorre a tabela inteira
+    # nessa ordem direto do indice, sem ordenar cada competencia a parte
+    cur.execute("DROP INDEX IF EXISTS idx_tarefas_competencia_titulo")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tarefas_competencia_desc ON tarefas (competencia DESC, titulo COLLATE NOCASE)"
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_tarefas_company_competencia
+        ON tarefas (company_id, competencia DESC, titulo COLLATE NOCASE)
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_tarefas_user_competencia
+        ON tarefas (user_id, competencia DESC, titulo COLLATE NOCASE)
+        """
+    )
+    # Proximos vencimentos (list_upcoming): mesma expressao do WHERE e do ORDER BY
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tarefas_vencimento ON tarefas (date(vencimento), titulo COLLATE NOCASE)"
+    )
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS task_logs (
@@ -130,6 +620,7 @@ def init_db() -> None:
         )
         """
     )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_task_logs_task ON task_logs (task_id, id)")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS email_logs (
@@ -149,6 +640,39 @@ def init_db() -> None:
         )
         """
     )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_email_logs_company ON email_logs (company_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_email_logs_task ON email_logs (task_id)")
+    # Fila de saida (app.mailer): a requisicao so grava aqui; o envio e o email_logs ficam com a thread do mailer.
+    # dedupe_key impede enfileirar duas vezes a mesma guia/resumo. task_id sem FK: archive-year move a tarefa.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            company_id INTEGER,
+            user_id INTEGER,
+            task_id INTEGER,
+            to_emails TEXT NOT NULL,
+            subject TEXT NOT NULL DEFAULT '',
+            body TEXT NOT NULL DEFAULT '',
+            link TEXT,
+            attach_pdf INTEGER NOT NULL DEFAULT 0,
+            dedupe_key TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL DEFAULT (datetime('now')),
+            lease_owner TEXT,
+            lease_until TEXT,
+            last_error TEXT,
+            email_log_id INTEGER,
+            created_at TEXT NOT NULL DEFAULT (datetime('now')),
+            sent_at TEXT,
+            FOREIGN KEY(company_id) REFERENCES empresas(id),
+            FOREIGN KEY(user_id) REFERENCES usuarios(id)
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_company ON email_outbox (company_id)")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS task_comments (
@@ -162,6 +686,7 @@ def init_db() -> None:
         )
         """
     )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_task_comments_task ON task_comments (task_id, id)")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS notifications (
@@ -176,6 +701,7 @@ def init_db() -> None:
         )
         """
     )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications (user_id, id)")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS classificacoes (
@@ -212,5 +738,44 @@ def init_db() -> None:
     cols_cls = [r[1] for r in cur.execute("PRAGMA table_info(classificacoes);").fetchall()]
     if "subgrupo" not in cols_cls:
         cur.execute("ALTER TABLE classificacoes ADD COLUMN subgrupo TEXT")
+    # Posicao da entrada no log JSONL (app.classification_log)
+    if "log_segment" not in cols_cls:
+        cur.execute("ALTER TABLE classificacoes ADD COLUMN log_segment TEXT")
+    if "log_offset" not in cols_cls:
+        cur.execute("ALTER TABLE classificacoes ADD COLUMN log_offset INTEGER")
+    # De onde vieram os campos (content_classifier.merge_content); NULL nas linhas anteriores
+    if "fonte" not in cols_cls:
+        cur.execute("ALTER TABLE classificacoes ADD COLUMN fonte TEXT")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_classificacoes_task ON classificacoes (task_id, id)")
+    # Tentativas de login por ip:nome, compartilhadas entre os workers (first_at em epoch)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS login_attempts (
+            key TEXT PRIMARY KEY,
+            first_at REAL NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """
+    )
+    # Execucoes dos jobs agendados (app.jobs); lease_until impede dois workers rodando o mesmo job
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS job_runs (
+            name TEXT PRIMARY KEY,
+            owner TEXT,
+            lease_until TEXT,
+            last_started TEXT,
+            last_finished TEXT,
+            last_status TEXT,
+            last_elapsed_s REAL,
+            last_result TEXT,
+            runs INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    _ensure_task_rollup(cur)
+    _ensure_pdf_blobs(cur)
+    _ensure_search_index(cur)
+    _ensure_classifier_patterns(cur)
     conn.commit()
     conn.close()
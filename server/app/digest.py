@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import os
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from .br_calendar import add_business_days, is_business_day
+from .mailer import enqueue
+from .repositories import SettingsRepository, TaskRepository
+
+# Resumo diario de vencimentos (job "due-digest"): uma consulta traz as tarefas em aberto que vencem nos proximos
+# FISCAL_DIGEST_BUSINESS_DAYS dias uteis, o agrupamento por responsavel e por empresa e feito numa passada so e
+# cada destinatario recebe um e-mail pela fila (app.mailer). A dedupe_key tem a data, entao rodar de novo no mesmo
+# dia nao manda nada.
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+DIGEST_BUSINESS_DAYS = max(1, _env_int("FISCAL_DIGEST_BUSINESS_DAYS", 3))
+# hora local a partir da qual o job manda o resumo do dia
+DIGEST_HOUR = min(23, max(0, _env_int("FISCAL_DIGEST_HOUR", 7)))
+# resumo tambem para os e-mails das empresas clientes (desligado: o escritorio decide quando liga)
+DIGEST_CLIENTS = os.environ.get("FISCAL_DIGEST_CLIENTS", "0") == "1"
+
+
+def _fmt(day: str) -> str:
+    return f"{day[8:10]}/{day[5:7]}/{day[:4]}" if len(day) >= 10 else day
+
+
+def _line(task: Dict[str, object]) -> str:
+    label = str(task.get("tributo") or task.get("titulo") or "")
+    comp = f" ({task['competencia']})" if task.get("competencia") else ""
+    return f"  {_fmt(str(task['vencimento']))}  {label}{comp} - {task['status']}"
+
+
+def group_tasks(
+    rows: List[Dict[str, object]],
+) -> Tuple[Dict[int, Dict[str, object]], Dict[int, Dict[str, object]]]:
+    """(por responsavel, por empresa). Cada grupo guarda destinatarios e tarefas na ordem de vencimento."""
+    users: Dict[int, Dict[str, object]] = {}
+    companies: Dict[int, Dict[str, object]] = {}
+    for row in rows:
+        if row.get("user_id") is not None:
+            user = users.setdefault(
+                int(row["user_id"]),  # type: ignore[arg-type]
+                {"nome": row.get("responsavel") or "", "email": row.get("responsavel_email") or "", "companies": {}},
+            )
+            user["companies"].setdefault(str(row["empresa"]), []).append(row)  # type: ignore[union-attr]
+        company = companies.setdefault(
+            int(row["company_id"]),  # type: ignore[arg-type]
+            {"nome": row["empresa"], "emails": row["company_emails"], "responsavel_id": row.get("responsavel_id"), "tasks": []},
+        )
+        company["tasks"].append(row)  # type: ignore[union-attr]
+    return users, companies
+
+
+def render_user(user: Dict[str, object], until: date) -> Tuple[str, str]:
+    companies: Dict[str, List[Dict[str, object]]] = user["companies"]  # type: ignore[assignment]
+    total = sum(len(tasks) for tasks in companies.values())
+    lines = [f"Ola, {user['nome']}.", "", f"Tarefas em aberto com vencimento ate {until.strftime('%d/%m/%Y')}:"]
+    for nome in sorted(companies, key=str.casefold):
+        lines += ["", str(nome), *(_line(t) for t in companies[nome])]
+    return f"Vencimentos: {total} tarefa(s) em {len(companies)} empresa(s) ate {until.strftime('%d/%m')}", "\n".join(lines)
+
+
+def render_company(company: Dict[str, object], until: date) -> Tuple[str, str]:
+    tasks: List[Dict[str, object]] = company["tasks"]  # type: ignore[assignment]
+    lines = [
+        f"{company['nome']}",
+        "",
+        f"Obrigacoes com vencimento ate {until.strftime('%d/%m/%Y')}:",
+        *(_line(t) for t in tasks),
+    ]
+    return f"{company['nome']}: vencimentos ate {until.strftime('%d/%m')}", "\n".join(lines)
+
+
+def build_digests(
+    today: date, business_days: int = DIGEST_BUSINESS_DAYS, *, clients: bool = DIGEST_CLIENTS
+) -> Tuple[List[Dict[str, object]], Dict[str, object]]:
+    """(itens para a fila, resumo). Uma consulta e uma passada pelas linhas, qualquer que seja o numero de destinatarios."""
+    until = add_business_days(today, business_days)
+    rows = TaskRepository().due_between(today.isoformat(), until.isoformat())
+    users, companies = group_tasks(rows)
+    items: List[Dict[str, object]] = []
+    without_email = 0
+    for user_id, user in users.items():
+        if not user["email"]:
+            without_email += 1
+            continue
+        subject, body = render_user(user, until)
+        items.append(
+            {
+                "user_id": user_id,
+                "to_emails": [user["email"]],
+                "subject": subject,
+                "body": body,
+                "dedupe_key": f"digest:user:{user_id}:{today.isoformat()}",
+            }
+        )
+    if clients:
+        for company_id, company in companies.items():
+            if not company["emails"]:
+                without_email += 1
+                continue
+            subject, body = render_company(company, until)
+            items.append(
+                {
+                    "company_id": company_id,
+                    "user_id": company["responsavel_id"],
+                    "to_emails": company["emails"],
+                    "subject": subject,
+                    "body": body,
+                    "dedupe_key": f"digest:company:{company_id}:{today.isoformat()}",
+                }
+            )
+    summary = {
+        "date": today.isoformat(),
+        "until": until.isoformat(),
+        "tasks": len(rows),
+        "users": len(users),
+        "companies": len(companies) if clients else 0,
+        "without_email": without_email,
+    }
+    return items, summary
+
+
+def run_due_digest(
+    today: Optional[date] = None,
+    *,
+    business_days: int = DIGEST_BUSINESS_DAYS,
+    clients: bool = DIGEST_CLIENTS,
+    force: bool = False,
+    dry_run: bool = False,
+) -> Dict[str, object]:
+    """Job: monta e enfileira o resumo do dia. Sem force so roda em dia util, depois de DIGEST_HOUR."""
+    now = datetime.now()
+    day = today or now.date()
+    if not force:
+        if not is_business_day(day):
+            return {"date": day.isoformat(), "skipped": "dia nao util"}
+        if today is None and now.hour < DIGEST_HOUR:
+            return {"date": day.isoformat(), "skipped": f"antes das {DIGEST_HOUR}h"}
+        if not str(SettingsRepository().get_email().get("smtp_host") or "").strip():
+            # sem SMTP a fila so acumularia resumos velhos
+            return {"date": day.isoformat(), "skipped": "smtp_host nao configurado"}
+    items, summary = build_digests(day, business_days, clients=clients)
+    summary["digests"] = len(items)
+    if dry_run:
+        summary["queued"] = 0
+        summary["preview"] = items[0] if items else None
+        return summary
+    summary["queued"] = enqueue(items)
+    return summary
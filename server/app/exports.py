@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import csv
+import io
+import re
+import zipfile
+import zlib
+from typing import Iterable, Iterator, List, Optional, Sequence
+from xml.sax.saxutils import escape
+
+# Planilhas em streaming (GET /exports/...): as linhas chegam de um gerador (cursor do SQLite lido em lotes) e saem
+# em pedacos de CHUNK_BYTES, sem montar a lista inteira. CSV pode ir com gzip; XLSX ja e um zip.
+
+CHUNK_BYTES = 64 * 1024
+
+TASK_HEADERS = {
+    "id": "ID",
+    "empresa": "Empresa",
+    "cnpj": "CNPJ",
+    "titulo": "Titulo",
+    "tipo": "Tipo",
+    "orgao": "Orgao",
+    "tributo": "Tributo",
+    "competencia": "Competencia",
+    "vencimento": "Vencimento",
+    "status": "Status",
+    "responsavel": "Responsavel",
+    "has_pdf": "PDF",
+}
+
+# Texto comecando com estes caracteres vira formula no Excel/LibreOffice (nome de empresa vindo de fora)
+_FORMULA_START = ("=", "+", "-", "@", "\t", "\r")
+# Caracteres de controle que o XML do XLSX nao aceita
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _cell_text(value: object) -> str:
+    text = "" if value is None else str(value)
+    return f"'{text}" if text.startswith(_FORMULA_START) else text
+
+
+def csv_chunks(header: Sequence[str], rows: Iterable[Sequence[object]], *, sep: str = ";") -> Iterator[bytes]:
+    """CSV em UTF-8 com BOM (o Excel em portugues abre direto com ';')."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=sep, lineterminator="\r\n")
+    buf.write("\ufeff")
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow([v if isinstance(v, (int, float)) else _cell_text(v) for v in row])
+        if buf.tell() >= CHUNK_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = cabecalho gzip
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+class _Sink:
+    """Arquivo so de escrita e sem seek: o zipfile grava em modo streaming e o gerador drena o que acumulou."""
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buf += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+    def size(self) -> int:
+        return len(self._buf)
+
+
+def _col(index: int) -> str:
+    name = ""
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        name = chr(65 + rest) + name
+    return name
+
+
+def _xlsx_row(number: int, values: Sequence[object], cols: List[str]) -> str:
+    cells = []
+    for col, value in zip(cols, values):
+        ref = f"{col}{number}"
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+        elif value is not None and value != "":
+            text = escape(_XML_INVALID.sub("", str(value)))
+            cells.append(f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return f'<row r="{number}">{"".join(cells)}</row>'
+
+
+_XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        "</Relationships>"
+    ),
+}
+
+
+def _workbook_xml(sheet_name: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+        "</workbook>"
+    )
+
+
+def xlsx_chunks(
+    header: Sequence[str], rows: Iterable[Sequence[object]], *, sheet_name: str = "Planilha1"
+) -> Iterator[bytes]:
+    """XLSX com uma planilha e strings inline (sem sharedStrings, que exigiria guardar todos os textos)."""
+    sink = _Sink()
+    cols = [_col(i) for i in range(len(header))]
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:  # type: ignore[arg-type]
+        for name, content in _XLSX_STATIC.items():
+            zf.writestr(name, content)
+        zf.writestr("xl/workbook.xml", _workbook_xml(sheet_name))
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b'<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" state="frozen"/>'
+                b"</sheetView></sheetViews><sheetData>"
+            )
+            sheet.write(_xlsx_row(1, list(header), cols).encode("utf-8"))
+            number = 1
+            for row in rows:
+                number += 1
+                sheet.write(_xlsx_row(number, row, cols).encode("utf-8"))
+                if sink.size() >= CHUNK_BYTES:
+                    yield sink.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+
+def task_rows(rows: Iterable[Sequence[object]], columns: Sequence[str]) -> Iterator[List[object]]:
+    """Linhas de TaskRepository.iter_export prontas para a planilha (PDF como sim/nao)."""
+    pdf = columns.index("has_pdf") if "has_pdf" in columns else None
+    for row in rows:
+        out = list(row)
+        if pdf is not None:
+            out[pdf] = "sim" if out[pdf] else "nao"
+        yield out
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() in ("gzip", "x-gzip"):
+            q = params.strip()
+            try:
+                return not (q.startswith("q=") and float(q[2:] or 0) == 0)
+            except ValueError:
+                return True
+    return False
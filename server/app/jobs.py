@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from .repositories import JobRunRepository
+
+# Jobs periodicos do servidor. O agendador acorda a cada TICK_SECONDS e roda o que venceu;
+# job_runs guarda o lease, entao com varios processos so um executa cada job.
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+TICK_SECONDS = max(5, _env_int("FISCAL_JOBS_TICK_SECONDS", 60))
+DB_MAINTENANCE_HOURS = max(1, _env_int("FISCAL_DB_MAINTENANCE_HOURS", 24))
+
+
+@dataclass(frozen=True)
+class Job:
+    name: str
+    func: Callable[[], Dict[str, object]]
+    interval_s: int
+    lease_s: int = 3600
+    description: str = ""
+
+
+_JOBS: Dict[str, Job] = {}
+_STOP = threading.Event()
+_THREAD: Optional[threading.Thread] = None
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def register(job: Job) -> None:
+    _JOBS[job.name] = job
+
+
+def _register_defaults() -> None:
+    if "db-maintenance" in _JOBS:
+        return
+    from .digest import run_due_digest
+    from .maintenance import run_db_maintenance
+
+    register(
+        Job(
+            name="db-maintenance",
+            func=run_db_maintenance,
+            interval_s=DB_MAINTENANCE_HOURS * 3600,
+            lease_s=1800,
+            description="PRAGMA optimize/ANALYZE, incremental_vacuum com limite de tempo e checkpoint do WAL",
+        )
+    )
+    register(
+        Job(
+            name="due-digest",
+            func=run_due_digest,
+            # confere de hora em hora; a dedupe_key por dia garante um resumo por destinatario
+            interval_s=3600,
+            lease_s=600,
+            description="resumo diario de vencimentos por responsavel (e por empresa) enfileirado em email_outbox",
+        )
+    )
+
+
+def registered() -> List[Job]:
+    _register_defaults()
+    return [_JOBS[name] for name in sorted(_JOBS)]
+
+
+def get_job(name: str) -> Optional[Job]:
+    _register_defaults()
+    return _JOBS.get(name)
+
+
+def run_job(name: str, *, force: bool = False) -> Optional[Dict[str, object]]:
+    """Roda o job se venceu (ou force) e ninguem esta com o lease. None quando nao rodou."""
+    job = get_job(name)
+    if job is None:
+        raise KeyError(name)
+    repo = JobRunRepository()
+    if not repo.claim(job.name, OWNER, interval_s=job.interval_s, lease_s=job.lease_s, force=force):
+        return None
+    started = time.perf_counter()
+    try:
+        result = job.func()
+    except Exception as exc:
+        repo.finish(job.name, OWNER, status="error", elapsed_s=time.perf_counter() - started, result={"error": str(exc)})
+        raise
+    repo.finish(job.name, OWNER, status="ok", elapsed_s=time.perf_counter() - started, result=result)
+    return result
+
+
+def run_due() -> Dict[str, str]:
+    statuses = {}
+    for job in registered():
+        try:
+            statuses[job.name] = "ran" if run_job(job.name) is not None else "skipped"
+        except Exception:
+            statuses[job.name] = "error"  # detalhe fica em job_runs
+    return statuses
+
+
+def list_jobs() -> List[Dict[str, object]]:
+    runs = {r["name"]: r for r in JobRunRepository().list()}
+    return [
+        {
+            "name": job.name,
+            "description": job.description,
+            "interval_s": job.interval_s,
+            **{k: v for k, v in runs.get(job.name, {}).items() if k != "name"},
+        }
+        for job in registered()
+    ]
+
+
+def queue_depth() -> Dict[str, int]:
+    """Jobs vencidos esperando o proximo tick e jobs com lease ativo (gauges de /metrics)."""
+    runs = {r["name"]: r for r in JobRunRepository().list()}
+    now = datetime.utcnow()
+    due = running = 0
+    for job in registered():
+        run = runs.get(job.name) or {}
+        lease = run.get("lease_until")
+        if lease and datetime.fromisoformat(str(lease)) > now:
+            running += 1
+            continue
+        started = run.get("last_started")
+        if not started or (now - datetime.fromisoformat(str(started))).total_seconds() >= job.interval_s:
+            due += 1
+    return {"due": due, "running": running}
+
+
+def _loop() -> None:
+    # primeiro tick atrasado: nao disputa o banco com o startup
+    while not _STOP.wait(TICK_SECONDS):
+        run_due()
+
+
+def start_scheduler() -> bool:
+    global _THREAD
+    if os.environ.get("FISCAL_JOBS_ENABLED", "1") == "0":
+        return False
+    if _THREAD is not None and _THREAD.is_alive():
+        return True
+    _STOP.clear()
+    _THREAD = threading.Thread(target=_loop, name="fiscal-jobs", daemon=True)
+    _THREAD.start()
+    return True
+
+
+def stop_scheduler() -> None:
+    _STOP.set()
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import logging
+import os
+import smtplib
+import ssl
+import threading
+import time
+import uuid
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from typing import Dict, List, Optional, Tuple
+
+from .jobs import OWNER
+from .pdf_store import read_pdf
+from .repositories import EmailOutboxRepository, SettingsRepository, TaskRepository
+
+# Envio de e-mails pela fila email_outbox. Endpoints e jobs so gravam a linha (enqueue) e acordam a thread
+# "fiscal-mailer" do processo, que reserva lotes por lease (varios workers nao mandam o mesmo e-mail),
+# manda tudo por uma conexao SMTP mantida aberta e grava email_logs no sucesso. Falha temporaria volta
+# para a fila com backoff exponencial; recusa definitiva do servidor (5xx) fica como 'failed'.
+logger = logging.getLogger("fiscal.mailer")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+BATCH_SIZE = max(1, _env_int("FISCAL_EMAIL_BATCH", 50))
+POLL_SECONDS = max(1, _env_int("FISCAL_EMAIL_POLL_SECONDS", 15))
+MAX_ATTEMPTS = max(1, _env_int("FISCAL_EMAIL_MAX_ATTEMPTS", 6))
+RETRY_BASE_SECONDS = max(1, _env_int("FISCAL_EMAIL_RETRY_BASE_SECONDS", 60))
+RETRY_MAX_SECONDS = 6 * 3600
+LEASE_SECONDS = 600
+SMTP_TIMEOUT_SECONDS = max(1, _env_int("FISCAL_SMTP_TIMEOUT_SECONDS", 30))
+# Conexao parada por mais que isso e fechada (o servidor derrubaria de qualquer forma)
+SMTP_IDLE_SECONDS = max(1, _env_int("FISCAL_SMTP_IDLE_SECONDS", 60))
+# Servidores limitam mensagens por sessao: reconecta antes de bater no limite
+SMTP_MAX_PER_CONNECTION = max(1, _env_int("FISCAL_SMTP_MAX_PER_CONNECTION", 100))
+
+_WAKE = threading.Event()
+_STOP = threading.Event()
+_THREAD: Optional[threading.Thread] = None
+
+
+class PermanentError(Exception):
+    """Nao adianta tentar de novo (destinatario recusado, PDF apagado...)."""
+
+
+def retry_delay(attempts: int) -> int:
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def _settings_key(settings: Dict[str, object]) -> Tuple[object, ...]:
+    return tuple(settings.get(k) for k in ("smtp_host", "smtp_port", "smtp_user", "smtp_pass", "smtp_tls"))
+
+
+class SmtpConnection:
+    """Uma sessao SMTP reaproveitada entre mensagens; reabre quando a configuracao muda ou o servidor cai."""
+
+    def __init__(self) -> None:
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._key: Optional[Tuple[object, ...]] = None
+        self._last_used = 0.0
+        self._sent = 0
+        self.connects = 0
+
+    def _open(self, settings: Dict[str, object]) -> smtplib.SMTP:
+        host = str(settings.get("smtp_host") or "")
+        port = int(settings.get("smtp_port") or 587)
+        if port == 465:
+            smtp: smtplib.SMTP = smtplib.SMTP_SSL(host, port, timeout=SMTP_TIMEOUT_SECONDS, context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(host, port, timeout=SMTP_TIMEOUT_SECONDS)
+            smtp.ehlo()
+            if settings.get("smtp_tls"):
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+        if settings.get("smtp_user"):
+            smtp.login(str(settings["smtp_user"]), str(settings.get("smtp_pass") or ""))
+        self.connects += 1
+        return smtp
+
+    def _session(self, settings: Dict[str, object]) -> smtplib.SMTP:
+        key = _settings_key(settings)
+        stale = time.monotonic() - self._last_used > SMTP_IDLE_SECONDS or self._sent >= SMTP_MAX_PER_CONNECTION
+        if self._smtp is not None and (key != self._key or stale):
+            self.close()
+        if self._smtp is None:
+            self._smtp = self._open(settings)
+            self._key = key
+            self._sent = 0
+        return self._smtp
+
+    def send(self, message: EmailMessage, settings: Dict[str, object]) -> Dict[str, object]:
+        """Destinatarios recusados quando ao menos um aceitou (todos recusados levanta SMTPRecipientsRefused)."""
+        try:
+            refused = self._session(settings).send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # sessao derrubada pelo servidor entre dois lotes: uma reconexao antes de contar como falha
+            self.close()
+            refused = self._session(settings).send_message(message)
+        self._sent += 1
+        self._last_used = time.monotonic()
+        return dict(refused)
+
+    def close_if_idle(self) -> None:
+        if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_SECONDS:
+            self.close()
+
+    def close(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+
+def build_message(item: Dict[str, object], settings: Dict[str, object]) -> Tuple[EmailMessage, Optional[str]]:
+    """(mensagem, nome do anexo). O PDF sai do armazenamento da tarefa na hora do envio."""
+    sender = str(settings.get("smtp_sender") or settings.get("smtp_user") or "").strip()
+    recipients = [str(e).strip() for e in item.get("to_emails") or [] if str(e).strip()]  # type: ignore[union-attr]
+    if not recipients:
+        raise PermanentError("sem destinatario")
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = ", ".join(recipients)
+    msg["Subject"] = str(item.get("subject") or "")
+    msg["Date"] = formatdate(localtime=True)
+    msg["Message-ID"] = make_msgid(domain=sender.rpartition("@")[2] or None)
+    body = str(item.get("body") or "")
+    if item.get("link"):
+        body = f"{body}\n\n{item['link']}" if body else str(item["link"])
+    msg.set_content(body)
+    attachment = None
+    if item.get("attach_pdf") and item.get("task_id") is not None:
+        row = TaskRepository().get_pdf(int(item["task_id"]), None)  # type: ignore[arg-type]
+        data = read_pdf(row) if row else None
+        if data is None:
+            raise PermanentError("PDF da tarefa nao encontrado")
+        attachment = str(row.get("pdf_path") or f"task_{item['task_id']}.pdf")  # type: ignore[union-attr]
+        msg.add_attachment(data, maintype="application", subtype="pdf", filename=attachment)
+    return msg, attachment
+
+
+def _server_down(exc: Exception) -> bool:
+    # conexao/autenticacao: o resto do lote falharia do mesmo jeito (e costuma ser configuracao, que se corrige)
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPHeloError, smtplib.SMTPAuthenticationError)):
+        return True
+    return isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)
+
+
+def _is_permanent(exc: Exception) -> bool:
+    if isinstance(exc, (PermanentError, smtplib.SMTPRecipientsRefused)):
+        return True
+    # 5xx na mensagem/remetente e definitivo; 4xx e temporario
+    if isinstance(exc, smtplib.SMTPResponseException) and not _server_down(exc):
+        return 500 <= int(exc.smtp_code) < 600
+    return False
+
+
+def deliver_pending(connection: Optional[SmtpConnection] = None, *, max_batches: Optional[int] = None) -> Dict[str, object]:
+    """Manda o que esta vencido na fila, em lotes de BATCH_SIZE, ate esvaziar (ou max_batches)."""
+    settings = SettingsRepository().get_email()
+    if not str(settings.get("smtp_host") or "").strip():
+        return {"sent": 0, "retry": 0, "failed": 0, "batches": 0, "skipped": "smtp_host nao configurado"}
+    if not str(settings.get("smtp_sender") or settings.get("smtp_user") or "").strip():
+        # sem remetente o servidor recusaria tudo: a fila espera a configuracao
+        return {"sent": 0, "retry": 0, "failed": 0, "batches": 0, "skipped": "smtp_sender nao configurado"}
+    own = connection is None
+    conn = connection or SmtpConnection()
+    repo = EmailOutboxRepository()
+    totals = {"sent": 0, "retry": 0, "failed": 0, "batches": 0}
+    try:
+        while max_batches is None or totals["batches"] < max_batches:
+            token = f"{OWNER}:{uuid.uuid4().hex[:8]}"
+            items = repo.claim(token, BATCH_SIZE, LEASE_SECONDS)
+            if not items:
+                break
+            totals["batches"] += 1
+            for pos, item in enumerate(items):
+                try:
+                    message, attachment = build_message(item, settings)
+                    refused = conn.send(message, settings)
+                except Exception as exc:
+                    attempts = int(item.get("attempts") or 1)
+                    if _is_permanent(exc) or attempts >= MAX_ATTEMPTS:
+                        repo.mark_failed(int(item["id"]), token, str(exc) or type(exc).__name__)
+                        totals["failed"] += 1
+                    else:
+                        repo.mark_failed(int(item["id"]), token, str(exc) or type(exc).__name__, retry_in=retry_delay(attempts))
+                        totals["retry"] += 1
+                    logger.warning("e-mail %s nao enviado (tentativa %s): %s", item["id"], attempts, exc)
+                    if _server_down(exc):
+                        # servidor fora: o resto do lote volta para a fila sem gastar tentativa
+                        conn.close()
+                        repo.release([int(i["id"]) for i in items[pos + 1:]], token)
+                        return totals
+                    continue
+                if refused:
+                    logger.warning("e-mail %s: destinatarios recusados %s", item["id"], sorted(refused))
+                repo.mark_sent(int(item["id"]), token, attachment)
+                totals["sent"] += 1
+    finally:
+        if own:
+            conn.close()
+    return totals
+
+
+def wake() -> None:
+    _WAKE.set()
+
+
+def _loop() -> None:
+    connection = SmtpConnection()
+    try:
+        while not _STOP.is_set():
+            _WAKE.clear()
+            try:
+                deliver_pending(connection)
+            except Exception:
+                logger.exception("falha no envio da fila de e-mails")
+            connection.close_if_idle()
+            _WAKE.wait(POLL_SECONDS)
+    finally:
+        connection.close()
+
+
+def start_mailer() -> bool:
+    global _THREAD
+    if os.environ.get("FISCAL_EMAIL_WORKER_ENABLED", "1") == "0":
+        return False
+    if _THREAD is not None and _THREAD.is_alive():
+        return True
+    _STOP.clear()
+    _THREAD = threading.Thread(target=_loop, name="fiscal-mailer", daemon=True)
+    _THREAD.start()
+    return True
+
+
+def stop_mailer() -> None:
+    _STOP.set()
+    _WAKE.set()
+
+
+def enqueue(items: List[Dict[str, object]]) -> int:
+    """Grava na fila e acorda o mailer deste processo. Devolve quantos entraram (dedupe_key repetida nao entra)."""
+    inserted = EmailOutboxRepository().enqueue_many(items)
+    if inserted:
+        wake()
+    return inserted
@@ -1,17 +1,16 @@
 from __future__ import annotations
 
-from typing import Optional, List
-from datetime import date, timedelta
+from typing import Iterable, Optional, List, Sequence
+from datetime import date
 import calendar
-import io
+import hashlib
+import hmac
 import os
-import re
 import time
 
-import pdfplumber
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from .db import init_db, _connect
@@ -19,6 +18,7 @@ from .schemas import (
     UserOut,
     UserCreate,
     UserRoleUpdate,
+    UserEmailUpdate,
     UserLogin,
     AuthLoginOut,
     CompanyOut,
@@ -32,26 +32,62 @@ from .schemas import (
     TaskCommentOut,
     TaskCommentCreate,
     NotificationOut,
+    ReportSummaryOut,
+    SearchOut,
+    ClassifierPatternItem,
+    ClassifierPatternsOut,
     ServerSettingsOut,
     ServerSettingsUpdate,
     EmailSettingsOut,
     EmailSettingsUpdate,
+    EmailSendPayload,
+    EmailOutboxOut,
+    EmailLogOut,
 )
 from .repositories import (
     UserRepository,
     CompanyRepository,
     TaskRepository,
+    ReportRepository,
+    RollupRepository,
+    PdfBlobRepository,
+    SearchRepository,
     ClassificationRepository,
+    ClassifierPatternRepository,
     TaskLogRepository,
     TaskCommentRepository,
     NotificationRepository,
     SettingsRepository,
+    LoginAttemptRepository,
+    EmailOutboxRepository,
+    EmailLogRepository,
 )
-from .classifier import classify_filename, save_classification_json
+from .serve import STARTUP_DONE_ENV, startup_lock
+from .jobs import get_job, list_jobs, queue_depth, run_job, start_scheduler, stop_scheduler
+from .mailer import enqueue as enqueue_emails, start_mailer, stop_mailer, wake as wake_mailer
+from . import metrics
+from .metrics import timed
+from . import profiling, repositories, server_timing, slow_queries
+from .server_timing import TimedRoute, stage
+from .classifier import classify_filename, compile_pattern_rows, matcher_stats
+from .classification_log import read_entries, record_classification
+from .content_classifier import classify_text, merge_content, review_status
+from .archive import archive_index, upgrade_archives
+from .backup import list_generations, start_backup_thread
+from .exports import TASK_HEADERS, accepts_gzip, csv_chunks, gzip_chunks, task_rows, xlsx_chunks
+from .pdf_text import extract_pdf_text
+from .pdf_store import migrate_blobs, put_pdf, stored_path
+from .br_docs import normalize_cnpj, normalize_competencia
+from .br_calendar import br_holidays, prev_business_day
+from .text_scan import scan_text
 from .auth import create_access_token, decode_access_token
 
+# Cada metodo publico dos repositorios vira uma etapa do header Server-Timing. Fica aqui, na API:
+# os comandos de linha (manage, bench, jobs) usam os repositorios sem carregar FastAPI
+server_timing.instrument_repositories(repositories)
 
 _LAST_MONTHLY_SYNC: Optional[str] = None
+MONTHLY_SYNC_KEY = "monthly_sync_competencia"
 
 
 def _read_env_int(name: str, default: int) -> int:
@@ -69,7 +105,6 @@ MAX_PDF_BYTES = MAX_PDF_MB * 1024 * 1024
 
 LOGIN_WINDOW_SECONDS = max(30, _read_env_int("FISCAL_LOGIN_WINDOW_SECONDS", 300))
 LOGIN_MAX_ATTEMPTS = max(3, _read_env_int("FISCAL_LOGIN_MAX_ATTEMPTS", 8))
-_LOGIN_ATTEMPTS: dict[str, dict[str, float]] = {}
 
 
 def _cors_origins() -> list[str]:
@@ -91,53 +126,6 @@ def _cors_origins() -> list[str]:
     return out
 
 
-def _easter_sunday(year: int) -> date:
-    # Meeus/Jones/Butcher
-    a = year % 19
-    b = year // 100
-    c = year % 100
-    d = b // 4
-    e = b % 4
-    f = (b + 8) // 25
-    g = (b - f + 1) // 3
-    h = (19 * a + b - d - g + 15) % 30
-    i = c // 4
-    k = c % 4
-    l = (32 + 2 * e + 2 * i - h - k) % 7
-    m = (a + 11 * h + 22 * l) // 451
-    month = (h + l - 7 * m + 114) // 31
-    day = ((h + l - 7 * m + 114) % 31) + 1
-    return date(year, month, day)
-
-
-def _br_holidays(year: int) -> set[date]:
-    easter = _easter_sunday(year)
-    fixed = {
-        date(year, 1, 1),
-        date(year, 4, 21),
-        date(year, 5, 1),
-        date(year, 9, 7),
-        date(year, 10, 12),
-        date(year, 11, 2),
-        date(year, 11, 15),
-        date(year, 12, 25),
-    }
-    movable = {
-        easter - timedelta(days=48),  # carnaval (seg)
-        easter - timedelta(days=47),  # carnaval (ter)
-        easter - timedelta(days=2),   # sexta-feira santa
-        easter + timedelta(days=60),  # corpus christi
-    }
-    return fixed | movable
-
-
-def _prev_business_day(dt: date, holidays: set[date]) -> date:
-    out = dt
-    while out.weekday() >= 5 or out in holidays:
-        out -= timedelta(days=1)
-    return out
-
-
 def _shift_year_month(year: int, month: int, offset: int) -> tuple[int, int]:
     m = month + offset
     y = year
@@ -152,7 +140,7 @@ def _shift_year_month(year: int, month: int, offset: int) -> tuple[int, int]:
 
 def _sync_monthly_tasks_for(year: int, month: int) -> None:
     competencia = f"{year}{month:02d}"
-    holidays = _br_holidays(year)
+    holidays = br_holidays(year)
     last_day = calendar.monthrange(year, month)[1]
 
     fed_rules = [
@@ -185,6 +173,8 @@ def _sync_monthly_tasks_for(year: int, month: int) -> None:
 
     conn = _connect()
     cur = conn.cursor()
+    # Varios workers podem sincronizar ao mesmo tempo: o lock de escrita desde o SELECT evita tarefas duplicadas
+    cur.execute("BEGIN IMMEDIATE")
     companies = cur.execute(
         "SELECT id, user_id, responsavel_id FROM empresas ORDER BY id"
     ).fetchall()
@@ -194,10 +184,10 @@ def _sync_monthly_tasks_for(year: int, month: int) -> None:
         owner_id = int(company["responsavel_id"] or company["user_id"])
         for tipo, orgao, tributo, due_day, month_offset in rules:
             due_year, due_month = _shift_year_month(year, month, month_offset)
-            due_holidays = holidays if due_year == year else _br_holidays(due_year)
+            due_holidays = holidays if due_year == year else br_holidays(due_year)
             due_last_day = calendar.monthrange(due_year, due_month)[1]
             base_day = due_last_day if due_day is None else due_day
-            venc = _prev_business_day(date(due_year, due_month, base_day), due_holidays).isoformat()
+            venc = prev_business_day(date(due_year, due_month, base_day), due_holidays).isoformat()
 
             row = cur.execute(
                 """
@@ -233,17 +223,26 @@ def _sync_monthly_tasks_for(year: int, month: int) -> None:
                     (owner_id, company_id, tributo, tipo, orgao, tributo, competencia, venc),
                 )
 
+    cur.execute(
+        """
+        INSERT INTO app_settings (key, value, updated_at) VALUES (?, ?, datetime('now'))
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        """,
+        (MONTHLY_SYNC_KEY, competencia),
+    )
     conn.commit()
     conn.close()
 
 
 def _ensure_monthly_tasks_synced() -> None:
+    # _LAST_MONTHLY_SYNC e so cache do processo; a competencia sincronizada fica em app_settings para todos os workers
     global _LAST_MONTHLY_SYNC
     today = date.today()
     comp = f"{today.year}{today.month:02d}"
     if _LAST_MONTHLY_SYNC == comp:
         return
-    _sync_monthly_tasks_for(today.year, today.month)
+    if SettingsRepository().get_value(MONTHLY_SYNC_KEY) != comp:
+        _sync_monthly_tasks_for(today.year, today.month)
     _LAST_MONTHLY_SYNC = comp
 
 
@@ -264,56 +263,16 @@ def _can_edit(role: str) -> bool:
     return role in {"admin", "collab"}
 
 
+def _can_view_company(company: dict, role: str, scope_user_id: Optional[int]) -> bool:
+    # Mesmo escopo de GET /companies: admin/manager veem todas, collab so as que tem como responsavel
+    if _can_view_all(role):
+        return True
+    responsavel = company.get("responsavel_id")
+    return responsavel is not None and scope_user_id is not None and int(responsavel) == int(scope_user_id)
 
-def _normalize_cnpj(value: str) -> Optional[str]:
-    digits = re.sub(r"\D", "", value or "")
-    return digits if len(digits) == 14 else None
-
-
-def _extract_pdf_text(data: bytes) -> str:
-    try:
-        with pdfplumber.open(io.BytesIO(data)) as pdf:
-            parts = []
-            for page in pdf.pages:
-                parts.append(page.extract_text() or "")
-            return "\n".join(parts)
-    except Exception:
-        return ""
-
-
-def _find_cnpj(text: str) -> Optional[str]:
-    if not text:
-        return None
-    match = re.search(r"\b\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}\b", text)
-    if match:
-        return _normalize_cnpj(match.group(0))
-    match = re.search(r"\b\d{14}\b", text)
-    if match:
-        return _normalize_cnpj(match.group(0))
-    return None
-
-
-def _find_competencia(text: str) -> Optional[str]:
-    if not text:
-        return None
-    match = re.search(r"\b(0[1-9]|1[0-2])[/-](\d{4})\b", text)
-    if not match:
-        return None
-    mm, yyyy = match.group(1), match.group(2)
-    return f"{yyyy}{mm}"
-
-
-def _match_tributo(text: str, tributo: Optional[str]) -> Optional[bool]:
-    if not tributo:
-        return None
-    hay = (text or "").lower()
-    needle = tributo.lower().strip()
-    if not needle:
-        return None
-    return needle in hay
 
 bearer_scheme = HTTPBearer(auto_error=False)
-_PUBLIC_PATHS = {"/health", "/auth/login"}
+_PUBLIC_PATHS = {"/health", "/auth/login", "/metrics"}
 _PUBLIC_PREFIXES = ("/docs", "/redoc", "/openapi.json")
 
 
@@ -367,31 +326,23 @@ def _login_attempt_key(request: Request, nome: str) -> str:
     return f"{host}:{login_name}"
 
 
+# Tentativas ficam no banco (login_attempts): com varios workers o limite vale para o servidor inteiro
 def _is_login_rate_limited(key: str) -> bool:
-    entry = _LOGIN_ATTEMPTS.get(key)
-    if not entry:
-        return False
-    now = time.time()
-    if now - entry["first"] > LOGIN_WINDOW_SECONDS:
-        _LOGIN_ATTEMPTS.pop(key, None)
-        return False
-    return entry["count"] >= LOGIN_MAX_ATTEMPTS
+    return LoginAttemptRepository().count(key, time.time(), LOGIN_WINDOW_SECONDS) >= LOGIN_MAX_ATTEMPTS
 
 
 def _register_login_failure(key: str) -> None:
-    now = time.time()
-    entry = _LOGIN_ATTEMPTS.get(key)
-    if (not entry) or (now - entry["first"] > LOGIN_WINDOW_SECONDS):
-        _LOGIN_ATTEMPTS[key] = {"first": now, "count": 1}
-        return
-    entry["count"] += 1
+    LoginAttemptRepository().register_failure(key, time.time(), LOGIN_WINDOW_SECONDS)
 
 
 def _clear_login_failures(key: str) -> None:
-    _LOGIN_ATTEMPTS.pop(key, None)
+    LoginAttemptRepository().clear(key)
 
 
 app = FastAPI(title="41 Fiscal Hub API")
+# Rotas medem o endpoint e a serializacao separadamente (Server-Timing)
+app.router.route_class = TimedRoute
+_TIMING_ORIGINS = set(_cors_origins())
 app.add_middleware(
     CORSMiddleware,
     allow_origins=_cors_origins(),
@@ -432,8 +383,9 @@ async def auth_guard(request: Request, call_next):
         return JSONResponse(status_code=401, content={"detail": "Token ausente"})
 
     try:
-        payload = decode_access_token(token)
-        request.state.auth_user = _build_auth_user_from_payload(payload)
+        with stage("auth"):
+            payload = decode_access_token(token)
+            request.state.auth_user = _build_auth_user_from_payload(payload)
     except HTTPException as exc:
         return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
 
@@ -444,11 +396,54 @@ async def auth_guard(request: Request, call_next):
     return response
 
 
+# Registrado depois de auth_guard: fica por fora e mede tambem a autenticacao
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    db_stats = metrics.begin_request()
+    timings = server_timing.begin()
+    started = time.perf_counter()
+    status = 500
+    response = None
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        route = getattr(request.scope.get("route"), "path", None) or "<unrouted>"
+        metrics.end_request(route, request.method.upper(), status, elapsed, db_stats)
+        if timings is not None:
+            if response is not None:
+                response.headers["Server-Timing"] = server_timing.header_value(timings, elapsed, db_stats)
+                origin = request.headers.get("origin")
+                if origin and origin in _TIMING_ORIGINS:
+                    # sem isso o navegador esconde os tempos de outra origem (web em :5173)
+                    response.headers["Timing-Allow-Origin"] = origin
+            server_timing.maybe_log(timings, route, request.method.upper(), status, elapsed, db_stats)
+
+
+def run_startup_tasks() -> None:
+    """Migracoes e sincronizacao mensal. Roda uma vez no processo pai de app.serve, antes dos workers."""
+    with startup_lock():
+        init_db()
+        upgrade_archives()
+        UserRepository().migrate_plaintext_passwords()
+        _ensure_monthly_tasks_synced()
+
+
 @app.on_event("startup")
 def _startup() -> None:
-    init_db()
-    UserRepository().migrate_plaintext_passwords()
-    _ensure_monthly_tasks_synced()
+    # Sob app.serve o pai ja rodou; com uvicorn direto (um ou varios workers) o lock de arquivo serializa
+    if os.environ.get(STARTUP_DONE_ENV) != "1":
+        run_startup_tasks()
+    start_scheduler()
+    start_mailer()
+
+
+@app.on_event("shutdown")
+def _shutdown() -> None:
+    stop_scheduler()
+    stop_mailer()
 
 
 @app.get("/health")
@@ -456,6 +451,25 @@ def health():
     return {"ok": True}
 
 
+@app.get("/metrics")
+def metrics_endpoint(request: Request):
+    # Scraper do Prometheus nao usa o login da API: FISCAL_METRICS_TOKEN. Loopback sem token so com
+    # FISCAL_METRICS_LOCAL=1, porque atras de um proxy na mesma maquina toda requisicao vem de 127.0.0.1
+    expected = str(os.environ.get("FISCAL_METRICS_TOKEN") or "").strip()
+    if expected:
+        supplied = str(request.headers.get("authorization") or "").split(" ", 1)[-1].strip()
+        if not hmac.compare_digest(supplied, expected):
+            raise HTTPException(status_code=401, detail="Token de metricas invalido")
+    elif not (
+        os.environ.get("FISCAL_METRICS_LOCAL", "0") == "1"
+        and (request.client.host if request.client else "") in {"127.0.0.1", "::1"}
+    ):
+        raise HTTPException(status_code=403, detail="Defina FISCAL_METRICS_TOKEN para expor /metrics")
+    depth = queue_depth()
+    gauges = [("fiscal_jobs_due", (), float(depth["due"])), ("fiscal_jobs_running", (), float(depth["running"]))]
+    return Response(content=metrics.render(gauges), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.post("/maintenance/sync-monthly")
 def maintenance_sync_monthly(
     user_id: Optional[int] = Query(None),
@@ -478,6 +492,195 @@ def maintenance_sync_monthly(
     return {"ok": True, "competencia": _LAST_MONTHLY_SYNC}
 
 
+@app.post("/maintenance/rollup/rebuild")
+def maintenance_rollup_rebuild(user_id: Optional[int] = Query(None), auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    return {"ok": True, "rows": RollupRepository().rebuild()}
+
+
+@app.get("/maintenance/rollup/check")
+def maintenance_rollup_check(
+    user_id: Optional[int] = Query(None),
+    limit: int = 100,
+    auth_user: dict = Depends(_require_auth_user),
+):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    mismatches = RollupRepository().check(limit=limit)
+    return {"ok": not mismatches, "mismatches": mismatches}
+
+
+@app.get("/maintenance/archive")
+def maintenance_archive(user_id: Optional[int] = Query(None), auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    return {"years": archive_index()}
+
+
+@app.get("/maintenance/backup")
+def maintenance_backup_status(user_id: Optional[int] = Query(None), auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    return {**SettingsRepository().get_backup_status(), "generations": list_generations()}
+
+
+@app.post("/maintenance/backup", status_code=202)
+def maintenance_backup_start(user_id: Optional[int] = Query(None), auth_user: dict = Depends(_require_auth_user)):
+    # Roda em segundo plano; o resultado aparece em GET /maintenance/backup
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    if SettingsRepository().get_backup_status().get("running") or not start_backup_thread():
+        raise HTTPException(status_code=409, detail="Backup ja em andamento.")
+    return {"ok": True, "started": True}
+
+
+@app.get("/maintenance/jobs")
+def maintenance_jobs(user_id: Optional[int] = Query(None), auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    return {"jobs": list_jobs()}
+
+
+@app.post("/maintenance/jobs/{name}/run")
+def maintenance_job_run(
+    name: str,
+    user_id: Optional[int] = Query(None),
+    force: bool = Query(True),
+    auth_user: dict = Depends(_require_auth_user),
+):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    if get_job(name) is None:
+        raise HTTPException(status_code=404, detail="Job nao encontrado.")
+    try:
+        result = run_job(name, force=force)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Job falhou: {exc}")
+    if result is None:
+        raise HTTPException(status_code=409, detail="Job em execucao em outro processo ou ainda nao venceu.")
+    return {"ok": True, "name": name, "result": result}
+
+
+@app.get("/maintenance/slow-queries")
+def maintenance_slow_queries(
+    user_id: Optional[int] = Query(None),
+    limit: int = Query(50, ge=1, le=1000),
+    auth_user: dict = Depends(_require_auth_user),
+):
+    # Buffer em memoria do worker que atendeu; com varios workers o log "fiscal.slow_query" tem todos
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    return {**slow_queries.settings(), "entries": slow_queries.entries(limit)}
+
+
+@app.post("/maintenance/profile")
+def maintenance_profile_start(
+    route: str = Query(..., min_length=1, description="padrao glob da rota, ex.: /tasks/*/pdf"),
+    count: int = Query(10),
+    mode: str = Query("cprofile"),
+    method: Optional[str] = Query(None),
+    ttl_s: int = Query(600),
+    user_id: Optional[int] = Query(None),
+    auth_user: dict = Depends(_require_auth_user),
+):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    try:
+        session = profiling.start_session(route, count=count, mode=mode, method=method, ttl_s=ttl_s)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {"ok": True, "session": session}
+
+
+@app.get("/maintenance/profile")
+def maintenance_profile_status(user_id: Optional[int] = Query(None), auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    return profiling.status()
+
+
+@app.delete("/maintenance/profile")
+def maintenance_profile_stop(user_id: Optional[int] = Query(None), auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    return {"ok": True, "stopped": profiling.stop_session()}
+
+
+@app.get("/maintenance/profile/result")
+def maintenance_profile_result(
+    format: str = Query("pstats", pattern="^(pstats|text|collapsed)$"),
+    user_id: Optional[int] = Query(None),
+    auth_user: dict = Depends(_require_auth_user),
+):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    data = profiling.result(format)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Nenhum resultado de profiling para esse formato.")
+    if format == "pstats":
+        headers = {"Content-Disposition": 'attachment; filename="profile.prof"'}
+        return Response(content=data, media_type="application/octet-stream", headers=headers)
+    if format == "collapsed":
+        headers = {"Content-Disposition": 'attachment; filename="profile.folded"'}
+        return Response(content=data, media_type="text/plain; charset=utf-8", headers=headers)
+    return Response(content=data, media_type="text/plain; charset=utf-8")
+
+
+@app.delete("/maintenance/slow-queries")
+def maintenance_slow_queries_clear(user_id: Optional[int] = Query(None), auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    return {"ok": True, "removed": slow_queries.clear()}
+
+
+@app.get("/maintenance/pdf-store")
+def maintenance_pdf_store(user_id: Optional[int] = Query(None), auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    return PdfBlobRepository().stats()
+
+
+@app.post("/maintenance/pdf-store/migrate")
+def maintenance_pdf_store_migrate(
+    user_id: Optional[int] = Query(None),
+    batch_size: int = Query(50, ge=1, le=500),
+    max_batches: int = Query(20, ge=1, le=1000),
+    auth_user: dict = Depends(_require_auth_user),
+):
+    # Limitado por chamada: a migracao completa roda pelo CLI (python -m app.manage pdf-migrate)
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    summary = migrate_blobs(batch_size=batch_size, max_batches=max_batches)
+    return {"ok": True, **summary, "store": PdfBlobRepository().stats()}
+
+
+@app.get("/classifier/patterns", response_model=ClassifierPatternsOut)
+def list_classifier_patterns(auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    return ClassifierPatternRepository().list()
+
+
+@app.put("/classifier/patterns", response_model=ClassifierPatternsOut)
+def replace_classifier_patterns(payload: List[ClassifierPatternItem], auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    items = [p.model_dump() for p in payload]
+    if not items:
+        raise HTTPException(status_code=400, detail="Lista de padroes vazia.")
+    _, errors = compile_pattern_rows(items)
+    if errors:
+        raise HTTPException(status_code=400, detail={"errors": errors})
+    # Os workers recompilam ao notar a nova versao (FISCAL_PATTERNS_CHECK_SECONDS)
+    ClassifierPatternRepository().replace(items)
+    return ClassifierPatternRepository().list()
+
+
+@app.get("/classifier/stats")
+def classifier_stats(auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    return matcher_stats()
+
+
 @app.get("/users", response_model=List[UserOut])
 def list_users(auth_user: dict = Depends(_require_auth_user)):
     if auth_user["role"] not in {"admin", "manager"}:
@@ -502,15 +705,21 @@ def create_user(payload: UserCreate, auth_user: Optional[dict] = Depends(_option
 
     if repo.count() == 0:
         role = payload.role if payload.role in {"admin", "manager", "collab"} else "admin"
-        new_id = repo.create(payload.nome, role=role, is_default=True, senha=senha)
-        return {"id": new_id, "nome": payload.nome, "role": role, "is_default": True}
+        new_id = repo.create(payload.nome, role=role, is_default=True, senha=senha, email=payload.email)
+        return {"id": new_id, "nome": payload.nome, "role": role, "is_default": True, "email": payload.email.strip() or None}
 
     if not auth_user:
         raise HTTPException(status_code=401, detail="Autenticação obrigatória")
     _require_admin_user(auth_user)
 
-    new_id = repo.create(payload.nome, role=payload.role, is_default=payload.is_default, senha=senha)
-    return {"id": new_id, "nome": payload.nome, "role": payload.role, "is_default": payload.is_default}
+    new_id = repo.create(payload.nome, role=payload.role, is_default=payload.is_default, senha=senha, email=payload.email)
+    return {
+        "id": new_id,
+        "nome": payload.nome,
+        "role": payload.role,
+        "is_default": payload.is_default,
+        "email": payload.email.strip() or None,
+    }
 
 
 @app.post("/auth/login", response_model=AuthLoginOut)
@@ -562,6 +771,21 @@ def update_user_role(user_id: int, payload: UserRoleUpdate, auth_user: dict = De
     return {"ok": True}
 
 
+@app.patch("/users/{user_id}/email")
+def update_user_email(user_id: int, payload: UserEmailUpdate, auth_user: dict = Depends(_require_auth_user)):
+    # Cada um troca o proprio e-mail; admin troca o de qualquer usuario
+    if int(auth_user["id"]) != int(user_id):
+        _require_admin_user(auth_user)
+    email = payload.email.strip()
+    if email and ("@" not in email or " " in email):
+        raise HTTPException(status_code=400, detail="E-mail inválido.")
+    repo = UserRepository()
+    if repo.get(user_id) is None:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado.")
+    repo.update_email(user_id, email)
+    return {"ok": True}
+
+
 @app.get("/settings/server", response_model=ServerSettingsOut)
 def get_server_settings(user_id: Optional[int] = Query(None), auth_user: dict = Depends(_require_auth_user)):
     _require_admin_user(auth_user)
@@ -594,6 +818,137 @@ def update_email_settings(payload: EmailSettingsUpdate, user_id: Optional[int] =
     return repo.set_email(payload.model_dump())
 
 
+@app.post("/emails", status_code=202, response_model=EmailOutboxOut)
+def send_email(payload: EmailSendPayload, request: Request, user_id: Optional[int] = Query(None)):
+    # So enfileira: o envio sai pela thread do mailer (app.mailer), fora da requisicao
+    auth_user = request.state.auth_user
+    scope_user_id = _resolve_query_user_id(auth_user, user_id)
+    role = str(auth_user.get("role") or "collab")
+    # O e-mail sai em nome de quem chama (admin atua por outro via ?user_id=, como nos outros endpoints)
+    if payload.user_id is not None and int(payload.user_id) != scope_user_id:
+        raise HTTPException(status_code=403, detail="Sem permissão para atuar em nome de outro usuário.")
+    company = CompanyRepository().get(payload.company_id)
+    if not company or not _can_view_company(company, role, scope_user_id):
+        raise HTTPException(status_code=404, detail="Empresa não encontrada.")
+    if payload.task_id is not None:
+        task = TaskRepository().get(payload.task_id, None if _can_view_all(role) else scope_user_id)
+        if not task or int(task["company_id"]) != int(payload.company_id):
+            raise HTTPException(status_code=404, detail="Tarefa não encontrada.")
+        if payload.attach_pdf and not task.get("has_pdf"):
+            raise HTTPException(status_code=400, detail="Tarefa sem PDF para anexar.")
+    elif payload.attach_pdf:
+        raise HTTPException(status_code=400, detail="attach_pdf exige task_id.")
+    recipients = [e.strip() for e in payload.to_emails if e.strip()]
+    if not recipients:
+        principal = str(company.get("email_principal") or "").strip()
+        recipients = list(dict.fromkeys(([principal] if principal else []) + list(company.get("emails_extra") or [])))
+    if not recipients:
+        raise HTTPException(status_code=400, detail="Empresa sem e-mail cadastrado.")
+    outbox = EmailOutboxRepository()
+    dedupe_key = f"manual:{os.urandom(8).hex()}"
+    enqueue_emails(
+        [
+            {
+                "company_id": payload.company_id,
+                "user_id": scope_user_id,
+                "task_id": payload.task_id,
+                "to_emails": recipients,
+                "subject": payload.subject,
+                "body": payload.body,
+                "link": payload.link,
+                "attach_pdf": payload.attach_pdf,
+                "dedupe_key": dedupe_key,
+            }
+        ]
+    )
+    return outbox.get_by_dedupe_key(dedupe_key)
+
+
+@app.post("/emails/guides", status_code=202)
+def send_guides(
+    request: Request,
+    competencia: str = Query(...),
+    company_id: Optional[int] = Query(None),
+    user_id: Optional[int] = Query(None),
+):
+    """Fechamento do mes: enfileira a guia (PDF guardado) de cada tarefa da competencia para os e-mails da empresa."""
+    auth_user = request.state.auth_user
+    scope_user_id = _resolve_query_user_id(auth_user, user_id)
+    if not _can_view_all(str(auth_user.get("role") or "collab")):
+        raise HTTPException(status_code=403, detail="Sem permissão.")
+    comp = competencia.strip()
+    if not comp:
+        raise HTTPException(status_code=400, detail="competencia é obrigatória")
+    outbox = EmailOutboxRepository()
+    items = []
+    without_email = 0
+    for row in outbox.guide_rows(comp, company_id):
+        if not row["to_emails"]:
+            without_email += 1
+            continue
+        label = f"{row['tributo'] or row['titulo']} {comp}"
+        body = f"Segue em anexo a guia {label} de {row['nome']}."
+        if row.get("vencimento"):
+            body += f" Vencimento: {row['vencimento']}."
+        items.append(
+            {
+                "company_id": row["company_id"],
+                "user_id": scope_user_id,
+                "task_id": row["task_id"],
+                "to_emails": row["to_emails"],
+                "subject": f"Guia {label} - {row['nome']}",
+                "body": body,
+                "attach_pdf": True,
+                # mesma guia (mesmo PDF) nao sai duas vezes se o fechamento for disparado de novo
+                "dedupe_key": f"guia:{row['task_id']}:{row['pdf_sha256'] or 'blob'}",
+            }
+        )
+    queued = enqueue_emails(items)
+    return {"competencia": comp, "queued": queued, "already_queued": len(items) - queued, "without_email": without_email}
+
+
+@app.get("/emails/outbox")
+def list_email_outbox(
+    status: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    user_id: Optional[int] = Query(None),
+    auth_user: dict = Depends(_require_auth_user),
+):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    repo = EmailOutboxRepository()
+    items = [EmailOutboxOut(**item).model_dump() for item in repo.list(status=status, limit=limit)]
+    return {"stats": repo.stats(), "items": items}
+
+
+@app.post("/emails/outbox/{outbox_id}/retry", response_model=EmailOutboxOut)
+def retry_email(outbox_id: int, user_id: Optional[int] = Query(None), auth_user: dict = Depends(_require_auth_user)):
+    _require_admin_user(auth_user)
+    _resolve_query_user_id(auth_user, user_id)
+    repo = EmailOutboxRepository()
+    if repo.get(outbox_id) is None:
+        raise HTTPException(status_code=404, detail="E-mail não encontrado.")
+    if not repo.requeue(outbox_id):
+        raise HTTPException(status_code=409, detail="Só e-mail com falha volta para a fila.")
+    wake_mailer()
+    return repo.get(outbox_id)
+
+
+@app.get("/emails/logs", response_model=List[EmailLogOut])
+def list_email_logs(
+    request: Request,
+    company_id: Optional[int] = Query(None),
+    task_id: Optional[int] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    user_id: Optional[int] = Query(None),
+):
+    auth_user = request.state.auth_user
+    _resolve_query_user_id(auth_user, user_id)
+    if not _can_view_all(str(auth_user.get("role") or "collab")):
+        raise HTTPException(status_code=403, detail="Sem permissão.")
+    return EmailLogRepository().list(company_id=company_id, task_id=task_id, limit=limit)
+
+
 @app.get("/companies", response_model=List[CompanyOut])
 def list_companies(
     request: Request,
@@ -625,6 +980,20 @@ def list_companies(
     )
 
 
+@app.get("/companies/lookup", response_model=CompanyOut)
+def lookup_company_by_cnpj(request: Request, cnpj: str, user_id: Optional[int] = Query(None)):
+    auth_user = request.state.auth_user
+    scope_user_id = _resolve_query_user_id(auth_user, user_id)
+    role = str(auth_user.get("role") or "collab")
+
+    if not normalize_cnpj(cnpj):
+        raise HTTPException(status_code=400, detail="CNPJ deve conter 14 digitos.")
+    company = CompanyRepository().get_by_cnpj(cnpj)
+    if not company or not _can_view_company(company, role, scope_user_id):
+        raise HTTPException(status_code=404, detail="Empresa não encontrada.")
+    return company
+
+
 @app.post("/companies", response_model=CompanyOut)
 def create_company(payload: CompanyCreate, request: Request):
     auth_user = request.state.auth_user
@@ -641,17 +1010,22 @@ def create_company(payload: CompanyCreate, request: Request):
         payload.responsavel_id = actor_id
 
     repo = CompanyRepository()
-    new_id = repo.create(
-        user_id=actor_id,
-        nome=payload.nome,
-        cnpj=payload.cnpj,
-        ie=payload.ie,
-        regime=payload.regime,
-        observacoes=payload.observacoes,
-        data_entrada=payload.data_entrada,
-        data_saida=payload.data_saida,
-        responsavel_id=payload.responsavel_id,
-    )
+    try:
+        new_id = repo.create(
+            user_id=actor_id,
+            nome=payload.nome,
+            cnpj=payload.cnpj,
+            ie=payload.ie,
+            regime=payload.regime,
+            observacoes=payload.observacoes,
+            data_entrada=payload.data_entrada,
+            data_saida=payload.data_saida,
+            responsavel_id=payload.responsavel_id,
+            email_principal=payload.email_principal,
+            emails_extra=payload.emails_extra,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
     created = repo.get(new_id)
     return created or {
         "id": new_id,
@@ -679,18 +1053,23 @@ def update_company(company_id: int, payload: CompanyUpdate, request: Request, us
             raise HTTPException(status_code=403, detail="Collab não pode atribuir outro responsável.")
 
     repo = CompanyRepository()
-    repo.update(
-        user_id=None if role == "admin" else actor_id,
-        company_id=company_id,
-        nome=payload.nome,
-        cnpj=payload.cnpj,
-        ie=payload.ie,
-        regime=payload.regime,
-        observacoes=payload.observacoes,
-        data_entrada=payload.data_entrada,
-        data_saida=payload.data_saida,
-        responsavel_id=payload.responsavel_id,
-    )
+    try:
+        repo.update(
+            user_id=None if role == "admin" else actor_id,
+            company_id=company_id,
+            nome=payload.nome,
+            cnpj=payload.cnpj,
+            ie=payload.ie,
+            regime=payload.regime,
+            observacoes=payload.observacoes,
+            data_entrada=payload.data_entrada,
+            data_saida=payload.data_saida,
+            responsavel_id=payload.responsavel_id,
+            email_principal=payload.email_principal,
+            emails_extra=payload.emails_extra,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
     updated = repo.get(company_id)
     return updated or {
         "id": company_id,
@@ -793,6 +1172,155 @@ def list_upcoming_tasks(
     ]
 
 
+@app.get("/search", response_model=SearchOut)
+def search(request: Request, q: str = "", user_id: Optional[int] = Query(None), limit: int = 20):
+    auth_user = request.state.auth_user
+    scope_user_id = _resolve_query_user_id(auth_user, user_id)
+    role = str(auth_user.get("role") or "collab")
+    scoped = None if _can_view_all(role) else scope_user_id
+    return SearchRepository().search(q, user_id=scoped, responsavel_id=scoped, limit=limit)
+
+
+@app.get("/reports/summary", response_model=ReportSummaryOut)
+def report_summary(
+    request: Request,
+    user_id: Optional[int] = Query(None),
+    group_by: Optional[List[str]] = Query(None),
+    company_id: Optional[int] = None,
+    status: Optional[List[str]] = Query(None),
+    tipo: Optional[str] = None,
+    orgao: Optional[str] = None,
+    competencia: Optional[str] = None,
+    competencia_from: Optional[str] = None,
+    competencia_to: Optional[str] = None,
+):
+    _ensure_monthly_tasks_synced()
+    auth_user = request.state.auth_user
+    scope_user_id = _resolve_query_user_id(auth_user, user_id)
+    role = str(auth_user.get("role") or "collab")
+    list_user_id = None if _can_view_all(role) else scope_user_id
+
+    dims = group_by or list(ReportRepository.DEFAULT_GROUP_BY)
+    try:
+        rows = ReportRepository().summary(
+            user_id=list_user_id,
+            group_by=dims,
+            company_id=company_id,
+            status=status,
+            tipo=tipo,
+            orgao=orgao,
+            competencia=competencia,
+            competencia_from=competencia_from,
+            competencia_to=competencia_to,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return {
+        "group_by": dims,
+        "total": sum(int(r.get("total") or 0) for r in rows),
+        "rows": rows,
+    }
+
+
+_XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _sheet_response(
+    request: Request, fmt: str, filename: str, header: List[str], rows: Iterable[Sequence[object]], sep: str = ";"
+) -> StreamingResponse:
+    """Resposta em streaming; CSV sai com gzip quando o cliente aceita (XLSX ja e comprimido)."""
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{fmt}"', "Cache-Control": "no-store"}
+    if fmt == "xlsx":
+        return StreamingResponse(xlsx_chunks(header, rows), media_type=_XLSX_MEDIA_TYPE, headers=headers)
+    body = csv_chunks(header, rows, sep=sep)
+    headers["Vary"] = "Accept-Encoding"
+    if accepts_gzip(request.headers.get("accept-encoding")):
+        headers["Content-Encoding"] = "gzip"
+        body = gzip_chunks(body)
+    return StreamingResponse(body, media_type="text/csv; charset=utf-8", headers=headers)
+
+
+@app.get("/exports/tasks.{fmt}")
+def export_tasks(
+    fmt: str,
+    request: Request,
+    user_id: Optional[int] = Query(None),
+    company_id: Optional[int] = None,
+    status: Optional[List[str]] = Query(None),
+    tipo: Optional[str] = None,
+    competencia: Optional[str] = None,
+    sep: str = Query(";", pattern="^[;,]$"),
+):
+    # Mesmos filtros e escopo de GET /tasks; as linhas saem do cursor em lotes, sem lista em memoria
+    if fmt not in ("csv", "xlsx"):
+        raise HTTPException(status_code=404, detail="Formato não suportado (csv ou xlsx).")
+    # antes de abrir o cursor: depois do primeiro byte o erro so cortaria o arquivo
+    if competencia and not normalize_competencia(competencia):
+        raise HTTPException(status_code=400, detail="Competência inválida (use AAAAMM ou MM/AAAA).")
+    _ensure_monthly_tasks_synced()
+    auth_user = request.state.auth_user
+    scope_user_id = _resolve_query_user_id(auth_user, user_id)
+    role = str(auth_user.get("role") or "collab")
+    list_user_id = None if _can_view_all(role) else scope_user_id
+    try:
+        rows = TaskRepository().iter_export(
+            user_id=list_user_id,
+            company_id=company_id,
+            status=status,
+            tipo=tipo,
+            competencia=competencia,
+        )
+        # primeiro next() abre a conexao e executa a consulta: erro de filtro ainda vira 400, nao resposta cortada
+        first = next(rows, None)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    columns = list(TaskRepository.EXPORT_COLUMNS)
+
+    def all_rows():
+        if first is not None:
+            yield first
+            yield from rows
+
+    filename = f"tarefas-{competencia or date.today().isoformat()}".replace("/", "-")
+    return _sheet_response(
+        request, fmt, filename, [TASK_HEADERS[c] for c in columns], task_rows(all_rows(), columns), sep
+    )
+
+
+@app.get("/exports/summary.{fmt}")
+def export_summary(
+    fmt: str,
+    request: Request,
+    user_id: Optional[int] = Query(None),
+    group_by: Optional[List[str]] = Query(None),
+    company_id: Optional[int] = None,
+    status: Optional[List[str]] = Query(None),
+    tipo: Optional[str] = None,
+    orgao: Optional[str] = None,
+    competencia: Optional[str] = None,
+    competencia_from: Optional[str] = None,
+    competencia_to: Optional[str] = None,
+    sep: str = Query(";", pattern="^[;,]$"),
+):
+    if fmt not in ("csv", "xlsx"):
+        raise HTTPException(status_code=404, detail="Formato não suportado (csv ou xlsx).")
+    summary = report_summary(
+        request,
+        user_id=user_id,
+        group_by=group_by,
+        company_id=company_id,
+        status=status,
+        tipo=tipo,
+        orgao=orgao,
+        competencia=competencia,
+        competencia_from=competencia_from,
+        competencia_to=competencia_to,
+    )
+    columns = [*summary["group_by"], "total", "with_pdf", "overdue"]
+    rows = ([r.get(c) for c in columns] for r in summary["rows"])
+    return _sheet_response(request, fmt, "resumo-tarefas", columns, rows, sep)
+
+
 @app.post("/tasks", response_model=TaskOut)
 def create_task(payload: TaskCreate, request: Request):
     auth_user = request.state.auth_user
@@ -910,7 +1438,8 @@ async def upload_pdf(task_id: int, request: Request, user_id: Optional[int] = Qu
     if len(data) > MAX_PDF_BYTES:
         raise HTTPException(status_code=413, detail=f"Arquivo excede limite de {MAX_PDF_MB}MB.")
     repo = TaskRepository()
-    repo.update_pdf(task_id, None if role == "admin" else scope_user_id, file.filename, data)
+    sha256, _ = put_pdf(data)
+    repo.update_pdf(task_id, None if role == "admin" else scope_user_id, file.filename, sha256, len(data))
 
     TaskLogRepository().create(
         task_id=task_id,
@@ -919,19 +1448,29 @@ async def upload_pdf(task_id: int, request: Request, user_id: Optional[int] = Qu
         details=file.filename,
     )
 
-    classification = classify_filename(file.filename)
-    status = "ok" if classification.get("tributo") else "needs_review"
+    # Texto extraido e varrido uma vez: serve ao classificador de conteudo e as checagens de inconsistencia
+    with timed("pdf_extract"):
+        text_pdf = extract_pdf_text(data)
+    task_row = repo.get(task_id, None if role == "admin" else scope_user_id)
+    # Uma passada so sobre o texto; o tributo da tarefa entra nos apelidos procurados
+    with timed("text_scan"):
+        scan = scan_text(text_pdf, [task_row.get("tributo") or ""] if task_row else [])
+    with timed("classify_filename"):
+        by_name = classify_filename(file.filename)
+    with timed("classify_text"):
+        by_text = classify_text(text_pdf, scan)
+    classification = merge_content(by_name, by_text)
+    status = review_status(classification.get("tributo"), classification.get("fonte"))
     classification["status"] = status
     classification["task_id"] = task_id
     classification["user_id"] = scope_user_id
 
     suggestions = []
     if status != "ok":
-        task_row = repo.get(task_id, None if role == "admin" else scope_user_id)
         if task_row:
             suggestions = repo.find_similar(company_id=int(task_row["company_id"]), text=classification.get("raw_text") or "")
 
-    json_path = save_classification_json(classification)
+    log_ref = record_classification(classification)
     class_repo = ClassificationRepository()
     class_repo.create(
         task_id=task_id,
@@ -948,23 +1487,36 @@ async def upload_pdf(task_id: int, request: Request, user_id: Optional[int] = Qu
         confianca=classification.get("confianca") or 0,
         status=status,
         raw_text=classification.get("raw_text") or "",
+        fonte=classification.get("fonte"),
+        log_segment=log_ref["log_segment"],
+        log_offset=log_ref["log_offset"],
     )
 
-    task_row = repo.get(task_id, None if role == "admin" else scope_user_id)
+    pdf_company = None
     if task_row:
         company = CompanyRepository().get(int(task_row["company_id"]))
-        text_pdf = _extract_pdf_text(data)
         issues = []
+        # o valor esperado vence se aparecer em qualquer ponto do texto
         if company and company.get("cnpj"):
-            cnpj_pdf = _find_cnpj(text_pdf)
-            cnpj_expected = _normalize_cnpj(company.get("cnpj") or "")
+            cnpj_expected = normalize_cnpj(company.get("cnpj") or "")
+            cnpj_pdf = scan.best_cnpj(cnpj_expected)
             if cnpj_pdf and cnpj_expected and cnpj_pdf != cnpj_expected:
-                issues.append(f"CNPJ diferente (PDF {cnpj_pdf} != Empresa {cnpj_expected})")
+                issue = f"CNPJ diferente (PDF {cnpj_pdf} != Empresa {cnpj_expected})"
+                owner = CompanyRepository().get_by_cnpj(cnpj_pdf)
+                # Dono do CNPJ so aparece para quem enxerga a empresa (como em /companies/lookup); o log e a
+                # notificacao vao tambem para o responsavel da tarefa, que precisa enxerga-la
+                if owner and _can_view_company(owner, role, scope_user_id):
+                    pdf_company = {"id": int(owner["id"]), "nome": str(owner["nome"])}
+                    notify_id = task_row.get("user_id")
+                    if notify_id is None or _can_view_company(owner, _get_role(int(notify_id)), int(notify_id)):
+                        issue += f"; CNPJ do PDF pertence a {owner['nome']} (id {owner['id']})"
+                issues.append(issue)
         comp_expected = (task_row.get("competencia") or "").strip()
-        comp_pdf = _find_competencia(text_pdf)
-        if comp_expected and comp_pdf and comp_pdf != comp_expected:
+        comp_key = normalize_competencia(comp_expected)
+        comp_pdf = scan.best_competencia(comp_key)
+        if comp_key and comp_pdf and comp_pdf != comp_key:
             issues.append(f"Competência diferente (PDF {comp_pdf} != Tarefa {comp_expected})")
-        trib_match = _match_tributo(text_pdf, task_row.get("tributo"))
+        trib_match = scan.has_tributo(task_row.get("tributo"))
         if trib_match is False:
             issues.append("Tributo não encontrado no PDF")
         if issues:
@@ -983,7 +1535,14 @@ async def upload_pdf(task_id: int, request: Request, user_id: Optional[int] = Qu
                     message=f"Inconsistência na tarefa {task_row.get('titulo')}: " + "; ".join(issues),
                 )
 
-    return {"ok": True, "classification": classification, "json_path": json_path, "suggestions": suggestions}
+    return {
+        "ok": True,
+        "classification": classification,
+        "json_path": log_ref["json_path"],
+        "log_segment": log_ref["log_segment"],
+        "suggestions": suggestions,
+        "pdf_company": pdf_company,
+    }
 
 
 @app.get("/tasks/{task_id}/logs", response_model=List[TaskLogOut])
@@ -999,6 +1558,25 @@ def list_task_logs(task_id: int, request: Request, user_id: Optional[int] = Quer
     return TaskLogRepository().list(task_id=task_id)
 
 
+@app.get("/tasks/{task_id}/classifications")
+def list_task_classifications(task_id: int, request: Request, user_id: Optional[int] = Query(None)):
+    auth_user = request.state.auth_user
+    scope_user_id = _resolve_query_user_id(auth_user, user_id)
+    role = str(auth_user.get("role") or "collab")
+
+    repo = TaskRepository()
+    task = repo.get(task_id, None if _can_view_all(role) else scope_user_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada.")
+    rows = ClassificationRepository().list_for_task(task_id)
+    # Linhas antigas (antes do log) nao tem segmento: devolvem so as colunas da tabela
+    with_log = [r for r in rows if r.get("log_segment")]
+    entries = read_entries([(str(r["log_segment"]), int(r["log_offset"] or 0)) for r in with_log])
+    for row, entry in zip(with_log, entries):
+        row["entry"] = entry
+    return rows
+
+
 @app.get("/tasks/{task_id}/comments", response_model=List[TaskCommentOut])
 def list_task_comments(task_id: int, request: Request, user_id: Optional[int] = Query(None)):
     auth_user = request.state.auth_user
@@ -1122,13 +1700,33 @@ def download_pdf(task_id: int, request: Request, user_id: Optional[int] = Query(
 
     repo = TaskRepository()
     row = repo.get_pdf(task_id, None if _can_view_all(role) else scope_user_id)
-    if not row or not row.get("pdf_blob"):
+    if not row or not (row.get("pdf_sha256") or row.get("pdf_blob")):
         raise HTTPException(status_code=404, detail="PDF não encontrado.")
 
-    data = row["pdf_blob"]
     filename = row.get("pdf_path") or f"task_{task_id}.pdf"
-    return StreamingResponse(
-        iter([data]),
+    # O hash do conteudo e o ETag: o navegador revalida e recebe 304 sem baixar de novo
+    path = stored_path(row)
+    if path is not None:
+        etag = f'"{row["pdf_sha256"]}"'
+    elif row.get("pdf_blob"):
+        data = bytes(row["pdf_blob"])
+        etag = f'"{hashlib.sha256(data).hexdigest()}"'
+    else:
+        raise HTTPException(status_code=404, detail="PDF não encontrado.")
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    if path is not None:
+        # FileResponse envia o arquivo direto do disco (sendfile quando o servidor suporta)
+        return FileResponse(
+            path,
+            media_type="application/pdf",
+            filename=filename,
+            content_disposition_type="inline",
+            headers=headers,
+        )
+    return Response(
+        content=data,
         media_type="application/pdf",
-        headers={"Content-Disposition": f'inline; filename="{filename}"'},
+        headers={**headers, "Content-Disposition": f'inline; filename="{filename}"'},
     )
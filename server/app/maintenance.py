@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, List
+
+from .db import _connect
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+# Paginas devolvidas por chamada de incremental_vacuum e tempo maximo gasto nisso por execucao
+VACUUM_STEP_PAGES = max(1, _env_int("FISCAL_VACUUM_STEP_PAGES", 2048))
+VACUUM_BUDGET_S = max(0, _env_int("FISCAL_VACUUM_BUDGET_MS", 2000)) / 1000
+# Linhas amostradas por indice no PRAGMA optimize (0 = sem limite)
+ANALYSIS_LIMIT = max(0, _env_int("FISCAL_ANALYSIS_LIMIT", 1000))
+
+_AUTO_VACUUM = {0: "none", 1: "full", 2: "incremental"}
+
+
+def _file_stats(conn: sqlite3.Connection) -> Dict[str, int]:
+    page_size = int(conn.execute("PRAGMA page_size").fetchone()[0])
+    pages = int(conn.execute("PRAGMA page_count").fetchone()[0])
+    free = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+    return {"page_size": page_size, "pages": pages, "free_pages": free, "bytes": pages * page_size}
+
+
+def run_db_maintenance(
+    *,
+    analyze: bool = False,
+    vacuum_pages: int = VACUUM_STEP_PAGES,
+    vacuum_budget_s: float = VACUUM_BUDGET_S,
+    checkpoint: str = "TRUNCATE",
+) -> Dict[str, object]:
+    """Estatisticas do planner, devolucao de paginas livres e checkpoint do WAL, com o tempo de cada passo.
+
+    analyze=True forca ANALYZE completo; sem isso roda PRAGMA optimize (ANALYZE so onde o SQLite acha
+    que as estatisticas envelheceram), ou ANALYZE na primeira vez, quando sqlite_stat1 nao existe.
+    """
+    conn = _connect()
+    steps: List[Dict[str, object]] = []
+
+    def step(name: str, fn: Callable[[], Dict[str, object]]) -> None:
+        started = time.perf_counter()
+        detail = fn()
+        steps.append({"step": name, "ms": round((time.perf_counter() - started) * 1000, 1), **detail})
+
+    try:
+        before = _file_stats(conn)
+        auto_vacuum = _AUTO_VACUUM.get(int(conn.execute("PRAGMA auto_vacuum").fetchone()[0]), "?")
+        journal = str(conn.execute("PRAGMA journal_mode").fetchone()[0]).lower()
+
+        def do_analyze() -> Dict[str, object]:
+            has_stats = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+            ).fetchone()
+            if analyze or not has_stats:
+                conn.execute("ANALYZE")
+                conn.commit()
+                return {"mode": "analyze"}
+            conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+            conn.execute("PRAGMA optimize")
+            conn.commit()
+            return {"mode": "optimize"}
+
+        def do_vacuum() -> Dict[str, object]:
+            if auto_vacuum != "incremental":
+                # auto_vacuum=none nao libera paginas sem VACUUM completo (convert_auto_vacuum)
+                return {"skipped": f"auto_vacuum={auto_vacuum}", "free_pages": before["free_pages"]}
+            released = 0
+            calls = 0
+            deadline = time.perf_counter() + max(0.0, float(vacuum_budget_s))
+            while True:
+                free = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+                if free <= 0 or (calls and time.perf_counter() >= deadline):
+                    break
+                # execute() do sqlite3 da um passo so (uma pagina); executescript roda o PRAGMA ate o fim
+                conn.executescript(f"PRAGMA incremental_vacuum({min(free, max(1, int(vacuum_pages)))});")
+                released += free - int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+                calls += 1
+            return {"released_pages": released, "calls": calls, "free_pages": free}
+
+        def do_checkpoint() -> Dict[str, object]:
+            if journal != "wal":
+                return {"skipped": f"journal_mode={journal}"}
+            mode = checkpoint.upper() if checkpoint.upper() in {"PASSIVE", "FULL", "RESTART", "TRUNCATE"} else "PASSIVE"
+            busy, log_frames, done = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+            return {"mode": mode, "busy": int(busy), "wal_frames": int(log_frames), "checkpointed": int(done)}
+
+        step("analyze", do_analyze)
+        step("incremental_vacuum", do_vacuum)
+        step("wal_checkpoint", do_checkpoint)
+        after = _file_stats(conn)
+    finally:
+        conn.close()
+    return {
+        "auto_vacuum": auto_vacuum,
+        "journal_mode": journal,
+        "before": before,
+        "after": after,
+        "steps": steps,
+        "total_ms": round(sum(float(s["ms"]) for s in steps), 1),
+    }
+
+
+def convert_auto_vacuum() -> Dict[str, object]:
+    """Liga auto_vacuum=INCREMENTAL num banco existente. Roda VACUUM completo: bloqueia escritas ate terminar."""
+    conn = _connect()
+    try:
+        before = _file_stats(conn)
+        started = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        after = _file_stats(conn)
+        mode = _AUTO_VACUUM.get(int(conn.execute("PRAGMA auto_vacuum").fetchone()[0]), "?")
+    finally:
+        conn.close()
+    return {"auto_vacuum": mode, "before": before, "after": after, "ms": round((time.perf_counter() - started) * 1000, 1)}
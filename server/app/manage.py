@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from datetime import date
+from typing import List, Optional
+
+from .archive import archive_index, archive_year
+from .backup import KEEP_GENERATIONS, PAGES_PER_STEP, STEP_SLEEP_S, run_backup
+from .classification_log import compress_closed_segments
+from .db import init_db
+from .digest import DIGEST_BUSINESS_DAYS, DIGEST_CLIENTS, run_due_digest
+from .jobs import get_job, list_jobs, run_job
+from .mailer import deliver_pending
+from .maintenance import VACUUM_BUDGET_S, VACUUM_STEP_PAGES, convert_auto_vacuum, run_db_maintenance
+from .pdf_store import collect_garbage, migrate_blobs
+from .reclassify import run_reclassification
+from .repositories import EmailOutboxRepository, PdfBlobRepository, RollupRepository
+from .smtp_sink import serve as serve_smtp_sink
+from .text_scan import benchmark as scan_benchmark
+
+
+def _print(data: object) -> None:
+    print(json.dumps(data, ensure_ascii=False, indent=2, default=str))
+
+
+def _cmd_rollup_rebuild(args: argparse.Namespace) -> int:
+    _print({"rows": RollupRepository().rebuild()})
+    return 0
+
+
+def _cmd_rollup_check(args: argparse.Namespace) -> int:
+    mismatches = RollupRepository().check(limit=args.limit)
+    _print({"ok": not mismatches, "mismatches": mismatches})
+    return 0 if not mismatches else 1
+
+
+def _cmd_reclassify(args: argparse.Namespace) -> int:
+    def progress(state: dict) -> None:
+        print(
+            f"ate id {state['last_id']}: {state['scanned']} lidas, {state['changed']} alteradas",
+            file=sys.stderr,
+            flush=True,
+        )
+
+    state = run_reclassification(
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        statuses=["needs_review"] if args.only_needs_review else None,
+        with_pdfs=args.with_pdfs,
+        restart=args.restart,
+        dry_run=args.dry_run,
+        progress=None if args.quiet else progress,
+    )
+    top = sorted(state["tributo"].items(), key=lambda kv: (-kv[1], kv[0]))[: args.top]
+    _print({**state, "tributo": dict(top), "dry_run": bool(args.dry_run)})
+    return 0
+
+
+def _cmd_classification_log_compress(args: argparse.Namespace) -> int:
+    _print({"compressed": compress_closed_segments()})
+    return 0
+
+
+def _cmd_archive_year(args: argparse.Namespace) -> int:
+    try:
+        summary = archive_year(args.year, force=args.force, dry_run=args.dry_run, vacuum=args.vacuum)
+    except ValueError as exc:
+        print(str(exc), file=sys.stderr)
+        return 1
+    _print(summary)
+    return 0
+
+
+def _cmd_archive_list(args: argparse.Namespace) -> int:
+    _print(archive_index())
+    return 0
+
+
+def _cmd_backup(args: argparse.Namespace) -> int:
+    def progress(info: dict) -> None:
+        if info["steps"] % 50 == 0:
+            print(f"{info['total'] - info['remaining']}/{info['total']} paginas", file=sys.stderr, flush=True)
+
+    try:
+        result = run_backup(
+            pages_per_step=args.pages,
+            sleep_s=args.sleep_ms / 1000,
+            keep=args.keep,
+            with_files=not args.db_only,
+            progress=None if args.quiet else progress,
+        )
+    except RuntimeError as exc:
+        print(str(exc), file=sys.stderr)
+        return 1
+    _print(result)
+    return 0
+
+
+def _cmd_db_maintenance(args: argparse.Namespace) -> int:
+    if args.convert_auto_vacuum:
+        print("VACUUM completo para ligar auto_vacuum=INCREMENTAL (bloqueia escritas)...", file=sys.stderr, flush=True)
+        _print({"convert": convert_auto_vacuum()})
+    _print(
+        run_db_maintenance(
+            analyze=args.analyze, vacuum_pages=args.vacuum_pages, vacuum_budget_s=args.budget_ms / 1000
+        )
+    )
+    return 0
+
+
+def _cmd_jobs(args: argparse.Namespace) -> int:
+    _print(list_jobs())
+    return 0
+
+
+def _cmd_job_run(args: argparse.Namespace) -> int:
+    if get_job(args.name) is None:
+        print(f"Job desconhecido: {args.name}", file=sys.stderr)
+        return 1
+    result = run_job(args.name, force=args.force)
+    if result is None:
+        print("Job nao rodou: ainda nao venceu ou outro processo esta com o lease (use --force)", file=sys.stderr)
+        return 1
+    _print(result)
+    return 0
+
+
+def _cmd_pdf_migrate(args: argparse.Namespace) -> int:
+    def progress(summary: dict) -> None:
+        print(f"lote {summary['batches']}: {summary['moved']} movidos", file=sys.stderr, flush=True)
+
+    summary = migrate_blobs(
+        batch_size=args.batch_size,
+        max_batches=args.max_batches,
+        pause_s=args.pause,
+        progress=None if args.quiet else progress,
+    )
+    _print({**summary, "store": PdfBlobRepository().stats()})
+    return 0
+
+
+def _cmd_pdf_gc(args: argparse.Namespace) -> int:
+    _print({**collect_garbage(grace_seconds=args.grace, dry_run=args.dry_run), "dry_run": bool(args.dry_run)})
+    return 0
+
+
+def _cmd_email_send(args: argparse.Namespace) -> int:
+    _print({**deliver_pending(max_batches=args.max_batches), "queue": EmailOutboxRepository().stats()})
+    return 0
+
+
+def _cmd_digest(args: argparse.Namespace) -> int:
+    day = date.fromisoformat(args.date) if args.date else None
+    _print(run_due_digest(day, business_days=args.days, clients=args.clients or DIGEST_CLIENTS, force=True, dry_run=args.dry_run))
+    return 0
+
+
+def _cmd_smtp_sink(args: argparse.Namespace) -> int:
+    serve_smtp_sink(args.host, args.port, args.out, tuple(args.reject_rcpt or ()))
+    return 0
+
+
+def _cmd_scan_bench(args: argparse.Namespace) -> int:
+    _print(scan_benchmark(megabytes=args.mb, rounds=args.rounds))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.manage", description="Comandos de manutencao do Fiscal HUB")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("rollup-rebuild", help="Recalcula task_rollup a partir de tarefas")
+    p.set_defaults(func=_cmd_rollup_rebuild)
+
+    p = sub.add_parser("rollup-check", help="Compara task_rollup com a agregacao de tarefas")
+    p.add_argument("--limit", type=int, default=100)
+    p.set_defaults(func=_cmd_rollup_check)
+
+    p = sub.add_parser("reclassify", help="Reaplica o classificador em classificacoes (retoma do checkpoint)")
+    p.add_argument("--chunk-size", type=int, default=2000)
+    p.add_argument("--workers", type=int, default=None, help="processos do pool; 0 roda no processo atual")
+    p.add_argument("--only-needs-review", action="store_true", help="so linhas com status needs_review")
+    p.add_argument("--with-pdfs", action="store_true", help="usa tambem o texto do PDF guardado na tarefa")
+    p.add_argument("--restart", action="store_true", help="ignora o checkpoint e comeca do inicio")
+    p.add_argument("--dry-run", action="store_true", help="so calcula o resumo, sem gravar")
+    p.add_argument("--top", type=int, default=20, help="transicoes de tributo listadas no resumo")
+    p.add_argument("--quiet", action="store_true")
+    p.set_defaults(func=_cmd_reclassify)
+
+    p = sub.add_parser(
+        "classification-log-compress", help="Comprime segmentos do log de classificacoes de dias anteriores"
+    )
+    p.set_defaults(func=_cmd_classification_log_compress)
+
+    p = sub.add_parser("archive-year", help="Move as tarefas de um ano fechado para <data_dir>/archive/fiscal-<ano>.db")
+    p.add_argument("year", type=int)
+    p.add_argument("--force", action="store_true", help="arquiva mesmo com tarefas em aberto")
+    p.add_argument("--dry-run", action="store_true", help="so conta o que seria movido")
+    p.add_argument("--vacuum", action="store_true", help="roda VACUUM na base quente ao final")
+    p.set_defaults(func=_cmd_archive_year)
+
+    p = sub.add_parser("archive-list", help="Lista os anos arquivados")
+    p.set_defaults(func=_cmd_archive_list)
+
+    p = sub.add_parser("backup", help="Backup online do banco (API de backup do SQLite), verificado e comprimido")
+    p.add_argument("--pages", type=int, default=PAGES_PER_STEP, help="paginas copiadas por passo")
+    p.add_argument("--sleep-ms", type=float, default=STEP_SLEEP_S * 1000, help="pausa entre passos")
+    p.add_argument("--keep", type=int, default=KEEP_GENERATIONS, help="geracoes mantidas")
+    p.add_argument("--db-only", action="store_true", help="nao espelha PDFs e arquivos anuais")
+    p.add_argument("--quiet", action="store_true")
+    p.set_defaults(func=_cmd_backup)
+
+    p = sub.add_parser("db-maintenance", help="ANALYZE/optimize, incremental_vacuum e checkpoint do WAL, com tempos")
+    p.add_argument("--analyze", action="store_true", help="ANALYZE completo em vez de PRAGMA optimize")
+    p.add_argument("--vacuum-pages", type=int, default=VACUUM_STEP_PAGES, help="paginas por incremental_vacuum")
+    p.add_argument("--budget-ms", type=float, default=VACUUM_BUDGET_S * 1000, help="tempo maximo no vacuum")
+    p.add_argument(
+        "--convert-auto-vacuum", action="store_true", help="liga auto_vacuum=INCREMENTAL num banco antigo (VACUUM)"
+    )
+    p.set_defaults(func=_cmd_db_maintenance)
+
+    p = sub.add_parser("jobs", help="Lista os jobs periodicos e a ultima execucao de cada um")
+    p.set_defaults(func=_cmd_jobs)
+
+    p = sub.add_parser("job-run", help="Roda um job periodico agora")
+    p.add_argument("name")
+    p.add_argument("--force", action="store_true", help="roda mesmo se ainda nao venceu")
+    p.set_defaults(func=_cmd_job_run)
+
+    p = sub.add_parser("pdf-migrate", help="Move PDFs de tarefas.pdf_blob para o armazenamento em arquivos")
+    p.add_argument("--batch-size", type=int, default=50)
+    p.add_argument("--max-batches", type=int, default=None)
+    p.add_argument("--pause", type=float, default=0.0, help="segundos de pausa entre lotes")
+    p.add_argument("--quiet", action="store_true")
+    p.set_defaults(func=_cmd_pdf_migrate)
+
+    p = sub.add_parser("pdf-gc", help="Apaga PDFs do armazenamento que nenhuma tarefa referencia")
+    p.add_argument("--grace", type=int, default=3600, help="idade minima (s) do arquivo sem referencia")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=_cmd_pdf_gc)
+
+    p = sub.add_parser("email-send", help="Manda agora os e-mails vencidos da fila (email_outbox)")
+    p.add_argument("--max-batches", type=int, default=None)
+    p.set_defaults(func=_cmd_email_send)
+
+    p = sub.add_parser("digest", help="Monta e enfileira o resumo de vencimentos do dia (mesmo do job due-digest)")
+    p.add_argument("--date", help="AAAA-MM-DD (padrao: hoje)")
+    p.add_argument("--days", type=int, default=DIGEST_BUSINESS_DAYS, help="dias uteis a frente")
+    p.add_argument("--clients", action="store_true", help="inclui o resumo para os e-mails das empresas")
+    p.add_argument("--dry-run", action="store_true", help="so conta e mostra o primeiro resumo")
+    p.set_defaults(func=_cmd_digest)
+
+    p = sub.add_parser("smtp-sink", help="Servidor SMTP local que grava as mensagens em .eml (desenvolvimento)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=1025)
+    p.add_argument("--out", default="smtp-sink", help="pasta onde cada mensagem vira um .eml")
+    p.add_argument("--reject-rcpt", action="append", help="recusa (550) destinatarios que contem este texto")
+    p.set_defaults(func=_cmd_smtp_sink)
+
+    p = sub.add_parser("scan-bench", help="Mede o scanner de texto de PDF (CNPJ, competencia, tributo) em MB/s")
+    p.add_argument("--mb", type=float, default=4.0)
+    p.add_argument("--rounds", type=int, default=3)
+    p.set_defaults(func=_cmd_scan_bench)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    init_db()
+    return int(args.func(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
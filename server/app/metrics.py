@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import server_timing
+from .db import add_query_observer, get_data_dir
+
+# Metricas em formato Prometheus (GET /metrics). Cada thread incrementa o proprio shard, sem lock;
+# o scrape soma os shards do processo e os snapshots que os outros workers gravam em <data_dir>/metrics/.
+METRICS_DIRNAME = "metrics"
+FLUSH_SECONDS = 5.0
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+Labels = Tuple[Tuple[str, str], ...]
+_Key = Tuple[str, Labels]
+
+_HELP = {
+    "fiscal_http_requests_total": ("counter", "Requisicoes HTTP por rota, metodo e status"),
+    "fiscal_http_request_duration_seconds": ("histogram", "Latencia das requisicoes HTTP por rota"),
+    "fiscal_db_queries_per_request": ("histogram", "Consultas SQLite por requisicao"),
+    "fiscal_db_time_per_request_seconds": ("histogram", "Tempo em consultas SQLite por requisicao"),
+    "fiscal_db_queries_total": ("counter", "Consultas SQLite executadas"),
+    "fiscal_db_query_seconds_total": ("counter", "Tempo total em consultas SQLite"),
+    "fiscal_stage_duration_seconds": ("histogram", "Etapas do upload (extracao de texto, classificacao)"),
+    "fiscal_cache_requests_total": ("counter", "Consultas a caches por resultado (hit/miss)"),
+    "fiscal_jobs_due": ("gauge", "Jobs agendados vencidos esperando execucao"),
+    "fiscal_jobs_running": ("gauge", "Jobs agendados com lease ativo"),
+    "fiscal_metrics_workers": ("gauge", "Processos com snapshot de metricas"),
+}
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self) -> None:
+        self.counters: Dict[_Key, float] = {}
+        # por chave: contagem por bucket (+Inf no fim), soma, total
+        self.histograms: Dict[_Key, List[float]] = {}
+
+
+_LOCAL = threading.local()
+_SHARDS: List[_Shard] = []
+_SHARDS_LOCK = threading.Lock()
+_BUCKETS: Dict[str, Tuple[float, ...]] = {}
+# Contadores lidos do estado de outros modulos na hora do snapshot (caches)
+_COLLECTORS: List[Callable[[], Iterable[Tuple[str, Labels, float]]]] = []
+_LAST_FLUSH = 0.0
+
+
+def _shard() -> _Shard:
+    shard = getattr(_LOCAL, "shard", None)
+    if shard is None:
+        shard = _LOCAL.shard = _Shard()
+        with _SHARDS_LOCK:
+            _SHARDS.append(shard)
+    return shard
+
+
+def _labels(labels: Optional[Dict[str, object]]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+def inc(name: str, labels: Optional[Dict[str, object]] = None, value: float = 1.0) -> None:
+    counters = _shard().counters
+    key = (name, _labels(labels))
+    counters[key] = counters.get(key, 0.0) + value
+
+
+def observe(
+    name: str,
+    value: float,
+    labels: Optional[Dict[str, object]] = None,
+    buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+) -> None:
+    _BUCKETS.setdefault(name, buckets)
+    histograms = _shard().histograms
+    key = (name, _labels(labels))
+    hist = histograms.get(key)
+    if hist is None:
+        hist = histograms[key] = [0.0] * (len(buckets) + 3)
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            hist[i] += 1
+            break
+    else:
+        hist[len(buckets)] += 1
+    hist[-2] += value
+    hist[-1] += 1
+
+
+class timed:
+    """with timed("pdf_extract"): ... -> fiscal_stage_duration_seconds{stage="pdf_extract"}"""
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+        self.started = 0.0
+
+    def __enter__(self) -> "timed":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        elapsed = time.perf_counter() - self.started
+        observe("fiscal_stage_duration_seconds", elapsed, {"stage": self.stage})
+        server_timing.record(self.stage, elapsed)
+
+
+def register_collector(fn: Callable[[], Iterable[Tuple[str, Labels, float]]]) -> None:
+    _COLLECTORS.append(fn)
+
+
+# Consultas da requisicao corrente: [quantidade, segundos]
+_REQUEST_DB: ContextVar[Optional[List[float]]] = ContextVar("fiscal_request_db", default=None)
+
+
+def _on_query(sql: str, params: object, elapsed: float, rows: int, conn: object) -> None:
+    current = _REQUEST_DB.get()
+    if current is not None:
+        current[0] += 1
+        current[1] += elapsed
+    inc("fiscal_db_queries_total")
+    inc("fiscal_db_query_seconds_total", value=elapsed)
+
+
+add_query_observer(_on_query)
+
+
+def _cache_counters() -> Iterable[Tuple[str, Labels, float]]:
+    from .classifier import matcher_stats
+    from .text_scan import _compile
+
+    info = _compile.cache_info()
+    yield "fiscal_cache_requests_total", (("cache", "text_scan_regex"), ("result", "hit")), float(info.hits)
+    yield "fiscal_cache_requests_total", (("cache", "text_scan_regex"), ("result", "miss")), float(info.misses)
+    stats = matcher_stats()
+    lookups = float(stats.get("lookups") or 0)
+    reloads = float(stats.get("reloads") or 0)
+    hits = max(0.0, lookups - reloads)
+    yield "fiscal_cache_requests_total", (("cache", "classifier_patterns"), ("result", "hit")), hits
+    yield "fiscal_cache_requests_total", (("cache", "classifier_patterns"), ("result", "miss")), reloads
+
+
+register_collector(_cache_counters)
+
+
+def begin_request() -> List[float]:
+    stats = [0.0, 0.0]
+    _REQUEST_DB.set(stats)
+    return stats
+
+
+def end_request(route: str, method: str, status: int, elapsed: float, db_stats: List[float]) -> None:
+    labels = {"route": route, "method": method}
+    inc("fiscal_http_requests_total", {**labels, "status": status})
+    observe("fiscal_http_request_duration_seconds", elapsed, labels)
+    observe("fiscal_db_queries_per_request", db_stats[0], labels, QUERY_COUNT_BUCKETS)
+    observe("fiscal_db_time_per_request_seconds", db_stats[1], labels)
+    if time.monotonic() - _LAST_FLUSH >= FLUSH_SECONDS:
+        flush()
+
+
+def _local_snapshot() -> Dict[str, object]:
+    counters: Dict[_Key, float] = {}
+    histograms: Dict[_Key, List[float]] = {}
+    with _SHARDS_LOCK:
+        shards = list(_SHARDS)
+    for shard in shards:
+        # dict(...) copia sem soltar o GIL; a thread dona pode seguir escrevendo
+        for key, value in dict(shard.counters).items():
+            counters[key] = counters.get(key, 0.0) + value
+        for key, hist in dict(shard.histograms).items():
+            merged = histograms.setdefault(key, [0.0] * len(hist))
+            for i, v in enumerate(list(hist)):
+                merged[i] += v
+    for collector in _COLLECTORS:
+        try:
+            for name, labels, value in collector():
+                counters[(name, labels)] = counters.get((name, labels), 0.0) + value
+        except Exception:
+            pass
+    return {
+        "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+        "histograms": [[name, labels, hist] for (name, labels), hist in histograms.items()],
+        "buckets": {k: list(v) for k, v in _BUCKETS.items()},
+    }
+
+
+def _metrics_dir() -> Path:
+    path = get_data_dir() / METRICS_DIRNAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def flush() -> None:
+    """Grava o snapshot deste processo para o scrape de outro worker somar."""
+    global _LAST_FLUSH
+    _LAST_FLUSH = time.monotonic()
+    path = _metrics_dir() / f"{os.getpid()}.json"
+    tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+    try:
+        tmp.write_text(json.dumps(_local_snapshot()), encoding="utf-8")
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True  # sem os.kill(pid, 0) confiavel; snapshots antigos saem pela idade
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merged_snapshots() -> Tuple[Dict[_Key, float], Dict[_Key, List[float]], Dict[str, Tuple[float, ...]], int]:
+    flush()
+    counters: Dict[_Key, float] = {}
+    histograms: Dict[_Key, List[float]] = {}
+    buckets: Dict[str, Tuple[float, ...]] = dict(_BUCKETS)
+    workers = 0
+    for path in _metrics_dir().glob("*.json"):
+        try:
+            pid = int(path.stem)
+        except ValueError:
+            continue
+        stale = time.time() - path.stat().st_mtime > 86400
+        if pid != os.getpid() and (stale or not _pid_alive(pid)):
+            path.unlink(missing_ok=True)
+            continue
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        workers += 1
+        for name, values in data.get("buckets", {}).items():
+            buckets.setdefault(name, tuple(values))
+        for name, labels, value in data.get("counters", []):
+            key = (name, tuple((str(k), str(v)) for k, v in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, hist in data.get("histograms", []):
+            key = (name, tuple((str(k), str(v)) for k, v in labels))
+            merged = histograms.setdefault(key, [0.0] * len(hist))
+            if len(merged) == len(hist):
+                for i, v in enumerate(hist):
+                    merged[i] += v
+    return counters, histograms, buckets, workers
+
+
+def _fmt_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(gauges: Iterable[Tuple[str, Labels, float]] = ()) -> str:
+    """Texto no formato de exposicao do Prometheus (version 0.0.4)."""
+    counters, histograms, buckets, workers = _merged_snapshots()
+    by_name: Dict[str, List[str]] = {}
+
+    for (name, labels), value in sorted(counters.items()):
+        by_name.setdefault(name, []).append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+    for (name, labels), hist in sorted(histograms.items()):
+        bounds = buckets.get(name, LATENCY_BUCKETS)
+        lines = by_name.setdefault(name, [])
+        cumulative = 0.0
+        for bound, count in zip(bounds, hist):
+            cumulative += count
+            le = (("le", _fmt_value(float(bound))),)
+            lines.append(f"{name}_bucket{_fmt_labels(labels, le)} {_fmt_value(cumulative)}")
+        cumulative += hist[len(bounds)]
+        lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {_fmt_value(cumulative)}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(hist[-2])}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {_fmt_value(hist[-1])}")
+    for name, labels, value in list(gauges) + [("fiscal_metrics_workers", (), float(workers))]:
+        by_name.setdefault(name, []).append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+
+    out = []
+    for name in sorted(by_name):
+        kind, help_text = _HELP.get(name, ("untyped", ""))
+        if help_text:
+            out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(by_name[name])
+    return "\n".join(out) + "\n"
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Mapping, Optional, Tuple
+
+from .db import get_data_dir
+from .repositories import PdfBlobRepository
+
+# PDFs enderecados por conteudo: <data_dir>/pdfs/ab/<sha256>.pdf. O mesmo arquivo enviado para
+# varias tarefas fica gravado uma vez; tarefas.pdf_sha256 referencia e pdf_blobs conta as referencias.
+STORE_DIRNAME = "pdfs"
+# Arquivo sem referencia so e apagado depois deste prazo (upload em andamento pode estar apontando para ele)
+GC_GRACE_SECONDS = 3600
+
+
+def _store_dir() -> Path:
+    path = get_data_dir() / STORE_DIRNAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def blob_path(sha256: str) -> Path:
+    return _store_dir() / sha256[:2] / f"{sha256}.pdf"
+
+
+def put_pdf(data: bytes) -> Tuple[str, Path]:
+    """Grava o PDF se ainda nao existe e devolve (sha256, caminho)."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = blob_path(sha256)
+    if path.exists():
+        # mtime novo protege o arquivo do gc enquanto a tarefa ainda nao aponta para ele
+        os.utime(path)
+        return sha256, path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return sha256, path
+
+
+def stored_path(row: Mapping[str, object]) -> Optional[Path]:
+    sha256 = row.get("pdf_sha256")
+    if not sha256:
+        return None
+    path = blob_path(str(sha256))
+    return path if path.is_file() else None
+
+
+def read_pdf(row: Mapping[str, object]) -> Optional[bytes]:
+    """Conteudo do PDF de uma linha de tarefas (pdf_sha256, ou pdf_blob ainda nao migrado)."""
+    path = stored_path(row)
+    if path is not None:
+        return path.read_bytes()
+    blob = row.get("pdf_blob")
+    return bytes(blob) if blob else None  # type: ignore[arg-type]
+
+
+def migrate_blobs(
+    *,
+    batch_size: int = 50,
+    max_batches: Optional[int] = None,
+    pause_s: float = 0.0,
+    progress: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> Dict[str, int]:
+    """Move tarefas.pdf_blob para o armazenamento em arquivos, em lotes curtos.
+
+    Cada lote le um blob por vez, grava os arquivos e troca as colunas numa transacao curta,
+    entao a API segue atendendo durante a migracao. Pode ser interrompido e rodado de novo.
+    """
+    repo = PdfBlobRepository()
+    summary = {"batches": 0, "moved": 0, "bytes": 0, "skipped": 0}
+    after_id = 0
+    while max_batches is None or summary["batches"] < max_batches:
+        ids = repo.legacy_ids(after_id, max(1, int(batch_size)))
+        if not ids:
+            break
+        after_id = ids[-1]
+        moves = []
+        for task_id in ids:
+            data = repo.legacy_blob(task_id)
+            if not data:
+                continue
+            sha256, _ = put_pdf(data)
+            moves.append((task_id, sha256, len(data)))
+            summary["bytes"] += len(data)
+        moved = repo.move_legacy(moves)
+        summary["moved"] += moved
+        summary["skipped"] += len(ids) - moved
+        summary["batches"] += 1
+        if progress:
+            progress(summary)
+        if pause_s > 0:
+            time.sleep(pause_s)
+    return summary
+
+
+def collect_garbage(grace_seconds: int = GC_GRACE_SECONDS, dry_run: bool = False) -> Dict[str, int]:
+    """Apaga arquivos sem referencia (refcount 0) e arquivos orfaos sem linha em pdf_blobs."""
+    repo = PdfBlobRepository()
+    cutoff = time.time() - max(0, int(grace_seconds))
+    older_than = (datetime.utcnow() - timedelta(seconds=max(0, int(grace_seconds)))).strftime("%Y-%m-%d %H:%M:%S")
+    summary = {"removed": 0, "orphans": 0, "bytes": 0}
+
+    def remove(path: Path) -> bool:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return False
+        if stat.st_mtime > cutoff:
+            return False
+        if not dry_run:
+            path.unlink(missing_ok=True)
+        summary["bytes"] += stat.st_size
+        return True
+
+    while True:
+        hashes = repo.unreferenced(older_than)
+        if not hashes:
+            break
+        for sha256 in hashes:
+            if dry_run or repo.drop_unreferenced(sha256):
+                summary["removed"] += int(remove(blob_path(sha256)))
+        if dry_run:
+            break
+
+    for folder in sorted(p for p in _store_dir().iterdir() if p.is_dir()):
+        files = {p.stem: p for p in folder.glob("*.pdf")}
+        names = list(files)
+        known = set()
+        for start in range(0, len(names), 500):
+            known |= repo.known(names[start : start + 500])
+        for sha256, path in files.items():
+            if sha256 not in known and remove(path):
+                summary["orphans"] += 1
+        # temporarios de gravacoes interrompidas
+        for tmp in folder.glob(".tmp-*"):
+            remove(tmp)
+    return summary
@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+import io
+
+import pdfplumber
+
+
+def extract_pdf_text(data: bytes) -> str:
+    try:
+        with pdfplumber.open(io.BytesIO(data)) as pdf:
+            parts = []
+            for page in pdf.pages:
+                parts.append(page.extract_text() or "")
+            return "\n".join(parts)
+    except Exception:
+        return ""
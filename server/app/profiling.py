@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import cProfile
+import fnmatch
+import io
+import json
+import os
+import pstats
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .db import get_data_dir
+
+# Profiling sob demanda (admin): liga para as proximas N requisicoes cuja rota casa com o padrao.
+# A sessao fica em <data_dir>/profiles/session.json, entao vale para todos os workers; cada requisicao
+# perfilada reserva um slot com O_EXCL e grava o proprio resultado. Desligado, o custo e comparar um relogio.
+PROFILE_DIRNAME = "profiles"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+MAX_REQUESTS = 50
+MAX_TTL_S = 3600
+# So ha amostragem enquanto alguma requisicao esta sendo perfilada
+SAMPLE_INTERVAL_S = max(0.0005, _env_float("FISCAL_PROFILE_SAMPLE_MS", 1) / 1000)
+# Intervalo entre leituras do session.json por worker
+CHECK_SECONDS = 1.0
+MODES = ("cprofile", "sample")
+
+_CACHE: Dict[str, object] = {"checked": 0.0, "mtime": None, "session": None}
+_CACHE_LOCK = threading.Lock()
+_RUN: ContextVar[Optional["_Run"]] = ContextVar("fiscal_profile_run", default=None)
+
+
+def _dir() -> Path:
+    path = get_data_dir() / PROFILE_DIRNAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _session_file() -> Path:
+    return _dir() / "session.json"
+
+
+def _write_json(path: Path, data: Dict[str, object]) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def start_session(
+    route: str, *, count: int, mode: str, method: Optional[str] = None, ttl_s: int = 600
+) -> Dict[str, object]:
+    if mode not in MODES:
+        raise ValueError(f"mode deve ser um de {', '.join(MODES)}")
+    if not 1 <= int(count) <= MAX_REQUESTS:
+        raise ValueError(f"count deve ficar entre 1 e {MAX_REQUESTS}")
+    session = {
+        "id": f"{datetime.now():%Y%m%d-%H%M%S}-{secrets.token_hex(3)}",
+        "route": route.strip() or "*",
+        "method": (method or "").upper() or None,
+        "mode": mode,
+        "count": int(count),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "expires_at": time.time() + max(10, min(int(ttl_s), MAX_TTL_S)),
+    }
+    (_dir() / str(session["id"])).mkdir(parents=True, exist_ok=True)
+    _write_json(_session_file(), session)
+    _write_json(_dir() / "last.json", session)
+    _CACHE["checked"] = 0.0
+    return session
+
+
+def stop_session() -> bool:
+    _CACHE["checked"] = 0.0
+    try:
+        _session_file().unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _active_session() -> Optional[Dict[str, object]]:
+    now = time.monotonic()
+    if now - float(_CACHE["checked"]) < CHECK_SECONDS:  # type: ignore[arg-type]
+        return _CACHE["session"]  # type: ignore[return-value]
+    with _CACHE_LOCK:
+        if now - float(_CACHE["checked"]) < CHECK_SECONDS:  # type: ignore[arg-type]
+            return _CACHE["session"]  # type: ignore[return-value]
+        _CACHE["checked"] = now
+        try:
+            mtime = _session_file().stat().st_mtime
+        except OSError:
+            _CACHE["session"] = None
+            return None
+        if mtime != _CACHE["mtime"]:
+            try:
+                _CACHE["session"] = json.loads(_session_file().read_text(encoding="utf-8"))
+                _CACHE["mtime"] = mtime
+            except (OSError, ValueError):
+                _CACHE["session"] = None
+        return _CACHE["session"]  # type: ignore[return-value]
+
+
+def _claim_slot(session: Dict[str, object]) -> Optional[int]:
+    folder = _dir() / str(session["id"])
+    for slot in range(int(session["count"])):  # type: ignore[call-overload]
+        try:
+            fd = os.open(folder / f"slot-{slot}", os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        except OSError:
+            return None
+        os.close(fd)
+        return slot
+    # todas as requisicoes pedidas ja foram perfiladas: desliga sozinho
+    stop_session()
+    return None
+
+
+def claim(route_path: str, request_path: str, method: str) -> Optional["_Run"]:
+    """Chamado por requisicao (TimedRoute). None na quase totalidade dos casos."""
+    session = _active_session()
+    if session is None:
+        return None
+    if time.time() > float(session["expires_at"]):  # type: ignore[arg-type]
+        stop_session()
+        return None
+    if session.get("method") and session["method"] != method.upper():
+        return None
+    pattern = str(session["route"])
+    if not (fnmatch.fnmatchcase(route_path, pattern) or fnmatch.fnmatchcase(request_path, pattern)):
+        return None
+    slot = _claim_slot(session)
+    if slot is None:
+        return None
+    run = _Run(session, slot, f"{method.upper()} {request_path}")
+    _RUN.set(run)
+    return run
+
+
+class _Sampler:
+    """Thread unica que amostra as pilhas das threads registradas (sys._current_frames)."""
+
+    def __init__(self) -> None:
+        self.threads: Dict[int, Counter] = {}
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def add(self, ident: int) -> Counter:
+        counter: Counter = Counter()
+        with self.lock:
+            # thread iniciada antes de registrar: a amostra nao pega o proprio Thread.start()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop, name="fiscal-profiler", daemon=True)
+                self.thread.start()
+            self.threads[ident] = counter
+        return counter
+
+    def remove(self, ident: int) -> None:
+        with self.lock:
+            self.threads.pop(ident, None)
+
+    def _loop(self) -> None:
+        idle_since = time.monotonic()
+        while True:
+            frames = sys._current_frames()
+            # contagem sob o lock: remove() devolve o Counter ja estavel para o save()
+            with self.lock:
+                if not self.threads:
+                    # fica um pouco ociosa antes de sair: sessao costuma ter varias requisicoes seguidas
+                    if time.monotonic() - idle_since > 2.0:
+                        self.thread = None
+                        return
+                else:
+                    idle_since = time.monotonic()
+                for ident, counter in self.threads.items():
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    if stack:
+                        counter[";".join(reversed(stack))] += 1
+            del frames
+            time.sleep(SAMPLE_INTERVAL_S)
+
+
+_SAMPLER = _Sampler()
+
+
+class _Run:
+    def __init__(self, session: Dict[str, object], slot: int, label: str) -> None:
+        self.session = session
+        self.slot = slot
+        self.label = label
+        self.mode = str(session["mode"])
+        self.profile = cProfile.Profile() if self.mode == "cprofile" else None
+        self.samples: List[Counter] = []
+        self.elapsed = 0.0
+
+    def __enter__(self) -> "_Run":
+        self.started = time.perf_counter()
+        if self.profile is not None:
+            try:
+                self.profile.enable()
+            except ValueError:
+                # outro profiler ja ativo neste processo (py3.12+ permite um so): segue sem perfilar
+                self.profile = None
+                self.mode = "skipped"
+        elif self.mode == "sample":
+            self.samples.append(_SAMPLER.add(threading.get_ident()))
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        if self.profile is not None:
+            self.profile.disable()
+        elif self.mode == "sample":
+            _SAMPLER.remove(threading.get_ident())
+        self.elapsed += time.perf_counter() - self.started
+
+    def save(self) -> None:
+        folder = _dir() / str(self.session["id"])
+        base = folder / f"{os.getpid()}-{self.slot}"
+        if self.profile is not None:
+            self.profile.dump_stats(str(base) + ".prof")
+        elif self.mode == "sample":
+            merged: Counter = Counter()
+            for counter in self.samples:
+                merged.update(counter)
+            with open(str(base) + ".folded", "w", encoding="utf-8") as fh:
+                for stack, hits in merged.most_common():
+                    fh.write(f"{stack} {hits}\n")
+        _write_json(Path(str(base) + ".json"), {"request": self.label, "ms": round(self.elapsed * 1000, 2)})
+
+
+def current_run() -> Optional[_Run]:
+    return _RUN.get()
+
+
+def status() -> Dict[str, object]:
+    active = _active_session() if _session_file().exists() else None
+    last_file = _dir() / "last.json"
+    last = json.loads(last_file.read_text(encoding="utf-8")) if last_file.exists() else None
+    requests = []
+    if active is not None:
+        used = len(list((_dir() / str(active["id"])).glob("slot-*")))
+        if used >= int(active["count"]) or time.time() > float(active["expires_at"]):  # type: ignore[arg-type]
+            stop_session()
+            active = None
+    if last:
+        for path in sorted((_dir() / str(last["id"])).glob("*.json")):
+            try:
+                requests.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+    return {"active": active is not None, "session": last, "profiled": requests}
+
+
+def result(fmt: str = "pstats") -> Optional[bytes]:
+    """Resultado da ultima sessao: pstats (binario, snakeviz/pstats), text (top 60 por tempo acumulado)
+    ou collapsed (pilhas no formato do flamegraph.pl/speedscope; so no modo sample)."""
+    last_file = _dir() / "last.json"
+    if not last_file.exists():
+        return None
+    folder = _dir() / str(json.loads(last_file.read_text(encoding="utf-8"))["id"])
+    if fmt == "collapsed":
+        merged: Counter = Counter()
+        for path in folder.glob("*.folded"):
+            for line in path.read_text(encoding="utf-8").splitlines():
+                stack, _, hits = line.rpartition(" ")
+                if stack and hits.isdigit():
+                    merged[stack] += int(hits)
+        if not merged:
+            return None
+        return "".join(f"{stack} {hits}\n" for stack, hits in merged.most_common()).encode("utf-8")
+    files = sorted(str(p) for p in folder.glob("*.prof"))
+    if not files:
+        return None
+    stats = pstats.Stats(files[0])
+    for extra in files[1:]:
+        stats.add(extra)
+    if fmt == "text":
+        out = io.StringIO()
+        stats.stream = out  # type: ignore[attr-defined]
+        stats.sort_stats("cumulative").print_stats(60)
+        return out.getvalue().encode("utf-8")
+    target = folder / "combined.prof"
+    stats.dump_stats(str(target))
+    return target.read_bytes()
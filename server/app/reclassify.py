@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import os
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from .classifier import classify_many, matcher_stats
+from .content_classifier import CONTENT_FONTES, classify_text, merge_content, review_status
+from .pdf_store import read_pdf
+from .pdf_text import extract_pdf_text
+from .repositories import ClassificationRepository
+
+# Status que o reclassify pode recalcular; outros (ajuste manual) ficam como estao.
+AUTO_STATUSES = ("ok", "needs_review")
+
+
+def _derive_chunk(
+    items: List[Tuple[Optional[int], str, Optional[str]]], with_pdfs: bool
+) -> List[Optional[Tuple[object, ...]]]:
+    # Roda no processo filho: le os PDFs por conta propria e devolve so as tuplas (pickle menor).
+    # None = linha mantida: os campos vieram do texto do PDF e o PDF nao foi lido de novo
+    results = classify_many([filename for _, filename, _ in items])
+    pdfs: Dict[int, Dict[str, object]] = {}
+    if with_pdfs:
+        repo = ClassificationRepository()
+        pdfs = repo.stored_pdfs([(task_id, filename) for task_id, filename, _ in items if task_id is not None])
+    derived: List[Optional[Tuple[object, ...]]] = []
+    for (task_id, _, fonte), result in zip(items, results):
+        row = pdfs.get(task_id) if task_id is not None else None
+        data = read_pdf(row) if row else None
+        if data:
+            result = merge_content(result, classify_text(extract_pdf_text(data)))
+        elif fonte in CONTENT_FONTES:
+            derived.append(None)
+            continue
+        else:
+            result = merge_content(result, None)
+        derived.append(ClassificationRepository.derived_values(result))
+    return derived
+
+
+class _InlineExecutor(Executor):
+    def submit(self, fn, /, *args, **kwargs):  # type: ignore[override]
+        fut: Future = Future()
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except BaseException as exc:
+            fut.set_exception(exc)
+        return fut
+
+
+def _new_state(statuses: Optional[List[str]]) -> Dict[str, object]:
+    return {
+        "run_id": uuid.uuid4().hex[:12],
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "finished_at": None,
+        "done": False,
+        "statuses": list(statuses or []),
+        "last_id": 0,
+        "scanned": 0,
+        "changed": 0,
+        "kept_content": 0,
+        "fields": {},
+        "status": {},
+        "tributo": {},
+        "elapsed_s": 0.0,
+    }
+
+
+def _diff_chunk(
+    rows: List[Dict[str, object]], derived: List[Optional[Tuple[object, ...]]], state: Dict[str, object]
+) -> List[Tuple[object, ...]]:
+    fields = ClassificationRepository.DERIVED_FIELDS
+    field_counts = Counter(state["fields"])
+    status_moves = Counter(state["status"])
+    tributo_moves = Counter(state["tributo"])
+    updates: List[Tuple[object, ...]] = []
+    kept = 0
+    for row, values in zip(rows, derived):
+        if values is None:
+            kept += 1
+            continue
+        old_status = row.get("status")
+        new_status = old_status
+        if old_status in AUTO_STATUSES:
+            new_status = review_status(values[fields.index("tributo")], values[fields.index("fonte")])
+        changed = [f for f, v in zip(fields, values) if row.get(f) != v]
+        if not changed and new_status == old_status:
+            continue
+        field_counts.update(changed)
+        if new_status != old_status:
+            status_moves[f"{old_status} -> {new_status}"] += 1
+        if "tributo" in changed:
+            tributo_moves[f"{row.get('tributo') or '-'} -> {values[fields.index('tributo')] or '-'}"] += 1
+        updates.append((*values, new_status, int(row["id"])))
+    state["scanned"] = int(state["scanned"]) + len(rows)
+    state["changed"] = int(state["changed"]) + len(updates)
+    state["kept_content"] = int(state.get("kept_content") or 0) + kept
+    state["fields"] = dict(field_counts)
+    state["status"] = dict(status_moves)
+    state["tributo"] = dict(tributo_moves)
+    return updates
+
+
+def run_reclassification(
+    *,
+    chunk_size: int = 2000,
+    workers: Optional[int] = None,
+    statuses: Optional[List[str]] = None,
+    with_pdfs: bool = False,
+    restart: bool = False,
+    dry_run: bool = False,
+    progress: Optional[Callable[[Dict[str, object]], None]] = None,
+) -> Dict[str, object]:
+    """Reaplica o classificador em classificacoes, em blocos por id, com checkpoint em app_settings.
+
+    Um run interrompido continua do ultimo bloco gravado (mesmos filtros) a menos que restart=True.
+    with_pdfs soma o classificador de conteudo quando a tarefa ainda guarda o mesmo PDF. Linhas cujos campos
+    vieram do conteudo (CONTENT_FONTES) so mudam quando o PDF e lido de novo; as demais ficam em kept_content.
+    dry_run so calcula o resumo: nao grava linhas nem checkpoint.
+    """
+    repo = ClassificationRepository()
+    chunk_size = max(1, int(chunk_size))
+    if workers is None:
+        workers = min(4, os.cpu_count() or 1)
+
+    state = None if restart else repo.get_reclassify_state()
+    if (
+        state is None
+        or state.get("done")
+        or list(state.get("statuses") or []) != list(statuses or [])
+        or bool(state.get("with_pdfs")) != with_pdfs
+    ):
+        state = _new_state(statuses)
+        state["with_pdfs"] = with_pdfs
+    # Versao dos padroes usada neste processo (os filhos do pool carregam a mesma do banco)
+    state["patterns_version"] = matcher_stats().get("version")
+    started = time.perf_counter()
+    elapsed_before = float(state.get("elapsed_s") or 0)
+
+    executor: Executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else _InlineExecutor()
+    pending: Deque[Tuple[List[Dict[str, object]], Future]] = deque()
+    max_inflight = max(2, workers * 2)
+    next_after = int(state["last_id"])
+    exhausted = False
+    with executor:
+        while True:
+            while not exhausted and len(pending) < max_inflight:
+                rows = repo.fetch_after(next_after, chunk_size, statuses)
+                if not rows:
+                    exhausted = True
+                    break
+                next_after = int(rows[-1]["id"])
+                items = [(r["task_id"], str(r["filename"] or ""), r.get("fonte")) for r in rows]
+                pending.append((rows, executor.submit(_derive_chunk, items, with_pdfs)))
+            if not pending:
+                break
+            rows, fut = pending.popleft()
+            updates = _diff_chunk(rows, fut.result(), state)
+            # Blocos sao gravados na ordem de leitura: o checkpoint nunca pula linha nao gravada
+            state["last_id"] = int(rows[-1]["id"])
+            state["elapsed_s"] = round(elapsed_before + time.perf_counter() - started, 3)
+            if not dry_run:
+                repo.apply_reclassification(updates, state)
+            if progress:
+                progress(state)
+
+    state["done"] = True
+    state["finished_at"] = datetime.now().isoformat(timespec="seconds")
+    state["elapsed_s"] = round(elapsed_before + time.perf_counter() - started, 3)
+    if not dry_run:
+        repo.apply_reclassification([], state)
+    return state
@@ -1,10 +1,65 @@
 from __future__ import annotations
 
-from typing import List, Optional, Dict
+from typing import Iterator, List, Optional, Dict, Set, Tuple
+from datetime import date
+import heapq
 import json
+import re
+import sqlite3
 
-from .db import _connect
+from .db import (
+    _connect,
+    CLASSIFIER_VERSION_KEY,
+    DONE_STATUSES,
+    ROLLUP_AGGREGATE_SQL,
+    ROLLUP_DUE_AGGREGATE_SQL,
+    ROLLUP_DUE_KEY,
+    ROLLUP_KEY,
+    bump_classifier_version,
+    rebuild_task_rollup,
+)
+from .archive import attach_archives, open_archive_for_task, years_for_filter
 from .security import hash_password, is_password_hash, verify_password
+from .classifier import _normalize
+from .br_docs import normalize_cnpj
+
+
+def fts_prefix_query(text: str) -> Optional[str]:
+    raw = (text or "").strip()
+    if not raw:
+        return None
+    # CNPJ/IE digitados com pontuacao viram um unico termo de digitos
+    if re.fullmatch(r"[\d./\-\s]+", raw):
+        digits = re.sub(r"\D", "", raw)
+        return f'"{digits}"*' if digits else None
+    tokens = _normalize(raw).split()
+    if not tokens:
+        return None
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+def _competencia_key(value: object) -> int:
+    # tarefas guardam AAAAMM; MM/AAAA aparece em dados digitados a mao
+    raw = str(value or "").strip()
+    if re.fullmatch(r"\d{6}", raw):
+        return int(raw)
+    m = re.fullmatch(r"(\d{2})/(\d{4})", raw)
+    return int(m.group(2)) * 100 + int(m.group(1)) if m else 0
+
+
+def _fetch_task_rows(task_id: int, sql: str, params: Tuple[object, ...]) -> List[sqlite3.Row]:
+    # Base quente primeiro; sem resultado, procura a tarefa nos anos arquivados
+    conn = _connect()
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    if rows:
+        return rows
+    arc = open_archive_for_task(task_id)
+    if arc is None:
+        return []
+    rows = arc.execute(sql, params).fetchall()
+    arc.close()
+    return rows
 
 
 class UserRepository:
@@ -12,12 +67,12 @@ class UserRepository:
         conn = _connect()
         cur = conn.cursor()
         rows = cur.execute(
-            "SELECT id, nome, role, is_default, senha FROM usuarios ORDER BY nome COLLATE NOCASE"
+            "SELECT id, nome, role, is_default, senha, email FROM usuarios ORDER BY nome COLLATE NOCASE"
         ).fetchall()
         conn.close()
         return [dict(r) for r in rows]
 
-    def create(self, nome: str, role: str = "collab", is_default: bool = False, senha: str = "") -> int:
+    def create(self, nome: str, role: str = "collab", is_default: bool = False, senha: str = "", email: str = "") -> int:
         nome = (nome or "").strip()
         if not nome:
             raise ValueError("Nome do usuario e obrigatorio")
@@ -26,8 +81,8 @@ class UserRepository:
         if is_default:
             cur.execute("UPDATE usuarios SET is_default = 0")
         cur.execute(
-            "INSERT INTO usuarios (nome, role, is_default, senha) VALUES (?, ?, ?, ?)",
-            (nome, role, 1 if is_default else 0, hash_password(senha)),
+            "INSERT INTO usuarios (nome, role, is_default, senha, email) VALUES (?, ?, ?, ?, ?)",
+            (nome, role, 1 if is_default else 0, hash_password(senha), (email or "").strip() or None),
         )
         conn.commit()
         new_id = int(cur.lastrowid)
@@ -49,7 +104,7 @@ class UserRepository:
         conn = _connect()
         cur = conn.cursor()
         row = cur.execute(
-            "SELECT id, nome, role, is_default, senha FROM usuarios WHERE id = ?",
+            "SELECT id, nome, role, is_default, senha, email FROM usuarios WHERE id = ?",
             (int(user_id),),
         ).fetchone()
         conn.close()
@@ -77,6 +132,13 @@ class UserRepository:
         conn.commit()
         conn.close()
 
+    def update_email(self, user_id: int, email: str) -> None:
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("UPDATE usuarios SET email = ? WHERE id = ?", ((email or "").strip() or None, int(user_id)))
+        conn.commit()
+        conn.close()
+
     def verify_login(self, nome: str, senha: str) -> Optional[Dict[str, object]]:
         conn = _connect()
         cur = conn.cursor()
@@ -216,11 +278,10 @@ class CompanyRepository:
             params.append(comp_date)
             q += " AND (data_saida IS NULL OR data_saida >= ?)"
             params.append(comp_date)
-        s = (query or "").strip()
-        if s:
-            q += " AND (nome LIKE ? OR cnpj LIKE ?)"
-            like = f"%{s}%"
-            params.extend([like, like])
+        match = fts_prefix_query(query)
+        if match:
+            q += " AND id IN (SELECT rowid FROM empresas_fts WHERE empresas_fts MATCH ?)"
+            params.append(match)
         q += " ORDER BY nome COLLATE NOCASE"
         rows = cur.execute(q, params).fetchall()
         conn.close()
@@ -252,6 +313,19 @@ class CompanyRepository:
         d["emails_extra"] = self._normalize_emails_out(d.get("emails_extra"))
         return d
 
+    def get_by_cnpj(self, cnpj: str) -> Optional[Dict[str, object]]:
+        digits = normalize_cnpj(cnpj)
+        if not digits:
+            return None
+        conn = _connect()
+        cur = conn.cursor()
+        row = cur.execute(
+            "SELECT id FROM empresas WHERE cnpj_digits = ? ORDER BY id LIMIT 1",
+            (digits,),
+        ).fetchone()
+        conn.close()
+        return self.get(int(row["id"])) if row else None
+
     def create(
         self,
         *,
@@ -272,27 +346,36 @@ class CompanyRepository:
             raise ValueError("Nome da empresa e obrigatorio")
         conn = _connect()
         cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO empresas (
-                user_id, nome, cnpj, ie, regime, observacoes, data_entrada, data_saida, responsavel_id, email_principal, emails_extra
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                int(user_id),
-                nome,
-                (cnpj or "").strip(),
-                (ie or "").strip(),
-                (regime or "").strip(),
-                self._normalize_observacoes_in(observacoes),
-                (data_entrada or "").strip() if data_entrada else None,
-                (data_saida or "").strip() if data_saida else None,
-                int(responsavel_id) if responsavel_id is not None else None,
+        try:
+            cur.execute(
+                """
+                INSERT INTO empresas (
+                    user_id, nome, cnpj, cnpj_digits, ie, regime, observacoes, data_entrada, data_saida, responsavel_id,
+                    email_principal, emails_extra
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    int(user_id),
+                    nome,
+                    (cnpj or "").strip(),
+                    normalize_cnpj(cnpj),
+                    (ie or "").strip(),
+                    (regime or "").strip(),
+                    self._normalize_observacoes_in(observacoes),
+                    (data_entrada or "").strip() if data_entrada else None,
+                    (data_saida or "").strip() if data_saida else None,
+                    int(responsavel_id) if responsavel_id is not None else None,
                     (email_principal or "").strip(),
                     self._normalize_emails_in(emails_extra),
-            ),
-        )
+                ),
+            )
+        except sqlite3.IntegrityError as exc:
+            conn.rollback()
+            conn.close()
+            if "cnpj_digits" in str(exc):
+                raise ValueError("CNPJ ja cadastrado em outra empresa") from exc
+            raise
         conn.commit()
         new_id = int(cur.lastrowid)
         conn.close()
@@ -314,53 +397,39 @@ class CompanyRepository:
         email_principal: str = "",
         emails_extra: object = "",
     ) -> None:
+        values = (
+            (nome or "").strip(),
+            (cnpj or "").strip(),
+            normalize_cnpj(cnpj),
+            (ie or "").strip(),
+            (regime or "").strip(),
+            self._normalize_observacoes_in(observacoes),
+            (data_entrada or "").strip() if data_entrada else None,
+            (data_saida or "").strip() if data_saida else None,
+            int(responsavel_id) if responsavel_id is not None else None,
+            (email_principal or "").strip(),
+            self._normalize_emails_in(emails_extra),
+            int(company_id),
+        )
+        q = """
+            UPDATE empresas
+            SET nome = ?, cnpj = ?, cnpj_digits = ?, ie = ?, regime = ?, observacoes = ?, data_entrada = ?, data_saida = ?,
+                responsavel_id = ?, email_principal = ?, emails_extra = ?
+            WHERE id = ?
+        """
+        if user_id is not None:
+            q += " AND user_id = ?"
+            values += (int(user_id),)
         conn = _connect()
         cur = conn.cursor()
-        if user_id is None:
-            cur.execute(
-                """
-                UPDATE empresas
-                SET nome = ?, cnpj = ?, ie = ?, regime = ?, observacoes = ?, data_entrada = ?, data_saida = ?, responsavel_id = ?,
-                    email_principal = ?, emails_extra = ?
-                WHERE id = ?
-                """,
-                (
-                    (nome or "").strip(),
-                    (cnpj or "").strip(),
-                    (ie or "").strip(),
-                    (regime or "").strip(),
-                    self._normalize_observacoes_in(observacoes),
-                    (data_entrada or "").strip() if data_entrada else None,
-                    (data_saida or "").strip() if data_saida else None,
-                    int(responsavel_id) if responsavel_id is not None else None,
-                    (email_principal or "").strip(),
-                    self._normalize_emails_in(emails_extra),
-                    int(company_id),
-                ),
-            )
-        else:
-            cur.execute(
-                """
-                UPDATE empresas
-                SET nome = ?, cnpj = ?, ie = ?, regime = ?, observacoes = ?, data_entrada = ?, data_saida = ?, responsavel_id = ?,
-                    email_principal = ?, emails_extra = ?
-                WHERE id = ? AND user_id = ?
-                """,
-                (
-                    (nome or "").strip(),
-                    (cnpj or "").strip(),
-                    (ie or "").strip(),
-                    (regime or "").strip(),
-                    self._normalize_observacoes_in(observacoes),
-                    (data_entrada or "").strip() if data_entrada else None,
-                    (data_saida or "").strip() if data_saida else None,
-                    int(responsavel_id) if responsavel_id is not None else None,
-                    (email_principal or "").strip(),
-                    self._normalize_emails_in(emails_extra),
-                    int(company_id),
-                    int(user_id),
-                ),
-            )
+        try:
+            cur.execute(q, values)
+        except sqlite3.IntegrityError as exc:
+            conn.rollback()
+            conn.close()
+            if "cnpj_digits" in str(exc):
+                raise ValueError("CNPJ ja cadastrado em outra empresa") from exc
+            raise
         conn.commit()
         conn.close()
 
@@ -375,7 +444,55 @@ class CompanyRepository:
         conn.close()
 
 
+# COLLATE NOCASE do SQLite: so A-Z viram minusculas, o resto compara pelo codigo
+_NOCASE = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def _fetch_batches(cur: sqlite3.Cursor, batch_size: int) -> Iterator[Tuple[object, ...]]:
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            return
+        for row in rows:
+            yield tuple(row)
+
+
+def _task_filter(
+    prefix: str,
+    user_id: Optional[int],
+    company_id: Optional[int],
+    status: Optional[List[str]],
+    tipo: Optional[str],
+    competencia: Optional[str],
+) -> Tuple[str, List[object]]:
+    """WHERE dos filtros de /tasks (prefix = alias da tabela com ponto, ou vazio)."""
+    where = "1=1"
+    params: List[object] = []
+    if user_id is not None:
+        where += f" AND {prefix}user_id = ?"
+        params.append(int(user_id))
+    if company_id is not None:
+        where += f" AND {prefix}company_id = ?"
+        params.append(int(company_id))
+    if status:
+        placeholders = ",".join("?" for _ in status)
+        where += f" AND {prefix}status IN ({placeholders})"
+        params.extend([str(s) for s in status])
+    if tipo:
+        where += f" AND {prefix}tipo = ?"
+        params.append(str(tipo))
+    if competencia:
+        where += f" AND {prefix}competencia = ?"
+        params.append(str(competencia))
+    return where, params
+
+
 class TaskRepository:
+    EXPORT_COLUMNS = (
+        "id", "empresa", "cnpj", "titulo", "tipo", "orgao", "tributo", "competencia", "vencimento", "status",
+        "responsavel", "has_pdf",
+    )
+
     def list(
         self,
         *,
@@ -385,35 +502,65 @@ class TaskRepository:
         tipo: Optional[str] = None,
         competencia: Optional[str] = None,
     ) -> List[Dict[str, object]]:
+        where, params = _task_filter("", user_id, company_id, status, tipo, competencia)
         conn = _connect()
-        cur = conn.cursor()
-        q = (
+        # Competencia de ano arquivado: a mesma consulta roda tambem em cada arquivo anexado
+        schemas = ["main", *attach_archives(conn, years_for_filter(competencia))]
+        q = " UNION ALL ".join(
             "SELECT id, company_id, titulo, tipo, orgao, tributo, competencia, vencimento, status, pdf_path, "
-            "CASE WHEN pdf_blob IS NOT NULL THEN 1 ELSE 0 END as has_pdf "
-            "FROM tarefas WHERE 1=1"
+            "CASE WHEN pdf_sha256 IS NOT NULL OR pdf_blob IS NOT NULL THEN 1 ELSE 0 END as has_pdf "
+            f"FROM {schema}.tarefas WHERE {where}"
+            for schema in schemas
         )
-        params: list[object] = []
-        if user_id is not None:
-            q += " AND user_id = ?"
-            params.append(int(user_id))
-        if company_id is not None:
-            q += " AND company_id = ?"
-            params.append(int(company_id))
-        if status:
-            placeholders = ",".join("?" for _ in status)
-            q += f" AND status IN ({placeholders})"
-            params.extend([str(s) for s in status])
-        if tipo:
-            q += " AND tipo = ?"
-            params.append(str(tipo))
-        if competencia:
-            q += " AND competencia = ?"
-            params.append(str(competencia))
         q += " ORDER BY competencia DESC, titulo COLLATE NOCASE"
-        rows = cur.execute(q, params).fetchall()
+        rows = conn.execute(q, params * len(schemas)).fetchall()
         conn.close()
         return [dict(r) for r in rows]
 
+    def iter_export(
+        self,
+        *,
+        user_id: Optional[int],
+        company_id: Optional[int] = None,
+        status: Optional[List[str]] = None,
+        tipo: Optional[str] = None,
+        competencia: Optional[str] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[Tuple[object, ...]]:
+        """Mesmas linhas e ordem de list(), com empresa e responsavel, lidas do cursor em lotes (EXPORT_COLUMNS).
+
+        A conexao fica aberta enquanto o gerador e consumido e fecha no fim (ou quando ele e descartado).
+        """
+        where, params = _task_filter("t.", user_id, company_id, status, tipo, competencia)
+        # lida por threads diferentes do pool a cada lote da resposta em streaming, nunca ao mesmo tempo
+        conn = _connect(check_same_thread=False)
+        try:
+            schemas = ["main", *attach_archives(conn, years_for_filter(competencia))]
+            # Uma consulta por base, cada uma ja na ordem do indice; um ORDER BY sobre o UNION ALL
+            # ordenaria tudo em B-tree temporario antes da primeira linha
+            streams = [
+                _fetch_batches(
+                    conn.execute(
+                        "SELECT t.id, e.nome AS empresa, e.cnpj, t.titulo, t.tipo, t.orgao, t.tributo, t.competencia, "
+                        "t.vencimento, t.status, u.nome AS responsavel, "
+                        "CASE WHEN t.pdf_sha256 IS NOT NULL OR t.pdf_blob IS NOT NULL THEN 1 ELSE 0 END AS has_pdf "
+                        f"FROM {schema}.tarefas t JOIN main.empresas e ON e.id = t.company_id "
+                        f"LEFT JOIN main.usuarios u ON u.id = t.user_id WHERE {where} "
+                        "ORDER BY t.competencia DESC, t.titulo COLLATE NOCASE",
+                        params,
+                    ),
+                    batch_size,
+                )
+                for schema in schemas
+            ]
+            if len(streams) == 1:
+                yield from streams[0]
+            else:
+                # arquivos so entram com filtro de competencia igual: as bases intercalam pelo titulo
+                yield from heapq.merge(*streams, key=lambda row: str(row[3] or "").translate(_NOCASE))
+        finally:
+            conn.close()
+
     def list_upcoming(
         self,
         *,
@@ -425,7 +572,7 @@ class TaskRepository:
         cur = conn.cursor()
         q = (
             "SELECT id, company_id, titulo, tipo, orgao, tributo, competencia, vencimento, status, pdf_path, "
-            "CASE WHEN pdf_blob IS NOT NULL THEN 1 ELSE 0 END as has_pdf "
+            "CASE WHEN pdf_sha256 IS NOT NULL OR pdf_blob IS NOT NULL THEN 1 ELSE 0 END as has_pdf "
             "FROM tarefas WHERE vencimento IS NOT NULL AND TRIM(vencimento) <> '' "
             "AND date(vencimento) >= date('now') AND date(vencimento) <= date('now', ?)"
         )
@@ -441,6 +588,31 @@ class TaskRepository:
         conn.close()
         return [dict(r) for r in rows]
 
+    def due_between(self, date_from: str, date_to: str) -> List[Dict[str, object]]:
+        """Tarefas em aberto com vencimento no intervalo, ja com empresa e responsavel (resumo diario, app.digest)."""
+        done = ReportRepository.DONE_STATUSES
+        conn = _connect()
+        rows = conn.execute(
+            f"""
+            SELECT t.id, t.user_id, t.company_id, t.titulo, t.tributo, t.competencia, date(t.vencimento) AS vencimento,
+                   t.status, e.nome AS empresa, e.responsavel_id, e.email_principal, e.emails_extra,
+                   u.nome AS responsavel, u.email AS responsavel_email
+            FROM tarefas t
+            JOIN empresas e ON e.id = t.company_id
+            LEFT JOIN usuarios u ON u.id = t.user_id
+            WHERE date(t.vencimento) BETWEEN ? AND ? AND t.status NOT IN ({", ".join("?" for _ in done)})
+            ORDER BY date(t.vencimento), t.titulo COLLATE NOCASE
+            """,
+            (str(date_from), str(date_to), *done),
+        ).fetchall()
+        conn.close()
+        out = []
+        for r in rows:
+            d = dict(r)
+            d["company_emails"] = _company_emails(d.pop("email_principal"), d.pop("emails_extra"))
+            out.append(d)
+        return out
+
     def create(
         self,
         *,
@@ -550,116 +722,473 @@ class TaskRepository:
         conn.close()
 
     def get_pdf(self, task_id: int, user_id: Optional[int]) -> Optional[Dict[str, object]]:
-        conn = _connect()
-        cur = conn.cursor()
         if user_id is None:
-            row = cur.execute(
-                "SELECT pdf_path, pdf_blob FROM tarefas WHERE id = ?",
+            rows = _fetch_task_rows(
+                task_id,
+                "SELECT pdf_path, pdf_sha256, pdf_blob FROM tarefas WHERE id = ?",
                 (int(task_id),),
-            ).fetchone()
+            )
         else:
-            row = cur.execute(
-                "SELECT pdf_path, pdf_blob FROM tarefas WHERE id = ? AND user_id = ?",
+            rows = _fetch_task_rows(
+                task_id,
+                "SELECT pdf_path, pdf_sha256, pdf_blob FROM tarefas WHERE id = ? AND user_id = ?",
                 (int(task_id), int(user_id)),
-            ).fetchone()
-        conn.close()
-        return dict(row) if row else None
+            )
+        return dict(rows[0]) if rows else None
 
     def get(self, task_id: int, user_id: Optional[int]) -> Optional[Dict[str, object]]:
-        conn = _connect()
-        cur = conn.cursor()
         if user_id is None:
-            row = cur.execute(
+            rows = _fetch_task_rows(
+                task_id,
                 """
                 SELECT id, user_id, company_id, titulo, tipo, orgao, tributo, competencia, vencimento, status, pdf_path,
-                CASE WHEN pdf_blob IS NOT NULL THEN 1 ELSE 0 END as has_pdf
+                CASE WHEN pdf_sha256 IS NOT NULL OR pdf_blob IS NOT NULL THEN 1 ELSE 0 END as has_pdf
                 FROM tarefas WHERE id = ?
                 """,
                 (int(task_id),),
-            ).fetchone()
+            )
         else:
-            row = cur.execute(
+            rows = _fetch_task_rows(
+                task_id,
                 """
                 SELECT id, user_id, company_id, titulo, tipo, orgao, tributo, competencia, vencimento, status, pdf_path,
-                CASE WHEN pdf_blob IS NOT NULL THEN 1 ELSE 0 END as has_pdf
+                CASE WHEN pdf_sha256 IS NOT NULL OR pdf_blob IS NOT NULL THEN 1 ELSE 0 END as has_pdf
                 FROM tarefas WHERE id = ? AND user_id = ?
                 """,
                 (int(task_id), int(user_id)),
-            ).fetchone()
+            )
+        return dict(rows[0]) if rows else None
+
+    SIMILAR_MAX_TOKENS = 8
+    SIMILAR_CANDIDATES = 50
+
+    def find_similar(
+        self,
+        *,
+        company_id: int,
+        text: str,
+        limit: int = 5,
+    ) -> List[Dict[str, object]]:
+        tokens: List[str] = []
+        for tok in _normalize(text).split():
+            if len(tok) >= 2 and tok not in tokens:
+                tokens.append(tok)
+        tokens = tokens[: self.SIMILAR_MAX_TOKENS]
+        if not tokens:
+            return []
+        match = f'company_key : "c{int(company_id)}" AND {{titulo tributo}} : (' + " OR ".join(
+            f'"{t}"*' for t in tokens
+        ) + ")"
+        conn = _connect()
+        cur = conn.cursor()
+        # Uma linha por titulo/tributo/tipo/orgao; MAX(t.id) faz as colunas soltas virem da tarefa mais recente.
+        rows = cur.execute(
+            """
+            WITH hits AS MATERIALIZED (
+                SELECT rowid AS id, bm25(tarefas_fts, 5.0, 3.0, 0.0) AS rank
+                FROM tarefas_fts WHERE tarefas_fts MATCH ?
+            )
+            SELECT MAX(t.id) AS id, t.titulo, t.tributo, t.competencia, t.tipo, t.orgao, t.status,
+                   COUNT(*) AS ocorrencias, hits.rank
+            FROM hits
+            JOIN tarefas t ON t.id = hits.id
+            GROUP BY t.titulo, t.tributo, t.tipo, t.orgao
+            ORDER BY rank
+            LIMIT ?
+            """,
+            (match, self.SIMILAR_CANDIDATES),
+        ).fetchall()
         conn.close()
-        return dict(row) if row else None
 
-    def update_pdf(self, task_id: int, user_id: Optional[int], pdf_path: str, pdf_blob: bytes) -> None:
+        scored: List[Dict[str, object]] = []
+        for row in rows:
+            item = dict(row)
+            item.pop("rank", None)
+            cand = set(_normalize(f"{item.get('titulo') or ''} {item.get('tributo') or ''}").split())
+            hits = sum(1 for t in tokens if any(c.startswith(t) for c in cand))
+            # Dice entre os termos do arquivo e os da tarefa; recorrencia so desempata.
+            dice = 2.0 * hits / (len(tokens) + len(cand)) if cand else 0.0
+            freq = min(1.0, int(item["ocorrencias"]) / 12.0)
+            item["score"] = round(0.85 * dice + 0.15 * freq, 3)
+            scored.append(item)
+        scored.sort(key=lambda r: (-float(r["score"]), -_competencia_key(r.get("competencia"))))
+        return scored[: max(1, int(limit))]
+
+    def update_pdf(self, task_id: int, user_id: Optional[int], pdf_path: str, sha256: str, size: int) -> None:
+        """Aponta a tarefa para um arquivo ja gravado em app.pdf_store (o refcount vem do trigger)."""
         conn = _connect()
         cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO pdf_blobs (sha256, size) VALUES (?, ?)
+            ON CONFLICT(sha256) DO UPDATE SET size = excluded.size
+            """,
+            (sha256, int(size)),
+        )
         if user_id is None:
             cur.execute(
-                "UPDATE tarefas SET pdf_path = ?, pdf_blob = ? WHERE id = ?",
-                (pdf_path, pdf_blob, int(task_id)),
+                "UPDATE tarefas SET pdf_path = ?, pdf_sha256 = ?, pdf_blob = NULL WHERE id = ?",
+                (pdf_path, sha256, int(task_id)),
             )
         else:
             cur.execute(
-                "UPDATE tarefas SET pdf_path = ?, pdf_blob = ? WHERE id = ? AND user_id = ?",
-                (pdf_path, pdf_blob, int(task_id), int(user_id)),
+                "UPDATE tarefas SET pdf_path = ?, pdf_sha256 = ?, pdf_blob = NULL WHERE id = ? AND user_id = ?",
+                (pdf_path, sha256, int(task_id), int(user_id)),
             )
         conn.commit()
         conn.close()
 
 
-class TaskLogRepository:
-    def create(self, *, task_id: int, user_id: Optional[int], action: str, details: Optional[str] = None) -> int:
+class SearchRepository:
+    def search(
+        self,
+        query: str,
+        *,
+        user_id: Optional[int] = None,
+        responsavel_id: Optional[int] = None,
+        limit: int = 20,
+    ) -> Dict[str, List[Dict[str, object]]]:
+        match = fts_prefix_query(query)
+        if not match:
+            return {"companies": [], "tasks": []}
+        limit = max(1, min(int(limit), 100))
         conn = _connect()
         cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO task_logs (task_id, user_id, action, details)
-            VALUES (?, ?, ?, ?)
-            """,
-            (
-                int(task_id),
-                int(user_id) if user_id is not None else None,
-                (action or "").strip(),
-                (details or "").strip() if details else None,
-            ),
+
+        q = (
+            "SELECT e.id, e.nome, e.cnpj, e.ie, e.regime, e.responsavel_id, "
+            "bm25(empresas_fts, 10.0, 5.0, 2.0) AS rank "
+            "FROM empresas_fts JOIN empresas e ON e.id = empresas_fts.rowid "
+            "WHERE empresas_fts MATCH ?"
         )
+        params: list[object] = [match]
+        if responsavel_id is not None:
+            q += " AND e.responsavel_id = ?"
+            params.append(int(responsavel_id))
+        q += " ORDER BY rank, e.nome COLLATE NOCASE LIMIT ?"
+        params.append(limit)
+        companies = [dict(r) for r in cur.execute(q, params).fetchall()]
+
+        q = (
+            "SELECT t.id, t.company_id, t.titulo, t.tipo, t.orgao, t.tributo, t.competencia, t.status, "
+            "bm25(tarefas_fts, 5.0, 3.0, 0.0) AS rank "
+            "FROM tarefas_fts JOIN tarefas t ON t.id = tarefas_fts.rowid "
+            "WHERE tarefas_fts MATCH ?"
+        )
+        params = [f"{{titulo tributo}} : ({match})"]
+        if user_id is not None:
+            q += " AND t.user_id = ?"
+            params.append(int(user_id))
+        q += " ORDER BY rank, t.competencia DESC LIMIT ?"
+        params.append(limit)
+        tasks = [dict(r) for r in cur.execute(q, params).fetchall()]
+        conn.close()
+        return {"companies": companies, "tasks": tasks}
+
+
+class ReportRepository:
+    # dimensao exposta na API -> coluna em task_rollup/tarefas
+    DIMENSIONS: Dict[str, str] = {
+        "status": "status",
+        "competencia": "competencia",
+        "company_id": "company_id",
+        "responsavel_id": "user_id",
+        "tipo": "tipo",
+        "orgao": "orgao",
+    }
+    # Sem group_by: a chave do rollup sem o responsavel (que continua disponivel como filtro e como group_by)
+    DEFAULT_GROUP_BY = ("status", "competencia", "company_id", "tipo", "orgao")
+    DONE_STATUSES = DONE_STATUSES
+
+    def summary(
+        self,
+        *,
+        user_id: Optional[int],
+        group_by: Optional[List[str]] = None,
+        company_id: Optional[int] = None,
+        status: Optional[List[str]] = None,
+        tipo: Optional[str] = None,
+        orgao: Optional[str] = None,
+        competencia: Optional[str] = None,
+        competencia_from: Optional[str] = None,
+        competencia_to: Optional[str] = None,
+    ) -> List[Dict[str, object]]:
+        dims = list(group_by) if group_by else list(self.DEFAULT_GROUP_BY)
+        unknown = [d for d in dims if d not in self.DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Dimensao invalida: {', '.join(unknown)}")
+        group_cols = [self.DIMENSIONS[d] for d in dims]
+
+        # filtros com a coluna na frente: prefixados com o alias de cada tabela da consulta
+        conds: list[str] = []
+        params: list[object] = []
+        if competencia:
+            conds.append("competencia = ?")
+            params.append(str(competencia))
+        if competencia_from:
+            conds.append("competencia >= ?")
+            params.append(str(competencia_from))
+        if competencia_to:
+            conds.append("competencia <= ?")
+            params.append(str(competencia_to))
+        if user_id is not None:
+            conds.append("user_id = ?")
+            params.append(int(user_id))
+        if company_id is not None:
+            conds.append("company_id = ?")
+            params.append(int(company_id))
+        if status:
+            placeholders = ",".join("?" for _ in status)
+            conds.append(f"status IN ({placeholders})")
+            params.extend([str(s) for s in status])
+        if tipo:
+            conds.append("tipo = ?")
+            params.append(str(tipo))
+        if orgao:
+            conds.append("orgao = ?")
+            params.append(str(orgao))
+
+        def where(alias: str) -> str:
+            return "".join(f" AND {alias}.{c}" for c in conds)
+
+        today = date.today().isoformat()
+        conn = _connect()
+        try:
+            # Anos arquivados entram pelo rollup gravado em cada arquivo
+            schemas = attach_archives(conn, years_for_filter(competencia, competencia_from, competencia_to))
+
+            def source(table: str, cols: str) -> str:
+                if not schemas:
+                    return table
+                return (
+                    f"(SELECT {cols} FROM main.{table} "
+                    + " ".join(f"UNION ALL SELECT {cols} FROM {schema}.{table}" for schema in schemas)
+                    + ")"
+                )
+
+            key = ", ".join(ROLLUP_KEY)
+            match = " AND ".join(f"d.{k} = r.{k}" for k in ROLLUP_KEY)
+            select_cols = [
+                "NULLIF(r.competencia, '') AS competencia" if d == "competencia" else f"r.{self.DIMENSIONS[d]} AS {d}"
+                for d in dims
+            ]
+            # Atrasadas: task_rollup_due (so status em aberto) somada por chave uma vez e ligada ao rollup.
+            # Toda chave de task_rollup_due tambem existe em task_rollup.
+            due = f"""
+                SELECT {key}, SUM(total) AS overdue
+                FROM {source("task_rollup_due", ", ".join(ROLLUP_DUE_KEY) + ", total")} AS t
+                WHERE t.vencimento < ?{where("t")}
+                GROUP BY {key}
+            """
+            if set(group_cols) == set(ROLLUP_KEY) and not schemas:
+                # Agrupado pela chave inteira: uma linha do rollup por grupo, sem GROUP BY
+                totals = "r.total AS total, r.with_pdf AS with_pdf, COALESCE(d.overdue, 0) AS overdue"
+                group = ""
+            else:
+                totals = "SUM(r.total) AS total, SUM(r.with_pdf) AS with_pdf, COALESCE(SUM(d.overdue), 0) AS overdue"
+                # na ordem da chave primaria: a agregacao percorre o rollup em ordem, sem ordenar
+                ordered = sorted(set(group_cols), key=ROLLUP_KEY.index)
+                group = f" GROUP BY {', '.join(f'r.{c}' for c in ordered)}"
+            q = f"""
+                WITH d AS ({due})
+                SELECT {", ".join(select_cols)}, {totals}
+                FROM {source("task_rollup", key + ", total, with_pdf")} AS r
+                LEFT JOIN d ON {match}
+                WHERE 1=1{where("r")}{group}
+            """
+            rows = conn.execute(q, [today, *params, *params]).fetchall()
+        finally:
+            conn.close()
+        return [dict(r) for r in rows]
+
+
+class RollupRepository:
+    def rebuild(self) -> int:
+        conn = _connect()
+        cur = conn.cursor()
+        total = rebuild_task_rollup(cur)
         conn.commit()
-        new_id = int(cur.lastrowid)
         conn.close()
-        return new_id
+        return total
 
-    def list(self, *, task_id: int) -> List[Dict[str, object]]:
+    def check(self, limit: int = 100) -> List[Dict[str, object]]:
         conn = _connect()
         cur = conn.cursor()
-        rows = cur.execute(
-            """
-            SELECT id, task_id, user_id, action, details, created_at
-            FROM task_logs
-            WHERE task_id = ?
-            ORDER BY id DESC
-            """,
-            (int(task_id),),
-        ).fetchall()
+        out: List[Dict[str, object]] = []
+        for table, key_cols, aggregate, has_pdf in (
+            ("task_rollup", ROLLUP_KEY, ROLLUP_AGGREGATE_SQL, True),
+            ("task_rollup_due", ROLLUP_DUE_KEY, ROLLUP_DUE_AGGREGATE_SQL, False),
+        ):
+            if len(out) >= limit:
+                break
+            key = ", ".join(key_cols)
+            join = " AND ".join(f"e.{k} = s.{k}" for k in key_cols)
+            pdf = "s.with_pdf" if has_pdf else "NULL"
+            expected_pdf = "e.with_pdf" if has_pdf else "NULL"
+            # FULL OUTER JOIN emulado: divergencias de contagem + chaves que so existem de um lado
+            rows = cur.execute(
+                f"""
+                WITH expected AS ({aggregate}),
+                stored AS (SELECT {key}, total{", with_pdf" if has_pdf else ""} FROM {table})
+                SELECT '{table}' AS tabela, {", ".join(f"e.{k}" for k in key_cols)},
+                       e.total AS expected_total, s.total AS stored_total,
+                       {expected_pdf} AS expected_with_pdf, {pdf} AS stored_with_pdf
+                FROM expected e LEFT JOIN stored s ON {join}
+                WHERE s.total IS NULL OR s.total <> e.total{f" OR s.with_pdf <> e.with_pdf" if has_pdf else ""}
+                UNION ALL
+                SELECT '{table}', {", ".join(f"s.{k}" for k in key_cols)},
+                       NULL, s.total, NULL, {pdf}
+                FROM stored s
+                WHERE NOT EXISTS (SELECT 1 FROM expected e WHERE {join})
+                LIMIT ?
+                """,
+                (int(limit) - len(out),),
+            ).fetchall()
+            out.extend(dict(r) for r in rows)
         conn.close()
-        return [dict(r) for r in rows]
+        return out
 
 
-class TaskCommentRepository:
-    def list(self, *, task_id: int) -> List[Dict[str, object]]:
+class PdfBlobRepository:
+    def legacy_ids(self, after_id: int, limit: int) -> List[int]:
         conn = _connect()
         cur = conn.cursor()
         rows = cur.execute(
-            """
-            SELECT id, task_id, author_id, text, created_at
-            FROM task_comments
-            WHERE task_id = ?
-            ORDER BY id DESC
-            """,
-            (int(task_id),),
+            "SELECT id FROM tarefas WHERE id > ? AND pdf_blob IS NOT NULL ORDER BY id LIMIT ?",
+            (int(after_id), int(limit)),
         ).fetchall()
         conn.close()
-        return [dict(r) for r in rows]
+        return [int(r["id"]) for r in rows]
 
-    def create(self, *, task_id: int, author_id: int, text: str) -> int:
+    def legacy_blob(self, task_id: int) -> Optional[bytes]:
+        conn = _connect()
+        cur = conn.cursor()
+        row = cur.execute("SELECT pdf_blob FROM tarefas WHERE id = ?", (int(task_id),)).fetchone()
+        conn.close()
+        return bytes(row["pdf_blob"]) if row and row["pdf_blob"] is not None else None
+
+    def move_legacy(self, moves: List[Tuple[int, str, int]]) -> int:
+        """Troca pdf_blob por pdf_sha256 em um lote (task_id, sha256, size), numa transacao."""
+        if not moves:
+            return 0
+        conn = _connect()
+        cur = conn.cursor()
+        cur.executemany(
+            """
+            INSERT INTO pdf_blobs (sha256, size) VALUES (?, ?)
+            ON CONFLICT(sha256) DO UPDATE SET size = excluded.size
+            """,
+            [(sha256, int(size)) for _, sha256, size in moves],
+        )
+        moved = 0
+        for task_id, sha256, _ in moves:
+            # Upload no meio do lote ja gravou pdf_sha256: a linha nao e mais legada
+            cur.execute(
+                "UPDATE tarefas SET pdf_sha256 = ?, pdf_blob = NULL "
+                "WHERE id = ? AND pdf_blob IS NOT NULL AND pdf_sha256 IS NULL",
+                (sha256, int(task_id)),
+            )
+            moved += cur.rowcount
+        conn.commit()
+        conn.close()
+        return moved
+
+    def unreferenced(self, older_than: str, limit: int = 500) -> List[str]:
+        conn = _connect()
+        cur = conn.cursor()
+        rows = cur.execute(
+            "SELECT sha256 FROM pdf_blobs WHERE refcount <= 0 AND updated_at < ? LIMIT ?",
+            (older_than, int(limit)),
+        ).fetchall()
+        conn.close()
+        return [str(r["sha256"]) for r in rows]
+
+    def drop_unreferenced(self, sha256: str) -> bool:
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM pdf_blobs WHERE sha256 = ? AND refcount <= 0", (sha256,))
+        dropped = cur.rowcount > 0
+        conn.commit()
+        conn.close()
+        return dropped
+
+    def known(self, hashes: List[str]) -> Set[str]:
+        if not hashes:
+            return set()
+        conn = _connect()
+        cur = conn.cursor()
+        rows = cur.execute(
+            f"SELECT sha256 FROM pdf_blobs WHERE sha256 IN ({', '.join('?' for _ in hashes)})", hashes
+        ).fetchall()
+        conn.close()
+        return {str(r["sha256"]) for r in rows}
+
+    def stats(self) -> Dict[str, int]:
+        conn = _connect()
+        cur = conn.cursor()
+        blobs = cur.execute(
+            """
+            SELECT COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes,
+                   COALESCE(SUM(refcount), 0) AS refs,
+                   COALESCE(SUM(CASE WHEN refcount <= 0 THEN 1 ELSE 0 END), 0) AS unreferenced
+            FROM pdf_blobs
+            """
+        ).fetchone()
+        legacy = cur.execute("SELECT COUNT(*) FROM tarefas WHERE pdf_blob IS NOT NULL").fetchone()
+        conn.close()
+        return {**{k: int(blobs[k]) for k in blobs.keys()}, "legacy_rows": int(legacy[0])}
+
+
+class TaskLogRepository:
+    def create(self, *, task_id: int, user_id: Optional[int], action: str, details: Optional[str] = None) -> int:
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO task_logs (task_id, user_id, action, details)
+            VALUES (?, ?, ?, ?)
+            """,
+            (
+                int(task_id),
+                int(user_id) if user_id is not None else None,
+                (action or "").strip(),
+                (details or "").strip() if details else None,
+            ),
+        )
+        conn.commit()
+        new_id = int(cur.lastrowid)
+        conn.close()
+        return new_id
+
+    def list(self, *, task_id: int) -> List[Dict[str, object]]:
+        rows = _fetch_task_rows(
+            task_id,
+            """
+            SELECT id, task_id, user_id, action, details, created_at
+            FROM task_logs
+            WHERE task_id = ?
+            ORDER BY id DESC
+            """,
+            (int(task_id),),
+        )
+        return [dict(r) for r in rows]
+
+
+class TaskCommentRepository:
+    def list(self, *, task_id: int) -> List[Dict[str, object]]:
+        rows = _fetch_task_rows(
+            task_id,
+            """
+            SELECT id, task_id, author_id, text, created_at
+            FROM task_comments
+            WHERE task_id = ?
+            ORDER BY id DESC
+            """,
+            (int(task_id),),
+        )
+        return [dict(r) for r in rows]
+
+    def create(self, *, task_id: int, author_id: int, text: str) -> int:
         conn = _connect()
         cur = conn.cursor()
         cur.execute(
@@ -756,7 +1285,287 @@ class NotificationRepository:
         return [dict(r) for r in rows]
 
 
+def _company_emails(principal: Optional[str], extra: Optional[str]) -> List[str]:
+    """email_principal + emails_extra (sem repetir), como saem de empresas."""
+    first = str(principal or "").strip()
+    return list(dict.fromkeys(([first] if first else []) + CompanyRepository()._normalize_emails_out(extra)))
+
+
+def _email_row(row: sqlite3.Row) -> Dict[str, object]:
+    item = dict(row)
+    try:
+        item["to_emails"] = json.loads(item.get("to_emails") or "[]")
+    except ValueError:
+        item["to_emails"] = [e for e in str(item.get("to_emails") or "").split(",") if e.strip()]
+    return item
+
+
+class EmailOutboxRepository:
+    FIELDS = (
+        "id, company_id, user_id, task_id, to_emails, subject, body, link, attach_pdf, dedupe_key, status, attempts, "
+        "next_attempt_at, last_error, email_log_id, created_at, sent_at"
+    )
+
+    def enqueue_many(self, items: List[Dict[str, object]]) -> int:
+        """Grava os e-mails numa transacao; item com dedupe_key ja enfileirado e ignorado. Devolve os gravados."""
+        if not items:
+            return 0
+        conn = _connect()
+        cur = conn.cursor()
+        cur.executemany(
+            """
+            INSERT INTO email_outbox (company_id, user_id, task_id, to_emails, subject, body, link, attach_pdf, dedupe_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(dedupe_key) DO NOTHING
+            """,
+            [
+                (
+                    int(item["company_id"]) if item.get("company_id") is not None else None,
+                    int(item["user_id"]) if item.get("user_id") is not None else None,
+                    int(item["task_id"]) if item.get("task_id") is not None else None,
+                    json.dumps(list(item["to_emails"]), ensure_ascii=False),  # type: ignore[call-overload]
+                    str(item.get("subject") or "").strip(),
+                    str(item.get("body") or ""),
+                    str(item.get("link") or "").strip() or None,
+                    1 if item.get("attach_pdf") else 0,
+                    item.get("dedupe_key") or None,
+                )
+                for item in items
+            ],
+        )
+        inserted = max(0, cur.rowcount)
+        conn.commit()
+        conn.close()
+        return inserted
+
+    def get(self, outbox_id: int) -> Optional[Dict[str, object]]:
+        conn = _connect()
+        row = conn.execute(f"SELECT {self.FIELDS} FROM email_outbox WHERE id = ?", (int(outbox_id),)).fetchone()
+        conn.close()
+        return _email_row(row) if row else None
+
+    def get_by_dedupe_key(self, dedupe_key: str) -> Optional[Dict[str, object]]:
+        conn = _connect()
+        row = conn.execute(f"SELECT {self.FIELDS} FROM email_outbox WHERE dedupe_key = ?", (dedupe_key,)).fetchone()
+        conn.close()
+        return _email_row(row) if row else None
+
+    def guide_rows(self, competencia: str, company_id: Optional[int] = None) -> List[Dict[str, object]]:
+        """Tarefas da competencia com PDF guardado, com os e-mails da empresa (envio de guias no fechamento)."""
+        q = """
+            SELECT t.id AS task_id, t.user_id, t.company_id, t.titulo, t.tributo, t.competencia, t.vencimento,
+                   t.pdf_path, t.pdf_sha256, e.nome, e.email_principal, e.emails_extra
+            FROM tarefas t JOIN empresas e ON e.id = t.company_id
+            WHERE t.competencia = ? AND (t.pdf_sha256 IS NOT NULL OR t.pdf_blob IS NOT NULL)
+        """
+        params: list[object] = [str(competencia)]
+        if company_id is not None:
+            q += " AND t.company_id = ?"
+            params.append(int(company_id))
+        conn = _connect()
+        rows = conn.execute(q, params).fetchall()
+        conn.close()
+        out = []
+        for r in rows:
+            d = dict(r)
+            d["to_emails"] = _company_emails(d.pop("email_principal"), d.pop("emails_extra"))
+            out.append(d)
+        return out
+
+    def claim(self, token: str, limit: int, lease_s: int) -> List[Dict[str, object]]:
+        """Reserva ate limit e-mails vencidos para este envio; lease vencido (processo que morreu) volta para a fila."""
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(
+            "UPDATE email_outbox SET status = 'pending', lease_owner = NULL, lease_until = NULL "
+            "WHERE status = 'sending' AND lease_until < datetime('now')"
+        )
+        ids = [
+            int(r["id"])
+            for r in cur.execute(
+                "SELECT id FROM email_outbox WHERE status = 'pending' AND next_attempt_at <= datetime('now') "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (int(limit),),
+            ).fetchall()
+        ]
+        rows: List[sqlite3.Row] = []
+        if ids:
+            marks = ", ".join("?" for _ in ids)
+            cur.execute(
+                f"UPDATE email_outbox SET status = 'sending', lease_owner = ?, lease_until = datetime('now', ?), "
+                f"attempts = attempts + 1 WHERE id IN ({marks})",
+                [token, f"+{int(lease_s)} seconds", *ids],
+            )
+            rows = cur.execute(f"SELECT {self.FIELDS} FROM email_outbox WHERE id IN ({marks}) ORDER BY id", ids).fetchall()
+        conn.commit()
+        conn.close()
+        return [_email_row(r) for r in rows]
+
+    def mark_sent(self, outbox_id: int, token: str, attachment_name: Optional[str] = None) -> Optional[int]:
+        """Fecha o envio e grava email_logs (quando ha empresa e usuario) na mesma transacao."""
+        conn = _connect()
+        cur = conn.cursor()
+        row = cur.execute(
+            f"SELECT {self.FIELDS} FROM email_outbox WHERE id = ? AND lease_owner = ?", (int(outbox_id), token)
+        ).fetchone()
+        if row is None:
+            conn.close()
+            return None
+        log_id = None
+        if row["company_id"] is not None and row["user_id"] is not None:
+            cur.execute(
+                """
+                INSERT INTO email_logs (company_id, user_id, to_emails, subject, body, link, task_id, attachment_name)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    row["company_id"], row["user_id"], row["to_emails"], row["subject"], row["body"], row["link"],
+                    row["task_id"], attachment_name,
+                ),
+            )
+            log_id = int(cur.lastrowid)
+        cur.execute(
+            """
+            UPDATE email_outbox
+            SET status = 'sent', sent_at = datetime('now'), email_log_id = ?, last_error = NULL,
+                lease_owner = NULL, lease_until = NULL
+            WHERE id = ?
+            """,
+            (log_id, int(outbox_id)),
+        )
+        conn.commit()
+        conn.close()
+        return log_id
+
+    def mark_failed(self, outbox_id: int, token: str, error: str, retry_in: Optional[int] = None) -> None:
+        """Falha do envio: volta para a fila daqui a retry_in segundos, ou fica 'failed' quando retry_in e None."""
+        conn = _connect()
+        cur = conn.cursor()
+        if retry_in is None:
+            cur.execute(
+                "UPDATE email_outbox SET status = 'failed', last_error = ?, lease_owner = NULL, lease_until = NULL "
+                "WHERE id = ? AND lease_owner = ?",
+                (error[:1000], int(outbox_id), token),
+            )
+        else:
+            cur.execute(
+                "UPDATE email_outbox SET status = 'pending', last_error = ?, next_attempt_at = datetime('now', ?), "
+                "lease_owner = NULL, lease_until = NULL WHERE id = ? AND lease_owner = ?",
+                (error[:1000], f"+{int(retry_in)} seconds", int(outbox_id), token),
+            )
+        conn.commit()
+        conn.close()
+
+    def release(self, ids: List[int], token: str) -> None:
+        """Devolve a fila o que foi reservado e nao chegou a ser tentado (sem contar tentativa)."""
+        if not ids:
+            return
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            UPDATE email_outbox SET status = 'pending', attempts = MAX(0, attempts - 1), lease_owner = NULL, lease_until = NULL
+            WHERE id IN ({", ".join("?" for _ in ids)}) AND lease_owner = ?
+            """,
+            [*[int(i) for i in ids], token],
+        )
+        conn.commit()
+        conn.close()
+
+    def requeue(self, outbox_id: int) -> bool:
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE email_outbox SET status = 'pending', attempts = 0, next_attempt_at = datetime('now'), last_error = NULL "
+            "WHERE id = ? AND status = 'failed'",
+            (int(outbox_id),),
+        )
+        changed = cur.rowcount > 0
+        conn.commit()
+        conn.close()
+        return changed
+
+    def list(self, *, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, object]]:
+        conn = _connect()
+        if status:
+            rows = conn.execute(
+                f"SELECT {self.FIELDS} FROM email_outbox WHERE status = ? ORDER BY next_attempt_at DESC LIMIT ?",
+                (str(status), int(limit)),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                f"SELECT {self.FIELDS} FROM email_outbox ORDER BY id DESC LIMIT ?", (int(limit),)
+            ).fetchall()
+        conn.close()
+        return [_email_row(r) for r in rows]
+
+    def stats(self) -> Dict[str, object]:
+        conn = _connect()
+        rows = conn.execute(
+            "SELECT status, COUNT(*) AS total, MIN(next_attempt_at) AS oldest FROM email_outbox GROUP BY status"
+        ).fetchall()
+        conn.close()
+        counts: Dict[str, object] = {s: 0 for s in ("pending", "sending", "sent", "failed")}
+        oldest = None
+        for r in rows:
+            counts[str(r["status"])] = int(r["total"])
+            if r["status"] == "pending":
+                oldest = r["oldest"]
+        return {**counts, "oldest_pending": oldest}
+
+
+class EmailLogRepository:
+    def list(
+        self, *, company_id: Optional[int] = None, task_id: Optional[int] = None, limit: int = 100
+    ) -> List[Dict[str, object]]:
+        q = (
+            "SELECT id, company_id, user_id, to_emails, subject, body, link, task_id, attachment_name, created_at "
+            "FROM email_logs WHERE 1=1"
+        )
+        params: list[object] = []
+        if company_id is not None:
+            q += " AND company_id = ?"
+            params.append(int(company_id))
+        if task_id is not None:
+            q += " AND task_id = ?"
+            params.append(int(task_id))
+        q += " ORDER BY id DESC LIMIT ?"
+        params.append(int(limit))
+        conn = _connect()
+        rows = conn.execute(q, params).fetchall()
+        conn.close()
+        return [_email_row(r) for r in rows]
+
+
 class ClassificationRepository:
+    # Campos derivados do nome do arquivo (e do texto do PDF, conforme fonte), na ordem usada pelo UPDATE do reclassify
+    DERIVED_FIELDS = (
+        "competencia", "empresa", "grupo", "subgrupo", "orgao", "tributo", "subtipo", "acao", "confianca", "raw_text",
+        "fonte",
+    )
+    RECLASSIFY_STATE_KEY = "reclassify_state"
+
+    @staticmethod
+    def derived_values(data: Dict[str, object]) -> Tuple[object, ...]:
+        def opt(key: str) -> Optional[str]:
+            value = data.get(key)
+            return str(value).strip() if value else None
+
+        return (
+            opt("competencia"),
+            str(data.get("empresa") or "").strip(),
+            opt("grupo"),
+            opt("subgrupo"),
+            opt("orgao"),
+            opt("tributo"),
+            opt("subtipo"),
+            opt("acao"),
+            float(data.get("confianca") or 0),
+            str(data.get("raw_text") or "").strip(),
+            opt("fonte"),
+        )
+
     def create(
         self,
         *,
@@ -774,6 +1583,9 @@ class ClassificationRepository:
         confianca: float,
         status: str,
         raw_text: str,
+        fonte: Optional[str] = None,
+        log_segment: Optional[str] = None,
+        log_offset: Optional[int] = None,
     ) -> int:
         conn = _connect()
         cur = conn.cursor()
@@ -781,9 +1593,9 @@ class ClassificationRepository:
             """
             INSERT INTO classificacoes (
                 task_id, user_id, filename, competencia, empresa, grupo, subgrupo, orgao, tributo,
-                subtipo, acao, confianca, status, raw_text, created_at
+                subtipo, acao, confianca, status, raw_text, fonte, log_segment, log_offset, created_at
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
             """,
             (
                 int(task_id) if task_id is not None else None,
@@ -800,6 +1612,9 @@ class ClassificationRepository:
                 float(confianca or 0),
                 (status or "").strip(),
                 (raw_text or "").strip(),
+                fonte or None,
+                log_segment,
+                int(log_offset) if log_offset is not None else None,
             ),
         )
         conn.commit()
@@ -807,6 +1622,230 @@ class ClassificationRepository:
         conn.close()
         return new_id
 
+    def list_for_task(self, task_id: int) -> List[Dict[str, object]]:
+        rows = _fetch_task_rows(
+            task_id,
+            f"""
+            SELECT id, filename, status, created_at, log_segment, log_offset, {", ".join(self.DERIVED_FIELDS)}
+            FROM classificacoes WHERE task_id = ? ORDER BY id DESC
+            """,
+            (int(task_id),),
+        )
+        return [dict(r) for r in rows]
+
+    def fetch_after(
+        self, after_id: int, limit: int, statuses: Optional[List[str]] = None
+    ) -> List[Dict[str, object]]:
+        fields = ", ".join(self.DERIVED_FIELDS)
+        q = f"SELECT id, task_id, filename, status, {fields} FROM classificacoes WHERE id > ?"
+        params: list[object] = [int(after_id)]
+        if statuses:
+            q += f" AND status IN ({', '.join('?' for _ in statuses)})"
+            params.extend(statuses)
+        q += " ORDER BY id LIMIT ?"
+        params.append(int(limit))
+        conn = _connect()
+        cur = conn.cursor()
+        rows = cur.execute(q, params).fetchall()
+        conn.close()
+        return [dict(r) for r in rows]
+
+    def apply_reclassification(self, updates: List[Tuple[object, ...]], state: Dict[str, object]) -> None:
+        """Grava um lote (valores de DERIVED_FIELDS + status + id) e o checkpoint na mesma transacao."""
+        sets = ", ".join(f"{f} = ?" for f in self.DERIVED_FIELDS)
+        conn = _connect()
+        cur = conn.cursor()
+        if updates:
+            cur.executemany(f"UPDATE classificacoes SET {sets}, status = ? WHERE id = ?", updates)
+        cur.execute(
+            """
+            INSERT INTO app_settings (key, value, updated_at)
+            VALUES (?, ?, datetime('now'))
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            """,
+            (self.RECLASSIFY_STATE_KEY, json.dumps(state, ensure_ascii=False)),
+        )
+        conn.commit()
+        conn.close()
+
+    def stored_pdfs(self, items: List[Tuple[int, str]]) -> Dict[int, Dict[str, object]]:
+        """PDF guardado na tarefa, so quando ainda e o mesmo arquivo da classificacao (task_id, filename).
+
+        Devolve as referencias (pdf_sha256/pdf_blob); o conteudo sai de app.pdf_store.read_pdf.
+        """
+        if not items:
+            return {}
+        conn = _connect()
+        cur = conn.cursor()
+        rows = cur.execute(
+            f"""
+            SELECT id, pdf_path, pdf_sha256, pdf_blob FROM tarefas
+            WHERE (pdf_sha256 IS NOT NULL OR pdf_blob IS NOT NULL) AND id IN ({', '.join('?' for _ in items)})
+            """,
+            [int(task_id) for task_id, _ in items],
+        ).fetchall()
+        conn.close()
+        by_id = {int(r["id"]): r for r in rows}
+        found: Dict[int, Dict[str, object]] = {}
+        for task_id, filename in items:
+            row = by_id.get(int(task_id))
+            if row is not None and (row["pdf_path"] or "") == filename:
+                found[int(task_id)] = dict(row)
+        return found
+
+    def get_reclassify_state(self) -> Optional[Dict[str, object]]:
+        conn = _connect()
+        cur = conn.cursor()
+        row = cur.execute("SELECT value FROM app_settings WHERE key = ?", (self.RECLASSIFY_STATE_KEY,)).fetchone()
+        conn.close()
+        if not row or not row["value"]:
+            return None
+        try:
+            state = json.loads(row["value"])
+        except ValueError:
+            return None
+        return state if isinstance(state, dict) else None
+
+
+class ClassifierPatternRepository:
+    def list(self) -> Dict[str, object]:
+        conn = _connect()
+        cur = conn.cursor()
+        rows = cur.execute(
+            """
+            SELECT name, tipo, grupo, orgao, tributo, subgrupo, patterns, active
+            FROM classifier_patterns ORDER BY position, id
+            """
+        ).fetchall()
+        version = cur.execute("SELECT value FROM app_settings WHERE key = ?", (CLASSIFIER_VERSION_KEY,)).fetchone()
+        conn.close()
+        items = []
+        for r in rows:
+            item = dict(r)
+            item["patterns"] = json.loads(item["patterns"] or "[]")
+            item["active"] = bool(item["active"])
+            items.append(item)
+        return {"version": int(version["value"]) if version else None, "patterns": items}
+
+    def replace(self, items: List[Dict[str, object]]) -> int:
+        """Troca a tabela inteira numa transacao; a posicao na lista e a prioridade."""
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM classifier_patterns")
+        cur.executemany(
+            """
+            INSERT INTO classifier_patterns (position, name, tipo, grupo, orgao, tributo, subgrupo, patterns, active)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    pos,
+                    str(item["name"]).strip(),
+                    str(item["tipo"]).strip(),
+                    str(item["grupo"]).strip(),
+                    str(item["orgao"]).strip(),
+                    str(item["tributo"]).strip(),
+                    (str(item.get("subgrupo") or "").strip() or None),
+                    json.dumps(list(item["patterns"]), ensure_ascii=False),
+                    1 if item.get("active", True) else 0,
+                )
+                for pos, item in enumerate(items)
+            ],
+        )
+        version = bump_classifier_version(cur)
+        conn.commit()
+        conn.close()
+        return version
+
+
+class JobRunRepository:
+    def claim(self, name: str, owner: str, *, interval_s: int, lease_s: int, force: bool = False) -> bool:
+        """Reserva o job para este processo se ele esta vencido e sem lease ativo (um UPDATE atomico)."""
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("INSERT INTO job_runs (name) VALUES (?) ON CONFLICT(name) DO NOTHING", (name,))
+        cur.execute(
+            """
+            UPDATE job_runs
+            SET owner = ?, lease_until = datetime('now', ?), last_started = datetime('now'), runs = runs + 1
+            WHERE name = ?
+              AND (lease_until IS NULL OR lease_until < datetime('now'))
+              AND (? OR last_started IS NULL OR (julianday('now') - julianday(last_started)) * 86400 >= ?)
+            """,
+            (owner, f"+{int(lease_s)} seconds", name, 1 if force else 0, int(interval_s)),
+        )
+        claimed = cur.rowcount == 1
+        conn.commit()
+        conn.close()
+        return claimed
+
+    def finish(self, name: str, owner: str, *, status: str, elapsed_s: float, result: Dict[str, object]) -> None:
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE job_runs
+            SET lease_until = NULL, last_finished = datetime('now'), last_status = ?, last_elapsed_s = ?, last_result = ?
+            WHERE name = ? AND owner = ?
+            """,
+            (status, round(float(elapsed_s), 3), json.dumps(result, ensure_ascii=False, default=str), name, owner),
+        )
+        conn.commit()
+        conn.close()
+
+    def list(self) -> List[Dict[str, object]]:
+        conn = _connect()
+        cur = conn.cursor()
+        rows = cur.execute(
+            """
+            SELECT name, owner, lease_until, last_started, last_finished, last_status, last_elapsed_s, last_result, runs
+            FROM job_runs ORDER BY name
+            """
+        ).fetchall()
+        conn.close()
+        out = []
+        for r in rows:
+            item = dict(r)
+            try:
+                item["last_result"] = json.loads(item["last_result"]) if item["last_result"] else None
+            except ValueError:
+                pass
+            out.append(item)
+        return out
+
+
+class LoginAttemptRepository:
+    def count(self, key: str, now: float, window_s: int) -> int:
+        conn = _connect()
+        row = conn.execute(
+            "SELECT count FROM login_attempts WHERE key = ? AND first_at >= ?", (key, now - window_s)
+        ).fetchone()
+        conn.close()
+        return int(row["count"]) if row else 0
+
+    def register_failure(self, key: str, now: float, window_s: int) -> None:
+        # Um UPSERT so: workers diferentes registrando falhas da mesma chave nao perdem contagem
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO login_attempts (key, first_at, count) VALUES (?, ?, 1)
+            ON CONFLICT(key) DO UPDATE SET
+                count = CASE WHEN first_at < excluded.first_at - ? THEN 1 ELSE count + 1 END,
+                first_at = CASE WHEN first_at < excluded.first_at - ? THEN excluded.first_at ELSE first_at END
+            """,
+            (key, now, window_s, window_s),
+        )
+        cur.execute("DELETE FROM login_attempts WHERE first_at < ?", (now - window_s,))
+        conn.commit()
+        conn.close()
+
+    def clear(self, key: str) -> None:
+        conn = _connect()
+        conn.execute("DELETE FROM login_attempts WHERE key = ?", (key,))
+        conn.commit()
+        conn.close()
+
 
 class SettingsRepository:
     def _get_json(self, key: str, default: Dict[str, object]) -> Dict[str, object]:
@@ -885,3 +1924,46 @@ class SettingsRepository:
         self._set_json("email", current)
         return current
 
+
+    def get_value(self, key: str) -> Optional[str]:
+        conn = _connect()
+        row = conn.execute("SELECT value FROM app_settings WHERE key = ?", (key,)).fetchone()
+        conn.close()
+        return str(row["value"]) if row and row["value"] is not None else None
+
+    def get_backup_status(self) -> Dict[str, object]:
+        return self._get_json("backup_status", {"running": False, "last": None})
+
+    def set_backup_status(self, payload: Dict[str, object]) -> Dict[str, object]:
+        current = self.get_backup_status()
+        current.update(payload or {})
+        self._set_json("backup_status", current)
+        return current
+
+    def claim_backup(self, started_at: str, stale_before: str) -> bool:
+        """Marca backup_status como running se nenhum backup roda (ou o que roda comecou antes de stale_before).
+
+        Um upsert condicional so, como JobRunRepository.claim: entre processos, um unico ganha.
+        """
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO app_settings (key, value, updated_at)
+            VALUES ('backup_status', json_object('running', json('true'), 'started_at', ?, 'last', NULL), datetime('now'))
+            ON CONFLICT(key) DO UPDATE SET
+                value = CASE WHEN json_valid(app_settings.value)
+                    THEN json_set(app_settings.value, '$.running', json('true'), '$.started_at', json_extract(excluded.value, '$.started_at'))
+                    ELSE excluded.value END,
+                updated_at = excluded.updated_at
+            WHERE NOT json_valid(app_settings.value)
+               OR NOT COALESCE(json_extract(app_settings.value, '$.running'), 0)
+               OR COALESCE(json_extract(app_settings.value, '$.started_at'), '') < ?
+            """,
+            (started_at, stale_before),
+        )
+        claimed = cur.rowcount == 1
+        conn.commit()
+        conn.close()
+        return claimed
+
@@ -9,6 +9,7 @@ class UserOut(BaseModel):
     nome: str
     role: str
     is_default: bool
+    email: Optional[str] = None
 
 
 class UserCreate(BaseModel):
@@ -16,12 +17,17 @@ class UserCreate(BaseModel):
     role: str = "collab"
     is_default: bool = False
     senha: str = ""
+    email: str = ""
 
 
 class UserRoleUpdate(BaseModel):
     role: str
 
 
+class UserEmailUpdate(BaseModel):
+    email: str = ""
+
+
 class UserLogin(BaseModel):
     nome: str
     senha: str
@@ -114,6 +120,51 @@ class TaskUpdate(BaseModel):
     status: str
 
 
+class SearchCompanyOut(BaseModel):
+    id: int
+    nome: str
+    cnpj: Optional[str] = ""
+    ie: Optional[str] = ""
+    regime: Optional[str] = ""
+    responsavel_id: Optional[int] = None
+    rank: float
+
+
+class SearchTaskOut(BaseModel):
+    id: int
+    company_id: int
+    titulo: str
+    tipo: str
+    orgao: str
+    tributo: Optional[str] = ""
+    competencia: Optional[str] = None
+    status: str
+    rank: float
+
+
+class SearchOut(BaseModel):
+    companies: List[SearchCompanyOut]
+    tasks: List[SearchTaskOut]
+
+
+class ReportSummaryRow(BaseModel):
+    status: Optional[str] = None
+    competencia: Optional[str] = None
+    company_id: Optional[int] = None
+    responsavel_id: Optional[int] = None
+    tipo: Optional[str] = None
+    orgao: Optional[str] = None
+    total: int
+    with_pdf: int = 0
+    overdue: int = 0
+
+
+class ReportSummaryOut(BaseModel):
+    group_by: List[str]
+    total: int
+    rows: List[ReportSummaryRow]
+
+
 class TaskLogOut(BaseModel):
     id: int
     task_id: int
@@ -147,11 +198,32 @@ class NotificationOut(BaseModel):
 
 class EmailSendPayload(BaseModel):
     company_id: int
-    user_id: int
+    user_id: Optional[int] = None
+    # vazio = email_principal + emails_extra da empresa
+    to_emails: List[str] = []
     subject: str = ""
     body: str = ""
     link: str = ""
     task_id: Optional[int] = None
+    attach_pdf: bool = False
+
+
+class EmailOutboxOut(BaseModel):
+    id: int
+    company_id: Optional[int] = None
+    user_id: Optional[int] = None
+    task_id: Optional[int] = None
+    to_emails: List[str]
+    subject: str = ""
+    attach_pdf: bool = False
+    dedupe_key: Optional[str] = None
+    status: str
+    attempts: int = 0
+    next_attempt_at: Optional[str] = None
+    last_error: Optional[str] = None
+    email_log_id: Optional[int] = None
+    created_at: str
+    sent_at: Optional[str] = None
 
 
 class EmailLogOut(BaseModel):
@@ -161,7 +233,7 @@ class EmailLogOut(BaseModel):
     to_emails: List[str]
     subject: str = ""
     body: str = ""
-    link: str = ""
+    link: Optional[str] = ""
     task_id: Optional[int] = None
     attachment_name: Optional[str] = None
     created_at: str
@@ -198,3 +270,19 @@ class EmailSettingsUpdate(BaseModel):
     smtp_sender: str = ""
     smtp_tls: bool = True
 
+
+
+class ClassifierPatternItem(BaseModel):
+    name: str
+    tipo: str
+    grupo: str
+    orgao: str
+    tributo: str
+    subgrupo: Optional[str] = None
+    patterns: List[str]
+    active: bool = True
+
+
+class ClassifierPatternsOut(BaseModel):
+    version: Optional[int] = None
+    patterns: List[ClassifierPatternItem]
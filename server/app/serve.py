@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from .db import DB_PATH
+
+try:
+    from uvicorn.protocols.http.httptools_impl import HttpToolsProtocol as _HttpProtocol
+except ImportError:  # sem httptools o uvicorn usa h11
+    from uvicorn.protocols.http.h11_impl import H11Protocol as _HttpProtocol  # type: ignore[assignment]
+
+# Sobe o servidor com varios workers uvicorn (a partir de server/: python -m app.serve --workers 4).
+# O pai roda migracoes e a sincronizacao mensal uma vez e avisa os workers por STARTUP_DONE_ENV.
+STARTUP_DONE_ENV = "FISCAL_STARTUP_DONE"
+LOCK_TIMEOUT_S = 300
+
+
+@contextmanager
+def startup_lock(timeout_s: float = LOCK_TIMEOUT_S) -> Iterator[None]:
+    """Lock de arquivo ao lado do banco: so um processo por vez roda as tarefas de startup."""
+    path = Path(DB_PATH).with_name(Path(DB_PATH).name + ".startup.lock")
+    with open(path, "a+b") as fh:
+        if os.name == "nt":
+            import msvcrt
+
+            fh.seek(0)
+            deadline = time.monotonic() + timeout_s
+            while True:
+                try:
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if time.monotonic() >= deadline:
+                        raise TimeoutError(f"Lock de startup ocupado: {path}")
+                    time.sleep(0.2)
+            try:
+                yield
+            finally:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+class NoDelayHttpProtocol(_HttpProtocol):  # type: ignore[misc, valid-type]
+    """Protocolo HTTP do uvicorn com TCP_NODELAY garantido na conexao aceita.
+
+    Com mais de um worker o uvicorn cria o socket de escuta sem proto=IPPROTO_TCP e o asyncio deixa de ligar o
+    TCP_NODELAY nas conexoes: em keep-alive a resposta (cabecalho e corpo em dois envios) esperava ~40ms pelo ACK.
+    """
+
+    def connection_made(self, transport) -> None:  # type: ignore[no-untyped-def, override]
+        sock = transport.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass
+        super().connection_made(transport)
+
+
+def _default_workers() -> int:
+    raw = os.environ.get("FISCAL_WORKERS")
+    try:
+        return max(1, int(raw)) if raw else max(1, min(4, os.cpu_count() or 1))
+    except ValueError:
+        return 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.serve", description="Servidor do Fiscal HUB com varios workers")
+    parser.add_argument("--host", default=os.environ.get("FISCAL_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("FISCAL_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=_default_workers(), help="processos uvicorn (FISCAL_WORKERS)")
+    parser.add_argument("--reload", action="store_true", help="desenvolvimento: um worker que recarrega ao editar")
+    parser.add_argument("--log-level", default="info")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    import uvicorn
+
+    from .main import run_startup_tasks
+
+    if not args.reload:
+        # com --reload cada recarga roda o startup de novo (sob o lock), para pegar migracoes novas
+        run_startup_tasks()
+        # Workers herdam o ambiente: pulam o que o pai ja fez e so sobem o agendador (lease em job_runs)
+        os.environ[STARTUP_DONE_ENV] = "1"
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=1 if args.reload else max(1, args.workers),
+        reload=args.reload,
+        log_level=args.log_level,
+        http=NoDelayHttpProtocol,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+
+from . import profiling
+
+# Etapas de uma requisicao (auth, repositorios, extracao de PDF, classificacao, handler, serializacao) somadas
+# por nome e devolvidas no header Server-Timing, que o devtools do navegador mostra na aba Network/Timing.
+# FISCAL_SERVER_TIMING_LOG_SAMPLE (0..1) grava a mesma quebra em JSON no logger "fiscal.timing".
+logger = logging.getLogger("fiscal.timing")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+ENABLED = os.environ.get("FISCAL_SERVER_TIMING", "1") != "0"
+LOG_SAMPLE = min(1.0, max(0.0, _env_float("FISCAL_SERVER_TIMING_LOG_SAMPLE", 0.0)))
+# Header curto: so as etapas mais demoradas
+MAX_ENTRIES = 20
+
+
+class Timings:
+    __slots__ = ("stages", "nested")
+
+    def __init__(self) -> None:
+        # nome -> [segundos, chamadas]
+        self.stages: Dict[str, List[float]] = {}
+        self.nested = 0
+
+    def add(self, name: str, seconds: float) -> None:
+        entry = self.stages.get(name)
+        if entry is None:
+            self.stages[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+_CURRENT: ContextVar[Optional[Timings]] = ContextVar("fiscal_server_timing", default=None)
+
+
+def begin() -> Optional[Timings]:
+    if not ENABLED:
+        return None
+    timings = Timings()
+    _CURRENT.set(timings)
+    return timings
+
+
+def record(name: str, seconds: float) -> None:
+    timings = _CURRENT.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+class stage:
+    """with stage("auth"): ... soma o tempo na etapa da requisicao corrente (nada fora de requisicao)."""
+
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self) -> "stage":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        record(self.name, time.perf_counter() - self.started)
+
+
+def instrument_repository(cls: type) -> type:
+    """Envolve os metodos publicos: cada chamada vira a etapa "<Classe>.<metodo>".
+
+    Chamada de repositorio dentro de outra nao e contada de novo (o tempo ja esta na de fora).
+    """
+    for attr, func in list(vars(cls).items()):
+        if attr.startswith("_") or not inspect.isfunction(func):
+            continue
+        name = f"{cls.__name__}.{attr}"
+
+        def wrap(func: Callable[..., Any], name: str) -> Callable[..., Any]:
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                timings = _CURRENT.get()
+                if timings is None or timings.nested:
+                    return func(*args, **kwargs)
+                timings.nested += 1
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    timings.nested -= 1
+                    timings.add(name, time.perf_counter() - started)
+
+            return wrapper
+
+        setattr(cls, attr, wrap(func, name))
+    return cls
+
+
+def instrument_repositories(module: Any) -> None:
+    """instrument_repository em cada classe *Repository do modulo (chamado pela API, nao pelos comandos de linha)."""
+    for name, cls in list(vars(module).items()):
+        if name.endswith("Repository") and isinstance(cls, type) and not getattr(cls, "_server_timing", False):
+            instrument_repository(cls)
+            cls._server_timing = True  # type: ignore[attr-defined]
+
+
+def _timed_endpoint(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    if inspect.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def timed(*args: Any, **kwargs: Any) -> Any:
+            with stage("handler"):
+                run = profiling.current_run()
+                if run is None:
+                    return await endpoint(*args, **kwargs)
+                # no loop de eventos o cProfile ve tambem as outras corrotinas que rodarem no meio
+                with run:
+                    return await endpoint(*args, **kwargs)
+
+    else:
+
+        @functools.wraps(endpoint)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            with stage("handler"):
+                run = profiling.current_run()
+                if run is None:
+                    return endpoint(*args, **kwargs)
+                # endpoint sincrono roda numa thread do pool: o profiler e ligado nela
+                with run:
+                    return endpoint(*args, **kwargs)
+
+    timed._server_timing = True  # type: ignore[attr-defined]
+    return timed
+
+
+class TimedRoute(APIRoute):
+    """Separa o tempo da funcao do endpoint ("handler") do resto da rota: validacao e serializacao da resposta.
+
+    Tambem e onde uma sessao de app.profiling escolhe as requisicoes que vai perfilar.
+    """
+
+    def get_route_handler(self) -> Callable[..., Any]:
+        # Troca so a chamada final: a assinatura (e as anotacoes em string do main) ja foram lidas do endpoint original
+        endpoint = self.dependant.call
+        if endpoint is not None and not getattr(endpoint, "_server_timing", False):
+            self.dependant.call = _timed_endpoint(endpoint)
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Any) -> Any:
+            timings = _CURRENT.get()
+            run = profiling.claim(self.path, request.url.path, request.method)
+            started = time.perf_counter()
+            try:
+                response = await handler(request)
+            finally:
+                if run is not None:
+                    run.save()
+            if timings is not None:
+                total = time.perf_counter() - started
+                spent = timings.stages.get("handler", [0.0])[0]
+                timings.add("serialize", max(0.0, total - spent))
+            return response
+
+        return timed_handler
+
+
+def _token(name: str) -> str:
+    return "".join(ch if ch.isalnum() or ch in "._-" else "_" for ch in name)
+
+
+def header_value(timings: Timings, total_s: float, db_stats: Optional[List[float]] = None) -> str:
+    items = sorted(timings.stages.items(), key=lambda kv: kv[1][0], reverse=True)[:MAX_ENTRIES]
+    parts = []
+    for name, (seconds, calls) in items:
+        desc = f';desc="{int(calls)}x"' if calls > 1 else ""
+        parts.append(f"{_token(name)};dur={seconds * 1000:.2f}{desc}")
+    if db_stats is not None:
+        parts.append(f'db;dur={db_stats[1] * 1000:.2f};desc="{int(db_stats[0])} consultas"')
+    parts.append(f"total;dur={total_s * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def maybe_log(
+    timings: Timings, route: str, method: str, status: int, total_s: float, db_stats: Optional[List[float]] = None
+) -> None:
+    if LOG_SAMPLE <= 0 or random.random() >= LOG_SAMPLE:
+        return
+    payload = {
+        "event": "server_timing",
+        "route": route,
+        "method": method,
+        "status": status,
+        "total_ms": round(total_s * 1000, 2),
+        "db_ms": round(db_stats[1] * 1000, 2) if db_stats else None,
+        "db_queries": int(db_stats[0]) if db_stats else None,
+        "stages": {k: {"ms": round(v[0] * 1000, 2), "calls": int(v[1])} for k, v in timings.stages.items()},
+    }
+    logger.info(json.dumps(payload, ensure_ascii=False))
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .db import add_query_observer
+
+# Consultas acima de FISCAL_SLOW_QUERY_MS vao para um buffer circular em memoria (por processo, GET
+# /maintenance/slow-queries) e para o logger "fiscal.slow_query", junto com o EXPLAIN QUERY PLAN.
+# FISCAL_SLOW_QUERY_SCAN_TABLES=tarefas,... registra tambem consulta rapida que faz SCAN nessas tabelas.
+logger = logging.getLogger("fiscal.slow_query")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+THRESHOLD_S = max(0.0, _env_float("FISCAL_SLOW_QUERY_MS", 100) / 1000)
+BUFFER_SIZE = max(10, int(_env_float("FISCAL_SLOW_QUERY_BUFFER", 200)))
+SCAN_TABLES = frozenset(
+    t.strip().lower() for t in str(os.environ.get("FISCAL_SLOW_QUERY_SCAN_TABLES") or "").split(",") if t.strip()
+)
+# O plano de um mesmo SQL normalizado e reaproveitado por este tempo
+PLAN_TTL_S = 300.0
+
+_BUFFER: Deque[Dict[str, object]] = deque(maxlen=BUFFER_SIZE)
+_PLANS: Dict[str, Tuple[float, List[str]]] = {}
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+_RX_STRING = re.compile(r"'(?:[^']|'')*'")
+_RX_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_RX_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RX_SPACES = re.compile(r"\s+")
+# "SCAN t", "SCAN main.tarefas USING INDEX x" (percorre o indice inteiro), "SCAN TABLE t AS a" (SQLite < 3.36)
+_RX_SCAN = re.compile(r"^SCAN (?:TABLE )?(?:\w+\.)?(\w+)(?: AS (\w+))?(?: USING (?:COVERING )?INDEX \w+)?$")
+_RX_FROM = re.compile(r"\b(?:FROM|JOIN)\s+(?:\w+\.)?(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_NOT_ALIAS = {"where", "join", "left", "inner", "cross", "on", "group", "order", "limit", "union", "using", "natural"}
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+def normalize_sql(sql: str) -> str:
+    """Literais viram ?, listas IN (?, ?, ...) viram (?...) e espacos colapsam: agrupa a mesma consulta."""
+    text = _RX_STRING.sub("?", sql)
+    text = _RX_NUMBER.sub("?", text)
+    text = _RX_IN_LIST.sub("(?...)", text)
+    return _RX_SPACES.sub(" ", text).strip()
+
+
+def params_shape(params: object) -> str:
+    # so os tipos: os valores podem ter CNPJ, nomes e senhas
+    if params is None:
+        return "-"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in params.items()) + "}"
+    if isinstance(params, (list, tuple)):
+        return "(" + ", ".join(type(v).__name__ for v in params) + ")"
+    return type(params).__name__
+
+
+def _plan(conn: sqlite3.Connection, sql: str, params: object, key: str) -> Tuple[List[str], bool]:
+    """(plano, recem-calculado)."""
+    now = time.monotonic()
+    cached = _PLANS.get(key)
+    if cached and now - cached[0] < PLAN_TTL_S:
+        return cached[1], False
+    # cursor base do sqlite3: o EXPLAIN nao passa pelos observadores
+    cur = conn.cursor(sqlite3.Cursor)
+    try:
+        rows = cur.execute(f"EXPLAIN QUERY PLAN {sql}", params if params is not None else ()).fetchall()
+        plan = [str(r[3]) for r in rows]
+    except sqlite3.Error as exc:
+        plan = [f"(sem plano: {exc})"]
+    finally:
+        cur.close()
+    with _LOCK:
+        if len(_PLANS) > 500:
+            _PLANS.clear()
+        _PLANS[key] = (now, plan)
+    return plan, True
+
+
+def scanned_tables(sql: str, plan: List[str]) -> List[str]:
+    # SQLite 3.36+ mostra o alias ("SCAN t"); o FROM/JOIN do SQL devolve o nome da tabela
+    aliases = {}
+    for table, alias in _RX_FROM.findall(sql):
+        aliases[table.lower()] = table.lower()
+        if alias and alias.lower() not in _NOT_ALIAS:
+            aliases[alias.lower()] = table.lower()
+    tables = []
+    for line in plan:
+        match = _RX_SCAN.match(line.strip())
+        if match:
+            name = (match.group(2) or match.group(1)).lower()
+            tables.append(aliases.get(name, name))
+    return tables
+
+
+def _observe(sql: str, params: object, elapsed: float, rows: int, conn: sqlite3.Connection) -> None:
+    slow = elapsed >= THRESHOLD_S
+    if not slow and not SCAN_TABLES:
+        return
+    if getattr(_LOCAL, "busy", False):
+        return
+    head = sql.lstrip()[:10].upper()
+    explainable = head.startswith(_EXPLAINABLE) and params is not None
+    if not slow and not (explainable and any(t in sql.lower() for t in SCAN_TABLES)):
+        return
+    _LOCAL.busy = True
+    try:
+        key = normalize_sql(sql)
+        plan, fresh = _plan(conn, sql, params, key) if explainable else ([], False)
+        scans = scanned_tables(sql, plan)
+        # consulta rapida com SCAN entra uma vez por PLAN_TTL_S, nao a cada execucao
+        if not slow and not (fresh and any(t in SCAN_TABLES for t in scans)):
+            return
+        entry = {
+            "at": datetime.now().isoformat(timespec="milliseconds"),
+            "pid": os.getpid(),
+            "ms": round(elapsed * 1000, 2),
+            "reason": "slow" if slow else "scan",
+            "sql": key,
+            "params": params_shape(params),
+            "rows": int(rows),
+            "plan": plan,
+            "full_scans": scans,
+            "temp_btree": any("TEMP B-TREE" in line for line in plan),
+        }
+        _BUFFER.append(entry)
+        logger.warning(
+            "consulta %s %.1fms rows=%d scans=%s sql=%s plan=%s",
+            entry["reason"],
+            entry["ms"],
+            entry["rows"],
+            ",".join(scans) or "-",
+            key,
+            " | ".join(plan) or "-",
+        )
+    finally:
+        _LOCAL.busy = False
+
+
+def entries(limit: Optional[int] = None) -> List[Dict[str, object]]:
+    items = list(_BUFFER)
+    items.reverse()
+    return items[:limit] if limit else items
+
+
+def clear() -> int:
+    count = len(_BUFFER)
+    _BUFFER.clear()
+    return count
+
+
+def settings() -> Dict[str, object]:
+    return {
+        "threshold_ms": round(THRESHOLD_S * 1000, 1),
+        "buffer_size": BUFFER_SIZE,
+        "scan_tables": sorted(SCAN_TABLES),
+        "pid": os.getpid(),
+    }
+
+
+add_query_observer(_observe)
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import socketserver
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# Servidor SMTP minimo para desenvolvimento e testes do mailer (python -m app.manage smtp-sink): aceita
+# qualquer remetente, grava cada mensagem como .eml e nao entrega nada. Sem TLS/AUTH: use smtp_tls=false
+# e smtp_user vazio em /settings/email. --reject-rcpt simula destinatario recusado (550).
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "SmtpSink"
+
+    def _reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+        self.wfile.flush()
+
+    def handle(self) -> None:
+        self.server.connections += 1
+        self._reply("220 fiscal-smtp-sink ESMTP")
+        sender: Optional[str] = None
+        recipients: List[str] = []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            verb = line[:4].upper()
+            if verb == "EHLO":
+                self.wfile.write(b"250-fiscal-smtp-sink\r\n250-8BITMIME\r\n250 SMTPUTF8\r\n")
+                self.wfile.flush()
+            elif verb == "HELO":
+                self._reply("250 fiscal-smtp-sink")
+            elif verb == "MAIL":
+                sender, recipients = line[10:].strip(), []
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                rcpt = line[8:].strip().strip("<>").split(">")[0]
+                if any(p in rcpt for p in self.server.reject):
+                    self._reply(f"550 {rcpt}: destinatario recusado")
+                else:
+                    recipients.append(rcpt)
+                    self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 fim com <CRLF>.<CRLF>")
+                data = bytearray()
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b".\r\n", b".\n"):
+                        break
+                    data += chunk[1:] if chunk.startswith(b"..") else chunk
+                path = self.server.store(bytes(data))
+                self._reply(f"250 OK {path.name}")
+                sender, recipients = None, []
+            elif verb in ("RSET", "NOOP"):
+                if verb == "RSET":
+                    sender, recipients = None, []
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 ate mais")
+                return
+            else:
+                self._reply("502 comando nao suportado")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int], out_dir: Path, reject: Tuple[str, ...] = ()) -> None:
+        super().__init__(address, _Handler)
+        self.out_dir = out_dir
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.reject = reject
+        self.connections = 0
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def store(self, data: bytes) -> Path:
+        with self._lock:
+            self.messages += 1
+            path = self.out_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{self.messages:05d}.eml"
+        path.write_bytes(data)
+        return path
+
+
+def serve(host: str, port: int, out_dir: str, reject: Tuple[str, ...] = ()) -> None:
+    with SmtpSink((host, port), Path(out_dir), reject) as sink:
+        print(f"smtp-sink em {host}:{sink.server_address[1]}, mensagens em {sink.out_dir}", flush=True)
+        try:
+            sink.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        print(f"{sink.messages} mensagem(ns) em {sink.connections} conexao(oes)", flush=True)
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from .br_docs import is_valid_cnpj, only_digits
+from .classifier import current_patterns
+from .content_classifier import CONTENT_PROFILES
+
+# Competencia precedida de um destes rotulos (ate LABEL_WINDOW caracteres antes) vale mais
+# que uma data solta, como vencimento ou emissao.
+COMPETENCIA_LABELS = ("compet", "apura", "referencia", "referência", "periodo", "período")
+LABEL_WINDOW = 40
+LABEL_BONUS = 2.0
+DATE_PENALTY = 0.5
+
+
+@dataclass
+class Candidate:
+    value: str
+    positions: List[int] = field(default_factory=list)
+    score: float = 0.0
+
+
+@dataclass
+class ScanResult:
+    cnpjs: List[Candidate]
+    competencias: List[Candidate]
+    tributos: Dict[str, List[int]]
+
+    def best_cnpj(self, expected: Optional[str] = None) -> Optional[str]:
+        """CNPJ valido do documento: o esperado, se aparece em qualquer ponto; senao o mais frequente."""
+        return _best(self.cnpjs, expected)
+
+    def best_competencia(self, expected: Optional[str] = None) -> Optional[str]:
+        return _best(self.competencias, expected)
+
+    def has_tributo(self, tributo: Optional[str]) -> Optional[bool]:
+        if not tributo or not tributo.strip():
+            return None
+        return tributo.strip().upper() in self.tributos
+
+
+def _best(candidates: List[Candidate], expected: Optional[str]) -> Optional[str]:
+    if not candidates:
+        return None
+    if expected and any(c.value == expected for c in candidates):
+        return expected
+    # maior pontuacao; empate fica com a que aparece primeiro
+    return max(candidates, key=lambda c: (c.score, -c.positions[0])).value
+
+
+def _strip_accents(text: str) -> str:
+    return "".join(ch for ch in unicodedata.normalize("NFD", text) if unicodedata.category(ch) != "Mn")
+
+
+def _trie_regex(words: Iterable[str]) -> str:
+    # O re do CPython nao fatora alternancias; a arvore de prefixos evita testar cada apelido
+    # em cada posicao. Palavras mais longas vencem porque o ramo "fim de palavra" vem por ultimo.
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def render(node: Dict[str, dict]) -> str:
+        branches = []
+        ends = "" in node
+        for ch in sorted(k for k in node if k):
+            piece = r"\s+" if ch == " " else re.escape(ch)
+            branches.append(piece + render(node[ch]))
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if ends else body
+
+    return render(trie)
+
+
+@lru_cache(maxsize=32)
+def _compile(aliases: FrozenSet[Tuple[str, str]]) -> Tuple["re.Pattern[str]", Dict[str, Tuple[str, ...]]]:
+    # um apelido pode ser de varios tributos ("cofins" -> COFINS digitado na tarefa e DARF COFINS)
+    owner: Dict[str, Tuple[str, ...]] = {}
+    for alias, tributo in sorted(aliases):
+        owner[alias] = owner.get(alias, ()) + (tributo,)
+    # \b na frente de tudo: no meio de uma palavra ou numero o motor desiste no primeiro teste.
+    # O (?=\d) separa os ramos numericos da arvore de tributos (~30% mais rapido no benchmark).
+    rx = re.compile(
+        r"\b(?:(?=\d)(?:"
+        r"(?P<cnpjf>\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}(?!\d))"
+        r"|(?P<cnpj>\d{14}(?!\d))"
+        r"|(?<![/-])(?P<comp>(?:(?P<dd>\d{2})[/-])?(?P<mm>0[1-9]|1[0-2])[/-](?P<yyyy>\d{4})(?![\d/-]))"
+        rf")|(?P<trib>{_trie_regex(owner)})(?![a-z0-9])"
+        r")",
+        re.IGNORECASE,
+    )
+    return rx, owner
+
+
+def _alias_table(extra: Iterable[str] = ()) -> FrozenSet[Tuple[str, str]]:
+    """Apelidos de cada tributo: o proprio nome e os termos fortes do perfil de conteudo do padrao."""
+    aliases = set()
+    for name in extra:
+        if name and name.strip():
+            aliases.add((" ".join(name.lower().split()), name.strip().upper()))
+    for pat in current_patterns():
+        tributo = pat.tributo.strip().upper()
+        names = {pat.tributo, pat.name}
+        profile = CONTENT_PROFILES.get(pat.name) or {}
+        names.update(term for term, weight in (profile.get("terms") or {}).items() if weight >= 2.0)
+        for name in names:
+            for form in {name, _strip_accents(name)}:
+                form = " ".join(form.lower().split())
+                if form:
+                    aliases.add((form, tributo))
+    return frozenset(aliases)
+
+
+def scan_text(text: str, tributos: Iterable[str] = ()) -> ScanResult:
+    """Uma passada de regex sobre o texto: CNPJs (com DV), competencias (AAAAMM) e tributos, com posicoes.
+
+    tributos acrescenta nomes fora da tabela de padroes (ex.: o tributo digitado na tarefa).
+    """
+    rx, owner = _compile(_alias_table(tributos))
+    cnpjs: Dict[str, Candidate] = {}
+    comps: Dict[str, Candidate] = {}
+    found: Dict[str, List[int]] = {}
+    text = text or ""
+    for m in rx.finditer(text):
+        kind = m.lastgroup
+        pos = m.start()
+        if kind == "trib":
+            alias = " ".join(m.group("trib").lower().split())
+            for tributo in owner.get(alias) or (alias.upper(),):
+                found.setdefault(tributo, []).append(pos)
+        elif kind in ("cnpjf", "cnpj"):
+            digits = only_digits(m.group(0))
+            if not is_valid_cnpj(digits):
+                continue
+            cand = cnpjs.setdefault(digits, Candidate(digits))
+            cand.positions.append(pos)
+            cand.score += 1.0
+        else:
+            value = f"{m.group('yyyy')}{m.group('mm')}"
+            cand = comps.setdefault(value, Candidate(value))
+            cand.positions.append(pos)
+            weight = DATE_PENALTY if m.group("dd") else 1.0
+            before = text[max(0, pos - LABEL_WINDOW) : pos].lower()
+            if any(label in before for label in COMPETENCIA_LABELS):
+                weight += LABEL_BONUS
+            cand.score += weight
+    return ScanResult(list(cnpjs.values()), list(comps.values()), found)
+
+
+_BENCH_PAGE = """MINISTERIO DA FAZENDA - SECRETARIA DA RECEITA FEDERAL DO BRASIL
+Documento de Arrecadacao de Receitas Federais - DARF
+CNPJ 11.222.333/0001-81 Razao Social EMPRESA EXEMPLO LTDA
+Periodo de Apuracao 01/2026 Data de Vencimento 25/02/2026
+Codigo da Receita 5856 COFINS - Nao cumulativa  Numero de referencia 0000000
+Valor do Principal 1.234,56 Multa 0,00 Juros 0,00 Valor Total 1.234,56
+Autenticacao bancaria 8589000000123456 Linha digitavel 85890000001 23456780001 81202602250
+"""
+
+
+def benchmark(megabytes: float = 4.0, rounds: int = 3) -> Dict[str, object]:
+    """Mede scan_text sobre um dump sintetico (paginas de DARF repetidas)."""
+    import time
+
+    reps = max(1, int(megabytes * 1024 * 1024 / len(_BENCH_PAGE)))
+    text = _BENCH_PAGE * reps
+    scan_text("")  # compila fora da medicao
+    timings = []
+    result = None
+    for _ in range(max(1, rounds)):
+        started = time.perf_counter()
+        result = scan_text(text)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    size_mb = len(text) / (1024 * 1024)
+    return {
+        "mb": round(size_mb, 2),
+        "best_s": round(best, 4),
+        "mb_per_s": round(size_mb / best, 2) if best else None,
+        "cnpj": result.best_cnpj() if result else None,
+        "competencia": result.best_competencia() if result else None,
+        "tributos": sorted(result.tributos) if result else [],
+    }
@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+# Base sintetica (bench.dataset) e medicao de latencia por endpoint (bench.run), a partir de server/.
+# Os modulos de app.* leem FISCAL_DB_PATH/FISCAL_DATA_DIR na hora do uso: configure() vem antes dos imports.
+
+# Senha de todos os usuarios gerados pelo bench.dataset
+BENCH_PASSWORD = "bench-1234"
+DATASET_KEY = "bench_dataset"
+
+
+def configure(db_path: str, data_dir: Optional[str] = None) -> Tuple[Path, Path]:
+    db = Path(db_path).expanduser().resolve()
+    data = Path(data_dir).expanduser().resolve() if data_dir else db.parent / "data"
+    os.environ["FISCAL_DB_PATH"] = str(db)
+    os.environ["FISCAL_DATA_DIR"] = str(data)
+    # medicao sem o agendador (e o mailer) disputando o banco
+    os.environ.setdefault("FISCAL_JOBS_ENABLED", "0")
+    os.environ.setdefault("FISCAL_EMAIL_WORKER_ENABLED", "0")
+    return db, data
@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+# Teste diferencial do classificador por nome de arquivo: o classify_filename/classify_many atual (tabela
+# compilada com ancoras, cache por lote) contra uma copia congelada do classificador anterior (re.search em
+# cada regex, na ordem da lista), com a mesma lista de padroes. Falha com qualquer diferenca.
+#
+#   python -m bench.classifier_diff                          # nomes gerados + nomes no formato real (roda no CI)
+#   python -m bench.classifier_diff --db /caminho/app.db     # tambem os nomes gravados (tarefas.pdf_path, classificacoes)
+#
+# Com --db os padroes sao os da tabela classifier_patterns dessa base; sem --db, os embutidos (PATTERNS).
+# Tambem confere merge_content (nome + texto do PDF) nos casos de CONTENT_CASES.
+
+# Nomes como chegam no upload: competencia, tarefa e empresa separados por " - ", com as variacoes vistas na pratica
+REAL_NAMES = (
+    "012026 - DARF PIS - ACME LTDA.pdf",
+    "01-2026 - DARF COFINS - Comercial Alfa Ltda.pdf",
+    "01/2026 - GR ICMS - Industria Beta ME.pdf",
+    "022026 - GUIA ICMS ST - Distribuidora Sao Jorge - Filial 2.pdf",
+    "032026 - ICMS DIFAL - Transportes Nova Era EIRELI.PDF",
+    "032026 - APURACAO ICMS - Agro Cerrado S.A..pdf",
+    "1T2025 - DARF IRPJ 1 TRIMESTRE - Construtora Litoral.pdf",
+    "122025 - DARF CSLL - 4 TRIMESTRE - Farmacia Primavera.pdf",
+    "102025 - IRPJ E CSLL - Servicos Boa Vista Ltda EPP.pdf",
+    "102025 - PIS E COFINS - Servicos Boa Vista Ltda EPP.pdf",
+    "092025 - SPED FISCAL - Comercial Pioneira.pdf",
+    "092025 - SPED Contribuições - Comercial Pioneira.pdf",
+    "092025 - MIT - DCTFWEB - Comercial Pioneira.pdf",
+    "092025 - DCTFWEB - Comercial Pioneira.pdf",
+    "082025 - REINF - Tres Irmaos.pdf",
+    "082025 - DeSTDA - Tres Irmaos.pdf",
+    "072025 - GIA - Santa Clara.pdf",
+    "072025 - DIME - Santa Clara.pdf",
+    "072025 - DAPI - Santa Clara.pdf",
+    "062025 - ISS - Horizonte.pdf",
+    "062025 - ISSRF - Horizonte.pdf",
+    "062025 - GUIA ISSQN - Horizonte.pdf",
+    "052025 - DARF IRRF - Atlantico.pdf",
+    "052025 - DARF INSS - Atlantico.pdf",
+    "052025 - GRPR INSS - Atlantico.pdf",
+    "052025 - GNRE ICMS - Atlantico.pdf",
+    "052025 - DAS - Atlantico.pdf",
+    "042025 - DARE ICMS - Serra Azul.pdf",
+    "042025 - DAE ICMS - Serra Azul.pdf",
+    "042025 - DUA ICMS - Serra Azul.pdf",
+    "042025 - GA ICMS - Serra Azul.pdf",
+    "042025 - ICMS A - Serra Azul.pdf",
+    "042025 - darf_pis - serra azul.pdf",
+    "guia darf cofins.pdf",
+    "DARF IPI.pdf",
+    "comprovante.pdf",
+    "012026 -  - ACME.pdf",
+    "",
+)
+
+# (nome do arquivo, texto do PDF, tributo, competencia, fonte, status) esperados depois de merge_content
+_DARF_COFINS = (
+    "MINISTERIO DA FAZENDA - DARF Documento de Arrecadacao de Receitas Federais\n"
+    "Periodo de Apuracao 01/2026 Data de Vencimento 25/02/2026\n"
+    "Codigo da Receita 2172 COFINS Valor Total 1.234,56"
+)
+CONTENT_CASES = (
+    # nome e conteudo concordam
+    ("012026 - DARF COFINS - ACME.pdf", _DARF_COFINS, "DARF COFINS", "01/2026", "nome+conteudo", "ok"),
+    # nome sem padrao: conteudo decide, competencia do texto
+    ("digitalizado.pdf", _DARF_COFINS, "DARF COFINS", "01/2026", "conteudo", "ok"),
+    # nome e conteudo discordam: codigo de receita e folga vencem o nome, mas vai para revisao
+    ("012026 - DARF PIS - ACME.pdf", _DARF_COFINS, "DARF COFINS", "01/2026", "divergente", "needs_review"),
+    # conteudo fraco (sem codigo) nao derruba o nome
+    ("012026 - DARF PIS - ACME.pdf", "DARF PIS COFINS", "DARF PIS", "01/2026", "nome", "ok"),
+    # so data solta no texto: nao vira competencia
+    ("DARF COFINS.pdf", "COFINS vencimento 25/02/2026", "DARF COFINS", None, "nome+conteudo", "ok"),
+)
+
+_SEPARATORS = (" - ", "-", " -", "_", " ")
+_COMPETENCIAS = ("012026", "01-2026", "13/2025", "", "2026", "1T2025", "12/2025")
+_EMPRESAS = ("ACME LTDA", "", "Empresa - Filial", "Comércio São João")
+_EXTRA_WORDS = (
+    "APUR APURACAO GUIA GR GA DARE DAE DUA GRPR DARF GNRE DAS DCTFWEB TRIMESTRE 1 2 3 4 5 E ST A PIS COFINS "
+    "SPED FISCAL CONTRIBUICOES EMPRESA LTDA MIT DIFAL XPTO ISSQN"
+).split() + ["Contribuições", "ção", "icms-st", "darf_pis", "1º", "/"]
+
+
+# --- copia congelada do classificador anterior (app/classifier.py antes da tabela compilada) -------------------
+# Nao otimizar: e a referencia. So a lista de padroes vem de fora.
+
+
+def _ref_normalize(text: str) -> str:
+    text = text or ""
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    text = text.upper()
+    text = re.sub(r"[^A-Z0-9]+", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return text
+
+
+def _ref_parse_competencia(raw: str) -> Optional[str]:
+    if not raw:
+        return None
+    m = re.search(r"\b(\d{2})[-/](\d{4})\b", raw)
+    if not m:
+        m = re.search(r"\b(\d{2})(\d{4})\b", raw)
+    if not m:
+        return None
+    return f"{m.group(1)}/{m.group(2)}"
+
+
+def _ref_match_pattern(patterns: Sequence[Any], text_norm: str) -> Optional[Any]:
+    for pat in patterns:
+        for rx in pat.patterns:
+            if re.search(rx, text_norm):
+                return pat
+    return None
+
+
+def _ref_infer_action(text_norm: str, tipo: Optional[str]) -> Optional[str]:
+    if re.search(r"\bAPUR", text_norm):
+        return "APURACAO"
+    if re.search(r"\bGUIA\b|\bGR\b|\bGA\b|\bDARE\b|\bDAE\b|\bDUA\b|\bGRPR\b|\bDARF\b|\bGNRE\b|\bDAS\b", text_norm):
+        return "GUIA"
+    if tipo == "ACS":
+        return "ENTREGA"
+    return None
+
+
+def _ref_infer_subtipo(text_norm: str) -> Optional[str]:
+    for key in ["GRPR", "GR", "GA", "DARE", "DAE", "DUA", "DCTFWEB", "GNRE", "DARF"]:
+        if re.search(rf"\b{key}\b", text_norm):
+            return key
+    if re.search(r"\bDARF\s+PIS\b", text_norm):
+        return "PIS"
+    if re.search(r"\bDARF\s+COFINS\b", text_norm):
+        return "COFINS"
+    return None
+
+
+def _ref_infer_trimestre(text_norm: str) -> Optional[str]:
+    m = re.search(r"\b([1-4])\s+TRIMESTRE\b", text_norm)
+    if not m:
+        return None
+    return f"TRIMESTRE_{m.group(1)}"
+
+
+def reference_classify(patterns: Sequence[Any], filename: str) -> Dict[str, Any]:
+    name = Path(filename).stem
+    parts = [p.strip() for p in re.split(r"\s*-\s*", name) if p.strip()]
+    competencia_raw = parts[0] if len(parts) >= 2 else ""
+    tarefa_raw = parts[1] if len(parts) >= 2 else (parts[0] if parts else "")
+    empresa = " - ".join(parts[2:]) if len(parts) >= 3 else ""
+
+    competencia = _ref_parse_competencia(competencia_raw) or _ref_parse_competencia(name)
+    tarefa_norm = _ref_normalize(tarefa_raw)
+    pattern = _ref_match_pattern(patterns, tarefa_norm)
+
+    tipo = pattern.tipo if pattern else None
+    grupo = pattern.grupo if pattern else None
+    subgrupo = pattern.subgrupo if pattern else None
+    orgao = pattern.orgao if pattern else None
+    tributo = pattern.tributo if pattern else None
+    acao = _ref_infer_action(tarefa_norm, tipo)
+    subtipo = _ref_infer_subtipo(tarefa_norm)
+    trimestre = _ref_infer_trimestre(tarefa_norm)
+    if trimestre and (subgrupo or "").startswith("TRIMESTRAL"):
+        subtipo = trimestre
+
+    confianca = 0.0
+    if pattern:
+        confianca = 0.9
+        if acao:
+            confianca = 0.95
+
+    return {
+        "filename": filename,
+        "competencia": competencia,
+        "empresa": empresa,
+        "grupo": grupo,
+        "subgrupo": subgrupo,
+        "tipo": tipo,
+        "orgao": orgao,
+        "tributo": tributo,
+        "subtipo": subtipo,
+        "acao": acao,
+        "confianca": confianca,
+        "raw_text": tarefa_raw,
+    }
+
+
+# --- nomes ------------------------------------------------------------------------------------------------------
+
+
+def generated_names(patterns: Sequence[Any], count: int, seed: int) -> List[str]:
+    """Palavras dos padroes e das regras de acao/subtipo recombinadas, com separadores, acentos e competencias."""
+    rng = random.Random(seed)
+    words = set(_EXTRA_WORDS)
+    for pat in patterns:
+        words.update(_ref_normalize(pat.name).split())
+        words.update(_ref_normalize(pat.tributo).split())
+        # literais das regex (padroes editados em /classifier/patterns entram sozinhos)
+        for rx in pat.patterns:
+            words.update(re.findall(r"[A-Z0-9]{2,}", rx))
+    vocab = sorted(words)
+    names = []
+    for _ in range(count):
+        tarefa = " ".join(rng.choice(vocab) for _ in range(rng.randint(0, 6)))
+        parts = [rng.choice(_COMPETENCIAS), tarefa, rng.choice(_EMPRESAS)]
+        sep = rng.choice(_SEPARATORS)
+        names.append(sep.join(p for p in parts if p or rng.random() < 0.1) + rng.choice((".pdf", ".PDF", "")))
+    return names
+
+
+def real_format_names(patterns: Sequence[Any]) -> List[str]:
+    """REAL_NAMES mais o nome e o tributo de cada padrao no formato do upload (bench.dataset.pdf_filename)."""
+    from .dataset import pdf_filename
+
+    names = list(REAL_NAMES)
+    for pat in patterns:
+        for label in (pat.name, pat.tributo, f"GUIA {pat.tributo}", f"APURACAO {pat.name}", f"{pat.name} 2 TRIMESTRE"):
+            names.append(pdf_filename("202601", label, "Empresa Exemplo Ltda"))
+    return names
+
+
+def stored_names(db_path: Path, limit: int) -> List[str]:
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        names: List[str] = []
+        for sql in (
+            "SELECT DISTINCT pdf_path FROM tarefas WHERE pdf_path IS NOT NULL AND pdf_path <> '' LIMIT ?",
+            "SELECT DISTINCT filename FROM classificacoes WHERE filename IS NOT NULL AND filename <> '' LIMIT ?",
+        ):
+            try:
+                names += [str(r[0]) for r in conn.execute(sql, (int(limit),)).fetchall()]
+            except sqlite3.Error:
+                continue
+        return names
+    finally:
+        conn.close()
+
+
+# --- comparacao -------------------------------------------------------------------------------------------------
+
+
+def compare(names: Sequence[str]) -> Dict[str, Any]:
+    from app import classifier
+
+    patterns = classifier.current_patterns()
+    started = time.perf_counter()
+    expected = [reference_classify(patterns, n) for n in names]
+    reference_s = time.perf_counter() - started
+    started = time.perf_counter()
+    single = [classifier.classify_filename(n) for n in names]
+    single_s = time.perf_counter() - started
+    started = time.perf_counter()
+    batch = classifier.classify_many(names)
+    batch_s = time.perf_counter() - started
+    mismatches = []
+    for label, got in (("classify_filename", single), ("classify_many", batch)):
+        for name, exp, res in zip(names, expected, got):
+            if exp != res:
+                fields = sorted(k for k in set(exp) | set(res) if exp.get(k) != res.get(k))
+                mismatches.append(
+                    {"funcao": label, "filename": name, "campos": {k: (exp.get(k), res.get(k)) for k in fields}}
+                )
+    return {
+        "names": len(names),
+        "patterns": len(patterns),
+        "matched": sum(1 for e in expected if e["tributo"]),
+        "reference_s": round(reference_s, 2),
+        "classify_filename_s": round(single_s, 2),
+        "classify_many_s": round(batch_s, 2),
+        "mismatches": mismatches,
+    }
+
+
+def check_content() -> List[Dict[str, Any]]:
+    from app import classifier
+    from app.content_classifier import classify_text, merge_content, review_status
+
+    mismatches = []
+    for filename, text, *expected in CONTENT_CASES:
+        got = merge_content(classifier.classify_filename(filename), classify_text(text))
+        status = review_status(got.get("tributo"), got.get("fonte"))
+        result = [got.get("tributo"), got.get("competencia"), got.get("fonte"), status]
+        if result != expected:
+            mismatches.append({"filename": filename, "esperado": expected, "obtido": result})
+    return mismatches
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Classificador atual x copia congelada do anterior")
+    parser.add_argument("--names", type=int, default=50000, help="nomes gerados")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--db", help="app.db: usa os padroes dessa base e compara tambem os nomes gravados")
+    parser.add_argument("--db-limit", type=int, default=100000, help="maximo de nomes lidos de cada tabela da --db")
+    parser.add_argument("--show", type=int, default=10, help="diferencas impressas")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    db_path = Path(args.db).expanduser().resolve() if args.db else None
+    # Sem --db: caminho inexistente, o classificador fica com os padroes embutidos
+    os.environ["FISCAL_DB_PATH"] = str(db_path or Path(tempfile.gettempdir()) / f"classifier-diff-{os.getpid()}.db")
+    os.environ.setdefault("FISCAL_DATA_DIR", tempfile.mkdtemp(prefix="classifier-diff-"))
+    if db_path is not None and not db_path.is_file():
+        print(f"base nao encontrada: {db_path}", file=sys.stderr)
+        return 2
+
+    from app import classifier
+
+    patterns = classifier.current_patterns()
+    sources = {
+        "real": real_format_names(patterns),
+        "gerados": generated_names(patterns, args.names, args.seed),
+    }
+    if db_path is not None:
+        sources["base"] = stored_names(db_path, args.db_limit)
+    failed = False
+    for label, names in sources.items():
+        result = compare(names)
+        mismatches = result.pop("mismatches")
+        print(f"[{label}] {result} diferencas={len(mismatches)}")
+        for item in mismatches[: args.show]:
+            print(f"  {item}")
+        failed = failed or bool(mismatches)
+    if db_path is None:
+        # casos escritos para os padroes embutidos
+        mismatches = check_content()
+        print(f"[conteudo] casos={len(CONTENT_CASES)} diferencas={len(mismatches)}")
+        for item in mismatches[: args.show]:
+            print(f"  {item}")
+        failed = failed or bool(mismatches)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
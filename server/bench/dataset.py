@@ -0,0 +1,406 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import BENCH_PASSWORD, DATASET_KEY, configure
+
+# Gera um app.db com volume de producao: empresas com regime, M meses de tarefas pelas mesmas regras de
+# _sync_monthly_tasks_for, historico de status, comentarios, notificacoes, e-mails enviados e PDFs sinteticos.
+#
+#   python -m bench.dataset --out /tmp/fiscal-bench/app.db --companies 300 --months 24
+
+REGIMES = (("Simples Nacional", 0.55), ("Lucro Presumido", 0.30), ("Lucro Real", 0.15))
+_PREFIXES = ("Comercial", "Industria", "Distribuidora", "Transportes", "Servicos", "Agro", "Construtora", "Farmacia")
+_CORES = (
+    "Alfa", "Beta", "Horizonte", "Vale Verde", "Santa Clara", "Sao Jorge", "Nova Era", "Bandeirantes",
+    "Atlantico", "Serra Azul", "Tres Irmaos", "Primavera", "Boa Vista", "Pioneira", "Litoral", "Cerrado",
+)
+_SUFFIXES = ("Ltda", "ME", "EIRELI", "S.A.", "Ltda EPP")
+_COMMENTS = (
+    "Cliente ainda nao enviou o faturamento do mes.",
+    "Guia conferida, aguardando pagamento.",
+    "Valor diferente do mes anterior, conferir base de calculo.",
+    "Enviado por e-mail para o financeiro.",
+    "Parcelamento em andamento, ver com o responsavel.",
+    "Retificar a declaracao antes de gerar a guia.",
+)
+_BATCH = 5000
+
+
+def _weighted(rng: random.Random, options: Sequence[Tuple[str, float]]) -> str:
+    return rng.choices([o[0] for o in options], weights=[o[1] for o in options])[0]
+
+
+def _cnpj(rng: random.Random, used: set) -> str:
+    from app.br_docs import _CNPJ_WEIGHTS_1, _CNPJ_WEIGHTS_2, _cnpj_check_digit
+
+    while True:
+        base = f"{rng.randrange(10**8):08d}0001"
+        first = _cnpj_check_digit(base, _CNPJ_WEIGHTS_1)
+        digits = base + first + _cnpj_check_digit(base + first, _CNPJ_WEIGHTS_2)
+        if digits not in used:
+            used.add(digits)
+            return f"{digits[:2]}.{digits[2:5]}.{digits[5:8]}/{digits[8:12]}-{digits[12:]}"
+
+
+def synthetic_pdf(lines: List[str], pages: int = 1) -> bytes:
+    """PDF minimo com texto extraivel (Helvetica, WinAnsi): o upload passa por extracao e classificacao de verdade."""
+    objs: List[bytes] = []
+
+    def add(obj: bytes) -> int:
+        objs.append(obj)
+        return len(objs)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    pages_id = add(b"")
+    kids = []
+    for _ in range(max(1, pages)):
+        shown = b" ".join(
+            b"(" + line.encode("cp1252", "replace").replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b") '"
+            for line in lines
+        )
+        body = b"BT /F1 10 Tf 40 800 Td 12 TL " + shown + b" ET"
+        content = add(b"<< /Length %d >>\nstream\n" % len(body) + body + b"\nendstream")
+        kids.append(
+            add(
+                b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 %d 0 R >> >> "
+                b"/Contents %d 0 R >>" % (pages_id, font, content)
+            )
+        )
+    objs[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, catalog, xref)
+    return bytes(out)
+
+
+def guia_lines(nome: str, cnpj: str, competencia: str, tributo: str, vencimento: str, valor: float) -> List[str]:
+    """Texto de uma guia no formato que o scanner do upload reconhece (CNPJ, periodo, tributo)."""
+    mm_aaaa = f"{competencia[4:]}/{competencia[:4]}"
+    venc = datetime.strptime(vencimento, "%Y-%m-%d").strftime("%d/%m/%Y") if vencimento else ""
+    valor_txt = f"{valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return [
+        "MINISTERIO DA FAZENDA - SECRETARIA DA RECEITA FEDERAL DO BRASIL",
+        f"Documento de Arrecadacao - {tributo}",
+        f"CNPJ {cnpj} Razao Social {nome.upper()}",
+        f"Periodo de Apuracao {mm_aaaa} Data de Vencimento {venc}",
+        f"Valor do Principal {valor_txt} Multa 0,00 Juros 0,00 Valor Total {valor_txt}",
+    ]
+
+
+def pdf_filename(competencia: str, tributo: str, nome: str) -> str:
+    # mesmo padrao de nome que o classificador por nome de arquivo espera
+    return f"{competencia[4:]}{competencia[:4]} - {tributo} - {nome}.pdf"
+
+
+def _stamp(day: date, rng: random.Random) -> str:
+    moment = datetime.combine(day, datetime.min.time()) + timedelta(seconds=rng.randrange(8 * 3600, 19 * 3600))
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _months(count: int, until: date) -> List[Tuple[int, int]]:
+    from app.main import _shift_year_month
+
+    return [_shift_year_month(until.year, until.month, -offset) for offset in range(count - 1, -1, -1)]
+
+
+def _pick_status(rng: random.Random, vencimento: str, today: date) -> str:
+    if vencimento and date.fromisoformat(vencimento) < today:
+        return _weighted(
+            rng,
+            (("CONCLUIDA", 0.55), ("ENVIADA", 0.33), ("DISPENSADA", 0.04), ("PENDENTE", 0.05), ("EM_ANDAMENTO", 0.03)),
+        )
+    return _weighted(rng, (("PENDENTE", 0.7), ("EM_ANDAMENTO", 0.2), ("CONCLUIDA", 0.1)))
+
+
+def _create_users(rng: random.Random, users: int) -> Tuple[int, List[int]]:
+    from app.repositories import UserRepository
+
+    repo = UserRepository()
+    admin_id = repo.create("admin", role="admin", is_default=True, senha=BENCH_PASSWORD)
+    repo.create("gerente", role="manager", senha=BENCH_PASSWORD)
+    collabs = [repo.create(f"colab{i:02d}", role="collab", senha=BENCH_PASSWORD) for i in range(1, max(1, users) + 1)]
+    return admin_id, collabs
+
+
+def _create_companies(rng: random.Random, count: int, admin_id: int, collabs: List[int], first_day: date) -> int:
+    from app.repositories import CompanyRepository
+
+    repo = CompanyRepository()
+    used: set = set()
+    for i in range(count):
+        nome = f"{rng.choice(_PREFIXES)} {rng.choice(_CORES)} {i + 1:04d} {rng.choice(_SUFFIXES)}"
+        slug = "".join(ch for ch in nome.lower() if ch.isalnum())[:24]
+        repo.create(
+            user_id=admin_id,
+            nome=nome,
+            cnpj=_cnpj(rng, used),
+            ie=f"{rng.randrange(10**9):09d}",
+            regime=_weighted(rng, REGIMES),
+            observacoes="",
+            data_entrada=(first_day - timedelta(days=rng.randrange(30, 3650))).isoformat(),
+            responsavel_id=rng.choice(collabs),
+            email_principal=f"fiscal@{slug}.com.br",
+            emails_extra=[f"financeiro@{slug}.com.br"] if rng.random() < 0.3 else [],
+        )
+    return count
+
+
+class _Writer:
+    """Linhas acumuladas e gravadas em lote numa transacao (o gerador insere centenas de milhares)."""
+
+    SQL = {
+        "status": "UPDATE tarefas SET status = ? WHERE id = ?",
+        "log": "INSERT INTO task_logs (task_id, user_id, action, details, created_at) VALUES (?, ?, ?, ?, ?)",
+        "comment": "INSERT INTO task_comments (task_id, author_id, text, created_at) VALUES (?, ?, ?, ?)",
+        "notification": (
+            "INSERT INTO notifications (user_id, type, ref_id, message, is_read, created_at) VALUES (?, ?, ?, ?, ?, ?)"
+        ),
+        "email": (
+            "INSERT INTO email_logs (company_id, user_id, to_emails, subject, body, link, task_id, attachment_name, created_at) "
+            "VALUES (?, ?, ?, ?, ?, NULL, ?, ?, ?)"
+        ),
+        "blob": "INSERT INTO pdf_blobs (sha256, size) VALUES (?, ?) ON CONFLICT(sha256) DO UPDATE SET size = excluded.size",
+        "pdf": "UPDATE tarefas SET pdf_path = ?, pdf_sha256 = ?, pdf_blob = NULL WHERE id = ?",
+    }
+
+    def __init__(self, conn) -> None:
+        self.conn = conn
+        self.rows: Dict[str, List[tuple]] = {k: [] for k in self.SQL}
+        self.counts: Dict[str, int] = {k: 0 for k in self.SQL}
+
+    def add(self, kind: str, row: tuple) -> None:
+        self.rows[kind].append(row)
+        if sum(len(v) for v in self.rows.values()) >= _BATCH:
+            self.flush()
+
+    def flush(self) -> None:
+        # pdf_blobs antes de tarefas: o trigger de refcount conta a referencia nova
+        for kind in self.SQL:
+            rows = self.rows[kind]
+            if rows:
+                self.conn.executemany(self.SQL[kind], rows)
+                self.counts[kind] += len(rows)
+                rows.clear()
+        self.conn.commit()
+
+
+def _history(rng: random.Random, pdf_ratio: float, comment_ratio: float, today: date) -> Dict[str, int]:
+    """Status, logs, comentarios, notificacoes, e-mails e PDFs sobre as tarefas ja sincronizadas."""
+    from app.db import _connect
+    from app.pdf_store import put_pdf
+
+    conn = _connect()
+    names = {int(r["id"]): str(r["nome"]) for r in conn.execute("SELECT id, nome FROM usuarios").fetchall()}
+    users = [int(r["id"]) for r in conn.execute("SELECT id FROM usuarios WHERE role = 'collab'").fetchall()]
+    tasks = conn.execute(
+        """
+        SELECT t.id, t.user_id, t.company_id, t.tipo, t.tributo, t.competencia, t.vencimento,
+               e.nome, e.cnpj, e.email_principal
+        FROM tarefas t
+        JOIN empresas e ON e.id = t.company_id
+        ORDER BY t.id
+        """
+    ).fetchall()
+    writer = _Writer(conn)
+    pdfs = 0
+    for task in tasks:
+        task_id = int(task["id"])
+        owner = int(task["user_id"])
+        venc = str(task["vencimento"] or "")
+        due = date.fromisoformat(venc) if venc else today
+        status = _pick_status(rng, venc, today)
+        if status != "PENDENTE":
+            writer.add("status", (status, task_id))
+            if status != "EM_ANDAMENTO" and rng.random() < 0.5:
+                writer.add("log", (task_id, owner, "status", "PENDENTE -> EM_ANDAMENTO", _stamp(due - timedelta(days=6), rng)))
+                previous = "EM_ANDAMENTO"
+            else:
+                previous = "PENDENTE"
+            done_day = min(today, due - timedelta(days=rng.randrange(0, 5)))
+            writer.add("log", (task_id, owner, "status", f"{previous} -> {status}", _stamp(done_day, rng)))
+            if status in ("CONCLUIDA", "ENVIADA") and task["tipo"] == "OBR" and rng.random() < pdf_ratio:
+                competencia = str(task["competencia"])
+                tributo = str(task["tributo"])
+                nome = str(task["nome"])
+                data = synthetic_pdf(
+                    guia_lines(nome, str(task["cnpj"]), competencia, tributo, venc, rng.uniform(80, 50000))
+                )
+                sha256, _ = put_pdf(data)
+                filename = pdf_filename(competencia, tributo, nome)
+                writer.add("blob", (sha256, len(data)))
+                writer.add("pdf", (filename, sha256, task_id))
+                writer.add("log", (task_id, owner, "upload_pdf", filename, _stamp(done_day, rng)))
+                pdfs += 1
+                if rng.random() < 0.03:
+                    issue = "Competência do PDF difere da tarefa"
+                    writer.add("log", (task_id, owner, "inconsistency", issue, _stamp(done_day, rng)))
+                    writer.add(
+                        "notification",
+                        (owner, "inconsistency", task_id, f"Inconsistência na tarefa {tributo}: {issue}", 1, _stamp(done_day, rng)),
+                    )
+                if status == "ENVIADA" and task["email_principal"]:
+                    writer.add(
+                        "email",
+                        (
+                            int(task["company_id"]),
+                            owner,
+                            str(task["email_principal"]),
+                            f"{tributo} - competencia {competencia[4:]}/{competencia[:4]}",
+                            "Segue a guia em anexo.",
+                            task_id,
+                            filename,
+                            _stamp(done_day, rng),
+                        ),
+                    )
+        if rng.random() < comment_ratio:
+            for _ in range(rng.randint(1, 3)):
+                author = rng.choice(users)
+                day = min(today, due - timedelta(days=rng.randrange(0, 10)))
+                writer.add("comment", (task_id, author, rng.choice(_COMMENTS), _stamp(day, rng)))
+                if author != owner:
+                    message = f"Novo comentário na tarefa {task['tributo']} (id {task_id})"
+                    writer.add("notification", (owner, "comment", task_id, message, int(due < today), _stamp(day, rng)))
+                    if rng.random() < 0.5:
+                        writer.add("log", (task_id, owner, "comment_ack", None, _stamp(day, rng)))
+                        message = f"{names.get(owner, '')} conferiu seu comentário na tarefa {task['tributo']} (id {task_id})"
+                        writer.add("notification", (author, "resolved", task_id, message, int(due < today), _stamp(day, rng)))
+    writer.flush()
+    conn.close()
+    counts = {k: v for k, v in writer.counts.items() if k not in ("blob", "pdf")}
+    counts["pdfs"] = pdfs
+    return counts
+
+
+def generate(
+    out: str,
+    *,
+    companies: int = 200,
+    months: int = 24,
+    users: int = 8,
+    pdf_ratio: float = 0.1,
+    comment_ratio: float = 0.05,
+    seed: int = 42,
+    data_dir: Optional[str] = None,
+    force: bool = False,
+    progress: bool = True,
+) -> Dict[str, object]:
+    db_path, data_path = configure(out, data_dir)
+    if db_path.exists():
+        if not force:
+            raise FileExistsError(f"{db_path} ja existe (use --force para recriar)")
+        for suffix in ("", "-wal", "-shm"):
+            Path(str(db_path) + suffix).unlink(missing_ok=True)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+
+    from app.db import _connect, init_db
+    from app.main import MONTHLY_SYNC_KEY, _sync_monthly_tasks_for
+    from app.maintenance import run_db_maintenance
+
+    def step(label: str) -> None:
+        if progress:
+            print(f"[{time.perf_counter() - started:7.1f}s] {label}", file=sys.stderr, flush=True)
+
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    today = date.today()
+    periods = _months(max(1, months), today)
+    init_db()
+    step("usuarios")
+    admin_id, collabs = _create_users(rng, users)
+    step(f"{companies} empresas")
+    _create_companies(rng, companies, admin_id, collabs, date(periods[0][0], periods[0][1], 1))
+    for year, month in periods:
+        step(f"tarefas {month:02d}/{year}")
+        _sync_monthly_tasks_for(year, month)
+    step("historico, comentarios e PDFs")
+    counts = _history(rng, pdf_ratio, comment_ratio, today)
+    step("estatisticas do planejador")
+    run_db_maintenance(analyze=True)
+
+    meta = {
+        "companies": companies,
+        "months": months,
+        "users": users,
+        "pdf_ratio": pdf_ratio,
+        "comment_ratio": comment_ratio,
+        "seed": seed,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    conn = _connect()
+    tasks = int(conn.execute("SELECT COUNT(*) FROM tarefas").fetchone()[0])
+    # parametros da base vao junto com o baseline; a competencia marcada evita ressincronizar no startup
+    conn.executemany(
+        """
+        INSERT INTO app_settings (key, value, updated_at) VALUES (?, ?, datetime('now'))
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        """,
+        [(DATASET_KEY, json.dumps(meta)), (MONTHLY_SYNC_KEY, f"{today.year}{today.month:02d}")],
+    )
+    conn.commit()
+    conn.close()
+    step("pronto")
+    return {
+        **meta,
+        "db": str(db_path),
+        "data_dir": str(data_path),
+        "tasks": tasks,
+        **counts,
+        "db_mb": round(db_path.stat().st_size / (1024 * 1024), 1),
+        "elapsed_s": round(time.perf_counter() - started, 1),
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m bench.dataset", description="Gera uma base sintetica para benchmark")
+    parser.add_argument("--out", required=True, help="caminho do app.db a gerar")
+    parser.add_argument("--data-dir", help="diretorio de dados (PDFs); padrao: <pasta do --out>/data")
+    parser.add_argument("--companies", type=int, default=200)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--users", type=int, default=8, help="colaboradores (alem de admin e gerente)")
+    parser.add_argument("--pdf-ratio", type=float, default=0.1, help="fracao das guias concluidas com PDF")
+    parser.add_argument("--comment-ratio", type=float, default=0.05, help="fracao das tarefas com comentarios")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--force", action="store_true", help="apaga o banco existente em --out")
+    parser.add_argument("--quiet", action="store_true")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        summary = generate(
+            args.out,
+            companies=args.companies,
+            months=args.months,
+            users=args.users,
+            pdf_ratio=args.pdf_ratio,
+            comment_ratio=args.comment_ratio,
+            seed=args.seed,
+            data_dir=args.data_dir,
+            force=args.force,
+            progress=not args.quiet,
+        )
+    except FileExistsError as exc:
+        print(str(exc), file=sys.stderr)
+        return 2
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,707 @@
+from __future__ import annotations
+
+import argparse
+import difflib
+import inspect
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+# EXPLAIN QUERY PLAN de cada SQL emitido pelos repositorios (server/app/repositories.py e
+# client/app/db/repositories.py) contra uma base sintetica populada. Falha quando:
+#   - uma consulta faz SCAN em tabela grande (WATCHED) fora de ALLOW_SCAN;
+#   - uma listagem de ORDERED ordena em B-tree temporario em vez de usar o indice;
+#   - o plano difere do snapshot em bench/plan_snapshots/<lado>.json (revise e rode com --update);
+#   - um metodo publico de repositorio nao tem chamada em _server_calls/_client_worker nem motivo em SKIP.
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+CLIENT_DIR = SERVER_DIR.parent / "client"
+SNAPSHOT_DIR = Path(__file__).resolve().parent / "plan_snapshots"
+
+WATCHED = {
+    "server": ("tarefas", "notifications", "task_logs", "task_comments", "classificacoes", "email_outbox", "email_logs"),
+    "client": ("tarefas",),
+}
+
+# metodo -> por que o SCAN e aceitavel
+ALLOW_SCAN: Dict[str, Dict[str, str]] = {
+    "server": {
+        "RollupRepository.rebuild": "reconstroi o rollup agregando a tabela inteira",
+        "RollupRepository.check": "compara o rollup com a agregacao da tabela inteira",
+        "PdfBlobRepository.stats": "contagem de linhas legadas, so na tela de manutencao",
+        "TaskRepository.iter_export": "exportacao sem filtro le a tabela inteira, na ordem do indice e em streaming",
+        "EmailOutboxRepository.list": "ultimas linhas pelo rowid (ORDER BY id DESC LIMIT), para no limite",
+        "EmailOutboxRepository.stats": "contagem por status no indice de cobertura, so na tela de manutencao",
+        "EmailLogRepository.list": "sem filtro: ultimas linhas pelo rowid (ORDER BY id DESC LIMIT), para no limite",
+    },
+    "client": {},
+}
+
+# listagens cuja ORDER BY precisa sair pronta do indice
+ORDERED = {
+    "server": {
+        "TaskRepository.list",
+        "TaskRepository.list_upcoming",
+        "TaskRepository.due_between",
+        "TaskRepository.iter_export",
+        "TaskLogRepository.list",
+        "TaskCommentRepository.list",
+        "NotificationRepository.list",
+        "ClassificationRepository.list_for_task",
+        "EmailOutboxRepository.claim",
+        "EmailLogRepository.list",
+    },
+    "client": {
+        "TaskRepository.list",
+        "TaskRepository.tasks_by_company_and_status",
+    },
+}
+
+SKIP: Dict[str, Dict[str, str]] = {
+    "server": {"ClassificationRepository.derived_values": "sem SQL"},
+    "client": {},
+}
+
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+_RX_TEMP_ORDER = re.compile(r"USE TEMP B-TREE FOR (?:RIGHT PART OF |LAST TERM OF )?ORDER BY")
+_RX_STRING = re.compile(r"'(?:[^']|'')*'")
+
+Plans = Dict[str, List[Dict[str, object]]]
+
+
+def _render(rows: List[Tuple[int, int, int, str]]) -> List[str]:
+    # arvore do EXPLAIN QUERY PLAN: cada nivel abaixo do pai ganha dois espacos
+    depth: Dict[int, int] = {}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth[parent] + 1 if parent in depth else 0
+        lines.append("  " * depth[node] + str(detail))
+    return lines
+
+
+def _explain(conn: sqlite3.Connection, sql: str, params: object) -> List[str]:
+    if params is None:
+        # executemany: o plano nao depende dos valores, so do numero de parametros
+        params = (None,) * _RX_STRING.sub("", sql).count("?")
+    # cursor base do sqlite3: o EXPLAIN nao passa pelos observadores de app.db
+    cur = conn.cursor(sqlite3.Cursor)
+    try:
+        return _render(cur.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall())
+    except sqlite3.Error as exc:
+        return [f"(sem plano: {exc})"]
+    finally:
+        cur.close()
+
+
+def _add(plans: Plans, label: str, sql: str, plan: List[str]) -> None:
+    entries = plans.setdefault(label, [])
+    if not any(e["sql"] == sql for e in entries):
+        entries.append({"sql": sql, "plan": plan})
+
+
+def _public_methods(module: object) -> List[str]:
+    names = []
+    for cls_name, cls in sorted(vars(module).items()):
+        if cls_name.endswith("Repository") and isinstance(cls, type) and cls.__module__ == getattr(module, "__name__", ""):
+            for name, attr in vars(cls).items():
+                if not name.startswith("_") and (inspect.isfunction(attr) or isinstance(attr, staticmethod)):
+                    names.append(f"{cls_name}.{name}")
+    return names
+
+
+def _uncovered(module: object, labels: List[str], skip: Dict[str, str]) -> List[str]:
+    covered = {label.split(" [")[0] for label in labels}
+    return [m for m in _public_methods(module) if m not in covered and m not in skip]
+
+
+# --- servidor -------------------------------------------------------------------------------------
+
+
+# ano fixo no passado: o schema anexado (arc_<ano>) aparece no SQL do snapshot
+ARCHIVE_YEAR = 2000
+
+
+def _seed_archive(conn: sqlite3.Connection, ids: "_ServerIds") -> None:
+    """Copia as tarefas da primeira competencia para ARCHIVE_YEAR e arquiva o ano."""
+    from app.archive import archive_year
+
+    conn.execute(
+        "INSERT INTO tarefas (user_id, company_id, titulo, tipo, orgao, tributo, competencia, vencimento, status) "
+        "SELECT user_id, company_id, titulo, tipo, orgao, tributo, ?, vencimento, status FROM tarefas WHERE competencia = ?",
+        (ids.archived_competencia, ids.first_competencia),
+    )
+    conn.commit()
+    archive_year(ARCHIVE_YEAR, force=True)
+
+
+class _ServerIds:
+    """Ids reais da base sintetica usados nas chamadas."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        def one(sql: str) -> object:
+            row = conn.execute(sql).fetchone()
+            if row is None:
+                raise ValueError(f"base sintetica sem dados para: {sql}")
+            return row[0]
+
+        self.admin = int(one("SELECT id FROM usuarios WHERE role = 'admin' ORDER BY id LIMIT 1"))
+        self.admin_nome = str(one(f"SELECT nome FROM usuarios WHERE id = {self.admin}"))
+        self.collab = int(one("SELECT user_id FROM tarefas t JOIN usuarios u ON u.id = t.user_id WHERE u.role = 'collab' LIMIT 1"))
+        self.task = int(one("SELECT task_id FROM task_comments ORDER BY id LIMIT 1"))
+        self.company = int(one(f"SELECT company_id FROM tarefas WHERE id = {self.task}"))
+        self.cnpj = str(one(f"SELECT cnpj FROM empresas WHERE id = {self.company}"))
+        self.word = str(one(f"SELECT nome FROM empresas WHERE id = {self.company}")).split()[0]
+        self.competencia = str(one("SELECT MAX(competencia) FROM tarefas"))
+        self.first_competencia = str(one("SELECT MIN(competencia) FROM tarefas"))
+        self.comment = int(one("SELECT id FROM task_comments ORDER BY id LIMIT 1"))
+        self.notified = int(one("SELECT user_id FROM notifications GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1"))
+        self.notification = int(one(f"SELECT id FROM notifications WHERE user_id = {self.notified} ORDER BY id LIMIT 1"))
+        self.sha256 = str(one("SELECT sha256 FROM pdf_blobs ORDER BY sha256 LIMIT 1"))
+        # competencia movida para o arquivo de ARCHIVE_YEAR (_seed_archive)
+        self.archived_competencia = f"{ARCHIVE_YEAR}{self.first_competencia[4:]}"
+        # preenchidos pelas chamadas de escrita
+        self.new_user = 0
+        self.new_company = 0
+        self.new_task = 0
+        self.new_classification = 0
+        self.outbox: List[int] = []
+
+
+def _server_calls(r: object) -> List[Tuple[str, Callable[[_ServerIds], object]]]:
+    from . import BENCH_PASSWORD
+
+    status_open = ["PENDENTE", "EM_ANDAMENTO"]
+    calls: List[Tuple[str, Callable[[_ServerIds], object]]] = [
+        # leitura
+        ("UserRepository.list", lambda i: r.UserRepository().list()),
+        ("UserRepository.get", lambda i: r.UserRepository().get(i.admin)),
+        ("UserRepository.get_by_nome", lambda i: r.UserRepository().get_by_nome(i.admin_nome)),
+        ("UserRepository.count", lambda i: r.UserRepository().count()),
+        ("UserRepository.verify_login", lambda i: r.UserRepository().verify_login(i.admin_nome, BENCH_PASSWORD)),
+        ("CompanyRepository.list", lambda i: r.CompanyRepository().list(None)),
+        ("CompanyRepository.list [colaborador]", lambda i: r.CompanyRepository().list(i.collab)),
+        ("CompanyRepository.list [responsavel]", lambda i: r.CompanyRepository().list(None, responsavel_id=i.collab)),
+        ("CompanyRepository.list [competencia]", lambda i: r.CompanyRepository().list(None, competencia=i.competencia)),
+        ("CompanyRepository.list [busca]", lambda i: r.CompanyRepository().list(None, query=i.word)),
+        ("CompanyRepository.get", lambda i: r.CompanyRepository().get(i.company)),
+        ("CompanyRepository.get_by_cnpj", lambda i: r.CompanyRepository().get_by_cnpj(i.cnpj)),
+        ("TaskRepository.list [competencia]", lambda i: r.TaskRepository().list(user_id=None, competencia=i.competencia)),
+        ("TaskRepository.list [empresa]", lambda i: r.TaskRepository().list(user_id=None, company_id=i.company)),
+        (
+            "TaskRepository.list [status]",
+            lambda i: r.TaskRepository().list(user_id=None, status=status_open, competencia=i.competencia),
+        ),
+        (
+            "TaskRepository.list [colaborador]",
+            lambda i: r.TaskRepository().list(user_id=i.collab, competencia=i.competencia),
+        ),
+        ("TaskRepository.list_upcoming", lambda i: r.TaskRepository().list_upcoming(user_id=None, days=30)),
+        ("TaskRepository.list_upcoming [colaborador]", lambda i: r.TaskRepository().list_upcoming(user_id=i.collab, days=30)),
+        ("TaskRepository.iter_export", lambda i: list(r.TaskRepository().iter_export(user_id=None))),
+        (
+            "TaskRepository.iter_export [competencia]",
+            lambda i: list(r.TaskRepository().iter_export(user_id=None, competencia=i.competencia)),
+        ),
+        (
+            "TaskRepository.iter_export [empresa]",
+            lambda i: list(r.TaskRepository().iter_export(user_id=None, company_id=i.company)),
+        ),
+        (
+            "TaskRepository.iter_export [arquivo]",
+            lambda i: list(r.TaskRepository().iter_export(user_id=None, competencia=i.archived_competencia)),
+        ),
+        (
+            "TaskRepository.iter_export [colaborador]",
+            lambda i: list(r.TaskRepository().iter_export(user_id=i.collab, status=["PENDENTE", "EM_ANDAMENTO"])),
+        ),
+        ("TaskRepository.due_between", lambda i: r.TaskRepository().due_between("2000-01-01", "2100-01-01")),
+        ("TaskRepository.get", lambda i: r.TaskRepository().get(i.task, None)),
+        ("TaskRepository.get [colaborador]", lambda i: r.TaskRepository().get(i.task, i.collab)),
+        ("TaskRepository.get_pdf", lambda i: r.TaskRepository().get_pdf(i.task, None)),
+        ("TaskRepository.get_pdf [colaborador]", lambda i: r.TaskRepository().get_pdf(i.task, i.collab)),
+        ("TaskRepository.find_similar", lambda i: r.TaskRepository().find_similar(company_id=i.company, text="DAS Simples")),
+        ("SearchRepository.search", lambda i: r.SearchRepository().search(i.word)),
+        ("SearchRepository.search [colaborador]", lambda i: r.SearchRepository().search(i.word, user_id=i.collab)),
+        ("ReportRepository.summary", lambda i: r.ReportRepository().summary(user_id=None)),
+        (
+            "ReportRepository.summary [periodo]",
+            lambda i: r.ReportRepository().summary(
+                user_id=None, group_by=["status", "tipo"], competencia_from=i.first_competencia, competencia_to=i.competencia
+            ),
+        ),
+        ("ReportRepository.summary [empresa]", lambda i: r.ReportRepository().summary(user_id=None, company_id=i.company)),
+        ("ReportRepository.summary [colaborador]", lambda i: r.ReportRepository().summary(user_id=i.collab)),
+        (
+            "ReportRepository.summary [responsavel]",
+            lambda i: r.ReportRepository().summary(user_id=None, group_by=["responsavel_id", "status"]),
+        ),
+        ("RollupRepository.check", lambda i: r.RollupRepository().check()),
+        ("PdfBlobRepository.legacy_ids", lambda i: r.PdfBlobRepository().legacy_ids(0, 100)),
+        ("PdfBlobRepository.legacy_blob", lambda i: r.PdfBlobRepository().legacy_blob(i.task)),
+        ("PdfBlobRepository.unreferenced", lambda i: r.PdfBlobRepository().unreferenced("9999-12-31")),
+        ("PdfBlobRepository.known", lambda i: r.PdfBlobRepository().known([i.sha256])),
+        ("PdfBlobRepository.stats", lambda i: r.PdfBlobRepository().stats()),
+        ("TaskLogRepository.list", lambda i: r.TaskLogRepository().list(task_id=i.task)),
+        ("TaskCommentRepository.list", lambda i: r.TaskCommentRepository().list(task_id=i.task)),
+        ("TaskCommentRepository.get", lambda i: r.TaskCommentRepository().get(i.comment)),
+        ("NotificationRepository.list", lambda i: r.NotificationRepository().list(user_id=i.notified)),
+        (
+            "NotificationRepository.list [nao lidas]",
+            lambda i: r.NotificationRepository().list(user_id=i.notified, unread_only=True),
+        ),
+        ("NotificationRepository.find_similar", lambda i: r.NotificationRepository().find_similar(company_id=i.company, text="DAS")),
+        ("ClassificationRepository.list_for_task", lambda i: r.ClassificationRepository().list_for_task(i.task)),
+        ("ClassificationRepository.fetch_after", lambda i: r.ClassificationRepository().fetch_after(0, 100)),
+        (
+            "ClassificationRepository.fetch_after [status]",
+            lambda i: r.ClassificationRepository().fetch_after(0, 100, ["SUGERIDA", "REVISAR"]),
+        ),
+        ("ClassificationRepository.stored_pdfs", lambda i: r.ClassificationRepository().stored_pdfs([(i.task, "guia.pdf")])),
+        ("ClassificationRepository.get_reclassify_state", lambda i: r.ClassificationRepository().get_reclassify_state()),
+        ("ClassifierPatternRepository.list", lambda i: r.ClassifierPatternRepository().list()),
+        ("JobRunRepository.list", lambda i: r.JobRunRepository().list()),
+        ("LoginAttemptRepository.count", lambda i: r.LoginAttemptRepository().count("plano", time.time(), 900)),
+        ("SettingsRepository.get_server", lambda i: r.SettingsRepository().get_server()),
+        ("SettingsRepository.get_email", lambda i: r.SettingsRepository().get_email()),
+        ("SettingsRepository.get_value", lambda i: r.SettingsRepository().get_value("plano")),
+        ("SettingsRepository.get_backup_status", lambda i: r.SettingsRepository().get_backup_status()),
+        ("EmailOutboxRepository.get", lambda i: r.EmailOutboxRepository().get(1)),
+        ("EmailOutboxRepository.get_by_dedupe_key", lambda i: r.EmailOutboxRepository().get_by_dedupe_key("plano")),
+        ("EmailOutboxRepository.guide_rows", lambda i: r.EmailOutboxRepository().guide_rows(i.competencia)),
+        (
+            "EmailOutboxRepository.guide_rows [empresa]",
+            lambda i: r.EmailOutboxRepository().guide_rows(i.competencia, i.company),
+        ),
+        ("EmailOutboxRepository.list", lambda i: r.EmailOutboxRepository().list()),
+        ("EmailOutboxRepository.list [status]", lambda i: r.EmailOutboxRepository().list(status="failed")),
+        ("EmailOutboxRepository.stats", lambda i: r.EmailOutboxRepository().stats()),
+        ("EmailLogRepository.list", lambda i: r.EmailLogRepository().list()),
+        ("EmailLogRepository.list [empresa]", lambda i: r.EmailLogRepository().list(company_id=i.company)),
+        ("EmailLogRepository.list [tarefa]", lambda i: r.EmailLogRepository().list(task_id=i.task)),
+        # escrita (depois das leituras, para nao mexer nos dados que elas usam)
+        ("UserRepository.create", lambda i: setattr(i, "new_user", r.UserRepository().create("plano", senha="plano-1234"))),
+        ("UserRepository.set_default", lambda i: r.UserRepository().set_default(i.admin)),
+        ("UserRepository.update_role", lambda i: r.UserRepository().update_role(i.new_user, "manager")),
+        ("UserRepository.update_email", lambda i: r.UserRepository().update_email(i.new_user, "plano@example.com")),
+        ("UserRepository.migrate_plaintext_passwords", lambda i: r.UserRepository().migrate_plaintext_passwords()),
+        (
+            "CompanyRepository.create",
+            lambda i: setattr(i, "new_company", r.CompanyRepository().create(user_id=i.admin, nome="Empresa Plano")),
+        ),
+        ("CompanyRepository.update", lambda i: r.CompanyRepository().update(user_id=None, company_id=i.new_company, nome="Empresa Plano")),
+        (
+            "CompanyRepository.update [colaborador]",
+            lambda i: r.CompanyRepository().update(user_id=i.admin, company_id=i.new_company, nome="Empresa Plano"),
+        ),
+        ("CompanyRepository.update_responsavel", lambda i: r.CompanyRepository().update_responsavel(i.new_company, i.collab)),
+        (
+            "TaskRepository.create",
+            lambda i: setattr(
+                i,
+                "new_task",
+                r.TaskRepository().create(
+                    user_id=i.collab, company_id=i.new_company, titulo="Plano", tipo="OBR", orgao="FED",
+                    competencia=i.competencia, status="PENDENTE",
+                ),
+            ),
+        ),
+        ("TaskRepository.update_status", lambda i: r.TaskRepository().update_status(i.new_task, None, "EM_ANDAMENTO")),
+        ("TaskRepository.update_status [colaborador]", lambda i: r.TaskRepository().update_status(i.new_task, i.collab, "PENDENTE")),
+        (
+            "TaskRepository.update",
+            lambda i: r.TaskRepository().update(
+                task_id=i.new_task, user_id=None, titulo="Plano", tipo="OBR", orgao="FED", status="PENDENTE"
+            ),
+        ),
+        (
+            "TaskRepository.update [colaborador]",
+            lambda i: r.TaskRepository().update(
+                task_id=i.new_task, user_id=i.collab, titulo="Plano", tipo="OBR", orgao="FED", status="PENDENTE"
+            ),
+        ),
+        ("TaskRepository.update_pdf", lambda i: r.TaskRepository().update_pdf(i.new_task, None, "plano.pdf", i.sha256, 1)),
+        (
+            "TaskRepository.update_pdf [colaborador]",
+            lambda i: r.TaskRepository().update_pdf(i.new_task, i.collab, "plano.pdf", i.sha256, 1),
+        ),
+        ("PdfBlobRepository.move_legacy", lambda i: r.PdfBlobRepository().move_legacy([(i.new_task, i.sha256, 1)])),
+        ("PdfBlobRepository.drop_unreferenced", lambda i: r.PdfBlobRepository().drop_unreferenced("0" * 64)),
+        (
+            "TaskLogRepository.create",
+            lambda i: r.TaskLogRepository().create(task_id=i.new_task, user_id=i.admin, action="PLANO"),
+        ),
+        (
+            "TaskCommentRepository.create",
+            lambda i: r.TaskCommentRepository().create(task_id=i.new_task, author_id=i.admin, text="plano"),
+        ),
+        (
+            "NotificationRepository.create",
+            lambda i: r.NotificationRepository().create(user_id=i.collab, type="plano", ref_id=i.new_task, message="plano"),
+        ),
+        ("NotificationRepository.mark_read", lambda i: r.NotificationRepository().mark_read(i.notification, i.notified)),
+        (
+            "ClassificationRepository.create",
+            lambda i: setattr(
+                i,
+                "new_classification",
+                r.ClassificationRepository().create(
+                    task_id=i.new_task, user_id=i.admin, filename="plano.pdf", competencia=i.competencia, empresa="Empresa Plano",
+                    grupo=None, subgrupo=None, orgao=None, tributo=None, subtipo=None, acao=None, confianca=0.0,
+                    status="REVISAR", raw_text="",
+                ),
+            ),
+        ),
+        (
+            "ClassificationRepository.apply_reclassification",
+            lambda i: r.ClassificationRepository().apply_reclassification(
+                [(*r.ClassificationRepository.derived_values({}), "REVISAR", i.new_classification)], {"after_id": 0}
+            ),
+        ),
+        (
+            "ClassifierPatternRepository.replace",
+            lambda i: r.ClassifierPatternRepository().replace(r.ClassifierPatternRepository().list()["patterns"]),
+        ),
+        ("JobRunRepository.claim", lambda i: r.JobRunRepository().claim("plano", "plano", interval_s=0, lease_s=60)),
+        (
+            "JobRunRepository.finish",
+            lambda i: r.JobRunRepository().finish("plano", "plano", status="ok", elapsed_s=0.0, result={}),
+        ),
+        ("LoginAttemptRepository.register_failure", lambda i: r.LoginAttemptRepository().register_failure("plano", time.time(), 900)),
+        ("LoginAttemptRepository.clear", lambda i: r.LoginAttemptRepository().clear("plano")),
+        ("SettingsRepository.set_server", lambda i: r.SettingsRepository().set_server({})),
+        ("SettingsRepository.set_email", lambda i: r.SettingsRepository().set_email({})),
+        ("SettingsRepository.set_backup_status", lambda i: r.SettingsRepository().set_backup_status({})),
+        (
+            "SettingsRepository.claim_backup",
+            lambda i: r.SettingsRepository().claim_backup("2000-01-01T00:00:00", "1999-12-31T18:00:00"),
+        ),
+        (
+            "EmailOutboxRepository.enqueue_many",
+            lambda i: r.EmailOutboxRepository().enqueue_many(
+                [
+                    {"company_id": i.company, "user_id": i.admin, "task_id": i.task, "to_emails": ["plano@example.com"], "dedupe_key": f"plano:{n}"}
+                    for n in range(2)
+                ]
+            ),
+        ),
+        (
+            "EmailOutboxRepository.claim",
+            lambda i: setattr(i, "outbox", [int(e["id"]) for e in r.EmailOutboxRepository().claim("plano", 2, 60)]),
+        ),
+        ("EmailOutboxRepository.mark_sent", lambda i: r.EmailOutboxRepository().mark_sent(i.outbox[0], "plano")),
+        ("EmailOutboxRepository.mark_failed", lambda i: r.EmailOutboxRepository().mark_failed(i.outbox[1], "plano", "plano")),
+        ("EmailOutboxRepository.requeue", lambda i: r.EmailOutboxRepository().requeue(i.outbox[1])),
+        ("EmailOutboxRepository.release", lambda i: r.EmailOutboxRepository().release(i.outbox[1:], "plano")),
+        (
+            "EmailOutboxRepository.mark_failed [retry]",
+            lambda i: r.EmailOutboxRepository().mark_failed(i.outbox[1], "plano", "plano", retry_in=60),
+        ),
+        ("RollupRepository.rebuild", lambda i: r.RollupRepository().rebuild()),
+    ]
+    return calls
+
+
+def collect_server(workdir: Path) -> Tuple[Plans, List[str]]:
+    # so interessa o plano: nada de log de consulta lenta durante a geracao
+    os.environ.setdefault("FISCAL_SLOW_QUERY_MS", "600000")
+    from .dataset import generate
+
+    generate(
+        str(workdir / "app.db"),
+        companies=40,
+        months=6,
+        users=4,
+        pdf_ratio=0.2,
+        comment_ratio=0.1,
+        seed=7,
+        data_dir=str(workdir / "data"),
+        force=True,
+        progress=False,
+    )
+    from app import repositories
+    from app.db import _connect, add_query_observer
+    from app.slow_queries import normalize_sql
+
+    plans: Plans = {}
+    current: List[str] = []
+
+    def observe(sql: str, params: object, elapsed: float, rows: int, conn: sqlite3.Connection) -> None:
+        if not current or not sql.lstrip()[:10].upper().startswith(_EXPLAINABLE):
+            return
+        _add(plans, current[0], normalize_sql(sql), _explain(conn, sql, params))
+
+    conn = _connect()
+    try:
+        ids = _ServerIds(conn)
+        _seed_archive(conn, ids)
+    finally:
+        conn.close()
+    add_query_observer(observe)
+    calls = _server_calls(repositories)
+    for label, call in calls:
+        current[:] = [label]
+        try:
+            call(ids)
+        finally:
+            current.clear()
+        if label not in plans:
+            plans[label] = []
+    return plans, _uncovered(repositories, [label for label, _ in calls], SKIP["server"])
+
+
+# --- cliente (processo separado: "app" ali e o pacote do client/) ----------------------------------
+
+
+def _client_seed(db_path: str) -> Dict[str, object]:
+    conn = sqlite3.connect(db_path)
+    users = [int(conn.execute("SELECT id FROM usuarios ORDER BY id LIMIT 1").fetchone()[0])]
+    for n in range(1, 4):
+        users.append(int(conn.execute("INSERT INTO usuarios (nome) VALUES (?)", (f"usuario{n:02d}",)).lastrowid))
+    titles = (
+        ("DAS", "OBR", "FED", "SIMPLES"),
+        ("ISS TOMADOS", "OBR", "MUN", "ISS"),
+        ("ICMS", "OBR", "EST", "ICMS"),
+        ("EFD REINF", "ACS", "FED", "SPED"),
+        ("DCTFWEB", "ACS", "FED", "INSS"),
+    )
+    statuses = ("CONCLUIDA", "CONCLUIDA", "ENVIADA", "EM_ANDAMENTO", "PENDENTE")
+    tasks = []
+    for user_id in users:
+        for c in range(30):
+            company_id = int(
+                conn.execute(
+                    "INSERT INTO empresas (user_id, nome, cnpj, ie, regime) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, f"EMPRESA {user_id:02d}{c:03d} LTDA", f"{user_id:02d}.{c:03d}.000/0001-00", "ISENTO", "Simples Nacional"),
+                ).lastrowid
+            )
+            for month in range(12):
+                competencia = f"{2025 + (month + 6) // 12}{(month + 6) % 12 + 1:02d}"
+                for t, (titulo, tipo, orgao, tributo) in enumerate(titles):
+                    tasks.append(
+                        (user_id, company_id, titulo, tipo, orgao, tributo, competencia, statuses[(c + month + t) % len(statuses)])
+                    )
+    conn.executemany(
+        "INSERT INTO tarefas (user_id, company_id, titulo, tipo, orgao, tributo, competencia, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        tasks,
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    row = conn.execute("SELECT company_id, competencia FROM tarefas WHERE user_id = ? ORDER BY id DESC LIMIT 1", (users[-1],)).fetchone()
+    conn.close()
+    return {"user": users[-1], "company": int(row[0]), "competencia": str(row[1])}
+
+
+def _client_worker() -> int:
+    workdir = Path(tempfile.mkdtemp(prefix="plans-client-"))
+    db_path = str(workdir / "app.db")
+    os.environ["NOTION_LIKE_DB_PATH"] = db_path
+    os.environ["XDG_DATA_HOME"] = str(workdir)
+    from app.db import repositories
+    from app.db.sqlite import init_db
+
+    init_db()
+    ids = _client_seed(db_path)
+    uid, cid, comp = int(ids["user"]), int(ids["company"]), str(ids["competencia"])
+    Tasks, Companies, Users = repositories.TaskRepository, repositories.CompanyRepository, repositories.UserRepository
+    new: Dict[str, int] = {}
+    calls: List[Tuple[str, Callable[[], object]]] = [
+        ("UserRepository.list", lambda: Users().list()),
+        ("UserRepository.get", lambda: Users().get(uid)),
+        ("CompanyRepository.list", lambda: Companies(uid).list()),
+        ("CompanyRepository.list [busca]", lambda: Companies(uid).list(query="empresa")),
+        ("CompanyRepository.list [regime]", lambda: Companies(uid).list(regime="Simples Nacional")),
+        ("CompanyRepository.get", lambda: Companies(uid).get(cid)),
+        ("TaskRepository.list_competencias", lambda: Tasks(uid).list_competencias(cid, "OBR")),
+        ("TaskRepository.list", lambda: Tasks(uid).list(company_id=cid, tipo="OBR")),
+        ("TaskRepository.list [competencia]", lambda: Tasks(uid).list(company_id=cid, tipo="OBR", competencia=comp)),
+        ("TaskRepository.list [status]", lambda: Tasks(uid).list(company_id=cid, tipo="OBR", status=["PENDENTE", "EM_ANDAMENTO"])),
+        ("TaskRepository.get", lambda: Tasks(uid).get(1)),
+        ("TaskRepository.count_by_status", lambda: Tasks(uid).count_by_status()),
+        ("TaskRepository.count_by_status [empresa]", lambda: Tasks(uid).count_by_status(company_id=cid)),
+        ("TaskRepository.companies_with_status", lambda: Tasks(uid).companies_with_status("PENDENTE")),
+        ("TaskRepository.tasks_by_company_and_status", lambda: Tasks(uid).tasks_by_company_and_status(cid, "PENDENTE")),
+        ("UserRepository.create", lambda: Users().create("plano")),
+        ("CompanyRepository.create", lambda: new.update(company=Companies(uid).create(nome="EMPRESA PLANO"))),
+        ("CompanyRepository.update", lambda: Companies(uid).update(new["company"], cnpj="", ie="", regime="Lucro Real")),
+        (
+            "TaskRepository.create",
+            lambda: new.update(task=Tasks(uid).create(company_id=new["company"], titulo="Plano", tipo="OBR", orgao="FED", competencia=comp)),
+        ),
+        ("TaskRepository.update_status", lambda: Tasks(uid).update_status(new["task"], "CONCLUIDA")),
+        (
+            "TaskRepository.update",
+            lambda: Tasks(uid).update(new["task"], company_id=new["company"], titulo="Plano", tipo="OBR", orgao="FED"),
+        ),
+        ("TaskRepository.update_pdf_path", lambda: Tasks(uid).update_pdf_path(new["task"], "plano.pdf")),
+        ("TaskRepository.update_pdf_blob", lambda: Tasks(uid).update_pdf_blob(new["task"], b"%PDF")),
+    ]
+
+    # o cliente nao tem observadores: o trace do sqlite3 entrega o SQL com os valores ja expandidos
+    traced: List[Tuple[str, str]] = []
+    current: List[str] = []
+    connect = repositories._connect
+
+    def traced_connect() -> sqlite3.Connection:
+        conn = connect()
+        conn.set_trace_callback(lambda sql: current and traced.append((current[0], sql)))
+        return conn
+
+    repositories._connect = traced_connect  # type: ignore[assignment]
+    for label, call in calls:
+        current[:] = [label]
+        try:
+            call()
+        finally:
+            current.clear()
+
+    plans: Plans = {label: [] for label, _ in calls}
+    conn = sqlite3.connect(db_path)
+    for label, sql in traced:
+        # consultas internas do FTS5 ('main'.'empresas_fts_config' etc.) tambem passam pelo trace
+        if sql.lstrip()[:10].upper().startswith(_EXPLAINABLE) and "'main'." not in sql:
+            plans[label].append({"sql": sql, "plan": _explain(conn, sql, ())})
+    conn.close()
+    uncovered = _uncovered(repositories, [label for label, _ in calls], SKIP["client"])
+    json.dump({"plans": plans, "uncovered": uncovered}, sys.stdout)
+    return 0
+
+
+def collect_client() -> Optional[Tuple[Plans, List[str]]]:
+    if not (CLIENT_DIR / "app" / "db" / "repositories.py").exists():
+        return None
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(SERVER_DIR), env.get("PYTHONPATH")]))
+    proc = subprocess.run(
+        [sys.executable, "-m", "bench.plans", "--client-worker"],
+        cwd=CLIENT_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"coleta do cliente falhou:\n{proc.stderr.strip()}")
+    from app.slow_queries import normalize_sql
+
+    raw = json.loads(proc.stdout)
+    plans: Plans = {}
+    for label, entries in raw["plans"].items():
+        plans[label] = []
+        for entry in entries:
+            _add(plans, label, normalize_sql(str(entry["sql"])), list(entry["plan"]))
+    return plans, list(raw["uncovered"])
+
+
+# --- regras e snapshot ----------------------------------------------------------------------------
+
+
+def check_rules(side: str, plans: Plans) -> List[str]:
+    from app.slow_queries import scanned_tables
+
+    problems = []
+    for label, entries in plans.items():
+        method = label.split(" [")[0]
+        for entry in entries:
+            sql, plan = str(entry["sql"]), [str(line).strip() for line in entry["plan"]]  # type: ignore[union-attr]
+            if any(line.startswith("(sem plano") for line in plan):
+                problems.append(f"{label}: {plan[0]}\n    {sql}")
+            scans = sorted({t for t in scanned_tables(sql, plan) if t in WATCHED[side]})
+            if scans and method not in ALLOW_SCAN[side]:
+                problems.append(f"{label}: SCAN {', '.join(scans)}\n    {sql}")
+            if method in ORDERED[side] and any(_RX_TEMP_ORDER.search(line) for line in plan):
+                problems.append(f"{label}: ORDER BY em B-tree temporario\n    {sql}")
+    return problems
+
+
+def snapshot_path(side: str) -> Path:
+    return SNAPSHOT_DIR / f"{side}.json"
+
+
+def _dump(plans: Plans) -> str:
+    return json.dumps(plans, ensure_ascii=False, indent=2, sort_keys=True) + "\n"
+
+
+def compare_snapshot(side: str, plans: Plans) -> List[str]:
+    path = snapshot_path(side)
+    if not path.exists():
+        return [f"{path} nao existe: gere com python -m bench.plans --update"]
+    saved: Plans = json.loads(path.read_text(encoding="utf-8"))
+    diffs = []
+    for label in sorted(set(saved) | set(plans)):
+        before = _dump({label: saved[label]}).splitlines() if label in saved else []
+        after = _dump({label: plans[label]}).splitlines() if label in plans else []
+        if before != after:
+            diff = difflib.unified_diff(before, after, "snapshot", "atual", lineterm="", n=1)
+            diffs.append(f"{label}: plano mudou\n" + "\n".join(f"    {line}" for line in diff))
+    return diffs
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.plans",
+        description="Confere o EXPLAIN QUERY PLAN dos repositorios contra regras e snapshots.",
+    )
+    parser.add_argument("--update", action="store_true", help="regrava bench/plan_snapshots/*.json com os planos atuais")
+    parser.add_argument("--side", choices=("server", "client"), action="append", help="lado a conferir (padrao: ambos)")
+    parser.add_argument("--keep", action="store_true", help="mantem a base sintetica do servidor no diretorio temporario")
+    parser.add_argument("--client-worker", action="store_true", help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.client_worker:
+        return _client_worker()
+    sides = args.side or ["server", "client"]
+    workdir = Path(tempfile.mkdtemp(prefix="plans-"))
+    failures: List[str] = []
+    collected: Dict[str, Tuple[Plans, List[str]]] = {}
+    try:
+        # o servidor primeiro: configura app.* (FISCAL_DB_PATH) antes de qualquer import
+        collected["server"] = collect_server(workdir)
+        if "client" in sides:
+            client = collect_client()
+            if client is None:
+                print(f"aviso: {CLIENT_DIR} nao encontrado, cliente ignorado", file=sys.stderr)
+            else:
+                collected["client"] = client
+    finally:
+        if args.keep:
+            print(f"base sintetica mantida em {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for side in sides:
+        if side not in collected:
+            continue
+        plans, uncovered = collected[side]
+        failures += [f"[{side}] sem chamada no harness: {m}" for m in uncovered]
+        failures += [f"[{side}] {p}" for p in check_rules(side, plans)]
+        statements = sum(len(e) for e in plans.values())
+        if args.update:
+            path = snapshot_path(side)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(_dump(plans), encoding="utf-8")
+            print(f"[{side}] {len(plans)} chamadas, {statements} consultas: snapshot gravado em {path}")
+        else:
+            failures += [f"[{side}] {d}" for d in compare_snapshot(side, plans)]
+            print(f"[{side}] {len(plans)} chamadas, {statements} consultas conferidas")
+
+    for failure in failures:
+        print(failure)
+    if failures:
+        print(f"{len(failures)} problema(s) nos planos de consulta", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
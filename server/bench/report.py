@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import json
+import math
+import platform
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Percentis por endpoint, baseline em JSON e comparacao entre duas execucoes.
+
+PERCENTILES = (50, 95, 99)
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank: o valor observado abaixo do qual ficam pct% das amostras."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(
+    samples: Dict[str, List[float]], errors: Dict[str, Dict[str, int]], wall_s: float
+) -> Dict[str, Dict[str, object]]:
+    out: Dict[str, Dict[str, object]] = {}
+    for name in sorted(set(samples) | set(errors)):
+        values = sorted(samples.get(name, []))
+        entry: Dict[str, object] = {
+            "count": len(values),
+            "errors": sum(errors.get(name, {}).values()),
+            "error_status": errors.get(name, {}),
+            "mean_ms": round(sum(values) / len(values), 2) if values else 0.0,
+            "max_ms": round(values[-1], 2) if values else 0.0,
+            "rps": round(len(values) / wall_s, 2) if wall_s > 0 else 0.0,
+        }
+        for pct in PERCENTILES:
+            entry[f"p{pct}_ms"] = round(percentile(values, pct), 2)
+        out[name] = entry
+    return out
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        rev = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return rev.stdout.strip() or None
+
+
+def build_result(endpoints: Dict[str, Dict[str, object]], meta: Dict[str, object]) -> Dict[str, object]:
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()}",
+            **meta,
+        },
+        "endpoints": endpoints,
+    }
+
+
+def baseline_path(name_or_path: str) -> Path:
+    # nome simples vai para bench/baselines/<nome>.json
+    path = Path(name_or_path)
+    if path.suffix != ".json" and path.parent == Path("."):
+        return BASELINE_DIR / f"{name_or_path}.json"
+    return path
+
+
+def save(result: Dict[str, object], name_or_path: str) -> Path:
+    path = baseline_path(name_or_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(result, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    return path
+
+
+def load(name_or_path: str) -> Dict[str, object]:
+    return json.loads(baseline_path(name_or_path).read_text(encoding="utf-8"))
+
+
+def compare(
+    current: Dict[str, object],
+    baseline: Dict[str, object],
+    *,
+    metric: str = "p95_ms",
+    threshold_pct: float = 10.0,
+    min_delta_ms: float = 1.0,
+) -> Tuple[List[Dict[str, object]], List[str]]:
+    """(linhas por endpoint, avisos). Regressao: piora acima de threshold_pct e de min_delta_ms ao mesmo tempo."""
+    warnings = []
+    cur_meta = current.get("meta", {})
+    base_meta = baseline.get("meta", {})
+    for key in ("dataset", "mode", "clients"):
+        if cur_meta.get(key) != base_meta.get(key):  # type: ignore[union-attr]
+            warnings.append(f"{key} difere do baseline: {base_meta.get(key)} -> {cur_meta.get(key)}")  # type: ignore[union-attr]
+    rows = []
+    cur_eps: Dict[str, Dict[str, object]] = current.get("endpoints", {})  # type: ignore[assignment]
+    base_eps: Dict[str, Dict[str, object]] = baseline.get("endpoints", {})  # type: ignore[assignment]
+    for name in sorted(set(cur_eps) | set(base_eps)):
+        now = cur_eps.get(name)
+        before = base_eps.get(name)
+        if now is None or before is None:
+            rows.append({"endpoint": name, "status": "novo" if before is None else "ausente"})
+            continue
+        new_v = float(now.get(metric) or 0)
+        old_v = float(before.get(metric) or 0)
+        delta = new_v - old_v
+        pct = (delta / old_v * 100) if old_v else 0.0
+        if delta > min_delta_ms and pct > threshold_pct:
+            status = "regressao"
+        elif -delta > min_delta_ms and -pct > threshold_pct:
+            status = "melhora"
+        else:
+            status = "igual"
+        rows.append(
+            {"endpoint": name, "baseline": old_v, "atual": new_v, "delta_ms": round(delta, 2), "delta_pct": round(pct, 1), "status": status}
+        )
+    return rows, warnings
+
+
+def format_table(endpoints: Dict[str, Dict[str, object]]) -> str:
+    header = f"{'endpoint':<26} {'n':>6} {'err':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'req/s':>8}"
+    lines = [header, "-" * len(header)]
+    for name, e in endpoints.items():
+        lines.append(
+            f"{name:<26} {e['count']:>6} {e['errors']:>4} {e['p50_ms']:>9.2f} {e['p95_ms']:>9.2f} "
+            f"{e['p99_ms']:>9.2f} {e['max_ms']:>9.2f} {e['rps']:>8.1f}"
+        )
+    return "\n".join(lines)
+
+
+def format_comparison(rows: List[Dict[str, object]], metric: str) -> str:
+    header = f"{'endpoint':<26} {'baseline':>10} {'atual':>10} {'delta':>10} {'%':>8}  {metric}"
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        if "baseline" not in row:
+            lines.append(f"{row['endpoint']:<26} {'':>10} {'':>10} {'':>10} {'':>8}  {row['status']}")
+            continue
+        lines.append(
+            f"{row['endpoint']:<26} {row['baseline']:>10.2f} {row['atual']:>10.2f} {row['delta_ms']:>+10.2f} "
+            f"{row['delta_pct']:>+7.1f}%  {row['status']}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import queue
+import random
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from . import BENCH_PASSWORD, DATASET_KEY, configure
+from . import report
+from .scenarios import Context, Request, Scenario, select
+
+# Mede p50/p95/p99 por endpoint sobre uma base do bench.dataset.
+#
+#   python -m bench.run --db /tmp/fiscal-bench/app.db --save antes            # app em processo (TestClient)
+#   python -m bench.run --db /tmp/fiscal-bench/app.db --compare antes         # compara com bench/baselines/antes.json
+#   python -m bench.run --db ... --url http://127.0.0.1:8000 --clients 16 --duration 60   # carga contra o servidor
+#
+# Em processo a base e copiada para um temporario (cenarios de escrita nao alteram a original; --in-place desliga).
+# Com --url o servidor precisa estar usando a mesma base (FISCAL_DB_PATH/FISCAL_DATA_DIR do --db).
+
+
+class _InProcess:
+    """Um TestClient por cliente: o app roda no processo, sem rede (mede rota, banco e serializacao)."""
+
+    def __init__(self) -> None:
+        from fastapi.testclient import TestClient
+
+        from app.main import app
+
+        self.client = TestClient(app)
+        self.client.__enter__()
+
+    def login(self, nome: str, senha: str) -> None:
+        response = self.client.post("/auth/login", json={"nome": nome, "senha": senha})
+        if response.status_code != 200:
+            raise RuntimeError(f"login de {nome} falhou: {response.status_code} {response.text}")
+        self.client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+    def send(self, req: Request) -> Tuple[int, int]:
+        response = self.client.request(req.method, req.path, params=req.params or None, json=req.json, files=req.files)
+        return response.status_code, len(response.content)
+
+    def close(self) -> None:
+        self.client.__exit__(None, None, None)
+
+
+class _NoDelayConnection(http.client.HTTPConnection):
+    def connect(self) -> None:
+        super().connect()
+        # sem isso Nagle + ACK atrasado somam ~40ms a cada requisicao com corpo em dois envios
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class _Http:
+    """Conexao keep-alive por cliente (http.client): sem dependencia alem da stdlib."""
+
+    def __init__(self, base_url: str, timeout: float) -> None:
+        parts = urlsplit(base_url)
+        conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else _NoDelayConnection
+        self.conn = conn_cls(parts.hostname or "127.0.0.1", parts.port, timeout=timeout)
+        self.prefix = parts.path.rstrip("/")
+        self.headers: Dict[str, str] = {}
+
+    def _request(self, method: str, path: str, body: Optional[bytes], headers: Dict[str, str]) -> Tuple[int, bytes]:
+        for attempt in (1, 2):
+            try:
+                self.conn.request(method, self.prefix + path, body=body, headers={**self.headers, **headers})
+                response = self.conn.getresponse()
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # keep-alive fechado pelo servidor: reabre uma vez
+                self.conn.close()
+                if attempt == 2:
+                    raise
+        raise AssertionError("inalcancavel")
+
+    def login(self, nome: str, senha: str) -> None:
+        body = json.dumps({"nome": nome, "senha": senha}).encode("utf-8")
+        status, data = self._request("POST", "/auth/login", body, {"Content-Type": "application/json"})
+        if status != 200:
+            raise RuntimeError(f"login de {nome} falhou: {status} {data[:200]!r}")
+        self.headers["Authorization"] = f"Bearer {json.loads(data)['access_token']}"
+
+    def send(self, req: Request) -> Tuple[int, int]:
+        path = req.path + ("?" + urlencode(req.params, doseq=True) if req.params else "")
+        body: Optional[bytes] = None
+        headers: Dict[str, str] = {}
+        if req.files:
+            boundary = uuid.uuid4().hex
+            chunks = []
+            for field, (filename, data, content_type) in req.files.items():
+                chunks.append(
+                    f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                    f"Content-Type: {content_type}\r\n\r\n".encode("utf-8")
+                    + data
+                    + b"\r\n"
+                )
+            body = b"".join(chunks) + f"--{boundary}--\r\n".encode("ascii")
+            headers["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+        elif req.json is not None:
+            body = json.dumps(req.json).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        status, data = self._request(req.method, path, body, headers)
+        return status, len(data)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class _Worker(threading.Thread):
+    def __init__(self, index: int, transport, ctx: Context, seed: int) -> None:
+        super().__init__(name=f"bench-client-{index}", daemon=True)
+        self.transport = transport
+        self.ctx = ctx
+        self.rng = random.Random(seed + index)
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.jobs: Optional["queue.Queue[Scenario]"] = None
+        self.mix: List[Scenario] = []
+        self.deadline = 0.0
+
+    def _one(self, scenario: Scenario) -> None:
+        req = scenario.build(self.ctx, self.rng)
+        started = time.perf_counter()
+        try:
+            status, _ = self.transport.send(req)
+        except Exception as exc:
+            errors = self.errors.setdefault(scenario.name, {})
+            errors[type(exc).__name__] = errors.get(type(exc).__name__, 0) + 1
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if status >= 400:
+            errors = self.errors.setdefault(scenario.name, {})
+            errors[str(status)] = errors.get(str(status), 0) + 1
+            return
+        self.samples.setdefault(scenario.name, []).append(elapsed_ms)
+
+    def run(self) -> None:
+        if self.jobs is not None:
+            while True:
+                try:
+                    scenario = self.jobs.get_nowait()
+                except queue.Empty:
+                    return
+                self._one(scenario)
+        weights = [s.weight for s in self.mix]
+        while time.perf_counter() < self.deadline:
+            self._one(self.rng.choices(self.mix, weights=weights)[0])
+
+
+def _copy_db(src: Path) -> Path:
+    """Copia consistente (API de backup) para um temporario; o WAL da origem entra na copia."""
+    target_dir = Path(tempfile.mkdtemp(prefix="fiscal-bench-"))
+    target = target_dir / "app.db"
+    source = sqlite3.connect(f"file:{src}?mode=ro", uri=True)
+    dest = sqlite3.connect(str(target))
+    try:
+        source.backup(dest)
+    finally:
+        dest.close()
+        source.close()
+    return target
+
+
+def _dataset_meta(db_path: Path) -> Optional[Dict[str, object]]:
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        row = conn.execute("SELECT value FROM app_settings WHERE key = ?", (DATASET_KEY,)).fetchone()
+    except sqlite3.Error:
+        row = None
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, object]:
+    source = Path(args.db).expanduser().resolve()
+    if not source.exists():
+        raise FileNotFoundError(f"{source} nao existe: gere a base com python -m bench.dataset")
+    data_dir = args.data_dir or str(source.parent / "data")
+    db_path = source
+    if not args.url and not args.in_place:
+        db_path = _copy_db(source)
+    configure(str(db_path), data_dir)
+
+    ctx = Context(str(db_path), args.user)
+    scenarios = select(args.scenario, read_only=args.read_only, role=ctx.role)
+    if not scenarios:
+        raise ValueError("nenhum cenario selecionado")
+
+    def transport():
+        return _Http(args.url, args.timeout) if args.url else _InProcess()
+
+    workers = []
+    for index in range(max(1, args.clients)):
+        t = transport()
+        t.login(args.user, args.password)
+        workers.append(_Worker(index, t, ctx, args.seed))
+
+    # aquecimento fora da medicao: caches do SQLite, regex compiladas, primeira importacao do pdfplumber
+    warm = _Worker(0, workers[0].transport, ctx, args.seed + 1000)
+    for scenario in scenarios:
+        for _ in range(max(0, args.warmup)):
+            warm._one(scenario)
+
+    if args.duration:
+        deadline = time.perf_counter() + args.duration
+        for w in workers:
+            w.mix, w.deadline = scenarios, deadline
+    else:
+        jobs: "queue.Queue[Scenario]" = queue.Queue()
+        planned = [s for s in scenarios for _ in range(max(1, args.requests))]
+        random.Random(args.seed).shuffle(planned)
+        for scenario in planned:
+            jobs.put(scenario)
+        for w in workers:
+            w.jobs = jobs
+
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    wall_s = time.perf_counter() - started
+    for w in workers:
+        w.transport.close()
+
+    samples: Dict[str, List[float]] = {}
+    errors: Dict[str, Dict[str, int]] = {}
+    for w in workers:
+        for name, values in w.samples.items():
+            samples.setdefault(name, []).extend(values)
+        for name, by_status in w.errors.items():
+            merged = errors.setdefault(name, {})
+            for status, count in by_status.items():
+                merged[status] = merged.get(status, 0) + count
+
+    endpoints = report.summarize(samples, errors, wall_s)
+    meta = {
+        "mode": "http" if args.url else "in-process",
+        "url": args.url,
+        "clients": max(1, args.clients),
+        "user": args.user,
+        "duration_s": args.duration or None,
+        "requests_per_scenario": None if args.duration else max(1, args.requests),
+        "warmup": args.warmup,
+        "seed": args.seed,
+        "wall_s": round(wall_s, 2),
+        "total_requests": sum(len(v) for v in samples.values()),
+        "dataset": _dataset_meta(db_path),
+    }
+    if db_path != source:
+        shutil.rmtree(db_path.parent, ignore_errors=True)
+    return report.build_result(endpoints, meta)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m bench.run", description="Latencia por endpoint (p50/p95/p99)")
+    parser.add_argument("--db", required=True, help="app.db gerado pelo bench.dataset")
+    parser.add_argument("--data-dir", help="diretorio de dados; padrao: <pasta do --db>/data")
+    parser.add_argument("--url", help="mede um servidor ja rodando (ex.: http://127.0.0.1:8000) em vez do app em processo")
+    parser.add_argument("--clients", type=int, default=1, help="clientes concorrentes (threads)")
+    parser.add_argument("--requests", type=int, default=50, help="requisicoes por cenario (sem --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="segundos de carga com a mistura ponderada de cenarios")
+    parser.add_argument("--warmup", type=int, default=3, help="requisicoes por cenario antes de medir")
+    parser.add_argument("--scenario", action="append", help="restringe aos cenarios indicados (repetivel)")
+    parser.add_argument("--read-only", action="store_true", help="sem cenarios que gravam (upload, status, comentario, sync)")
+    parser.add_argument("--in-place", action="store_true", help="em processo, usa a base original em vez de uma copia")
+    parser.add_argument("--user", default="admin")
+    parser.add_argument("--password", default=BENCH_PASSWORD)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="grava o resultado (nome em bench/baselines/ ou caminho .json)")
+    parser.add_argument("--compare", help="baseline para comparar (nome ou caminho)")
+    parser.add_argument("--metric", default="p95_ms", choices=[f"p{p}_ms" for p in report.PERCENTILES] + ["mean_ms"])
+    parser.add_argument("--threshold", type=float, default=10.0, help="piora percentual que conta como regressao")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="diferenca minima em ms para contar (ruido)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="sai com 1 se algum endpoint regrediu")
+    parser.add_argument("--json", action="store_true", help="imprime o resultado completo em JSON")
+    parser.add_argument("--list", action="store_true", help="lista os cenarios e sai")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    raw = list(sys.argv[1:] if argv is None else argv)
+    if "--list" in raw:
+        for scenario in select():
+            flags = ", ".join((["escrita"] if scenario.writes else []) + list(scenario.roles))
+            print(f"{scenario.name:<26} peso {scenario.weight:<5g} {flags}".rstrip())
+        return 0
+    args = build_parser().parse_args(raw)
+    try:
+        result = run_benchmark(args)
+    except (FileNotFoundError, ValueError, RuntimeError) as exc:
+        print(str(exc), file=sys.stderr)
+        return 2
+    endpoints: Dict[str, Dict[str, object]] = result["endpoints"]  # type: ignore[assignment]
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        meta = result["meta"]
+        print(f"{meta['mode']}, {meta['clients']} cliente(s), {meta['total_requests']} requisicoes em {meta['wall_s']}s")  # type: ignore[index]
+        print(report.format_table(endpoints))
+    if args.save:
+        print(f"baseline gravado em {report.save(result, args.save)}", file=sys.stderr)
+    if args.compare:
+        rows, warnings = report.compare(
+            result, report.load(args.compare), metric=args.metric, threshold_pct=args.threshold, min_delta_ms=args.min_delta_ms
+        )
+        for warning in warnings:
+            print(f"aviso: {warning}", file=sys.stderr)
+        print()
+        print(report.format_comparison(rows, args.metric))
+        if args.fail_on_regression and any(r.get("status") == "regressao" for r in rows):
+            return 1
+    failed = sum(int(e["errors"]) for e in endpoints.values())
+    if failed:
+        print(f"{failed} requisicoes com erro (ver coluna err)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
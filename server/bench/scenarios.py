@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import random
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .dataset import guia_lines, pdf_filename, synthetic_pdf
+
+# Requisicoes medidas pelo bench.run. Cada cenario sorteia os parametros na base (ids, competencias,
+# termos de busca) para nao medir sempre a mesma linha quente do cache do SQLite.
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    params: Dict[str, object] = field(default_factory=dict)
+    json: Optional[object] = None
+    files: Optional[Dict[str, Tuple[str, bytes, str]]] = None
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    build: Callable[["Context", random.Random], Request]
+    weight: float = 1.0
+    # grava no banco: fica de fora com --read-only
+    writes: bool = False
+    # papeis com permissao no endpoint (vazio = todos)
+    roles: Tuple[str, ...] = ()
+
+
+class Context:
+    """Amostra da base para montar as requisicoes (lida uma vez, direto do SQLite)."""
+
+    def __init__(self, db_path: str, user: str = "admin", sample: int = 2000) -> None:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute("SELECT id, role FROM usuarios WHERE nome = ?", (user,)).fetchone()
+            # colaborador so enxerga as proprias tarefas: sortear as dos outros mediria 404
+            self.role = str(row["role"]) if row else "admin"
+            owner = int(row["id"]) if row and self.role == "collab" else None
+            self.tasks = [
+                dict(r)
+                for r in conn.execute(
+                    """
+                    SELECT t.id, t.user_id, t.company_id, t.tipo, t.tributo, t.competencia, t.vencimento, t.status,
+                           t.pdf_sha256 IS NOT NULL AS has_pdf, e.nome, e.cnpj
+                    FROM tarefas t JOIN empresas e ON e.id = t.company_id
+                    WHERE ? IS NULL OR t.user_id = ?
+                    ORDER BY random() LIMIT ?
+                    """,
+                    (owner, owner, sample),
+                ).fetchall()
+            ]
+            self.companies = [dict(r) for r in conn.execute("SELECT id, nome, cnpj, regime FROM empresas").fetchall()]
+            self.competencias = [
+                str(r[0])
+                for r in conn.execute(
+                    "SELECT DISTINCT competencia FROM tarefas WHERE competencia IS NOT NULL ORDER BY competencia"
+                ).fetchall()
+            ]
+        finally:
+            conn.close()
+        if not self.tasks or not self.companies:
+            raise ValueError(f"{db_path} sem tarefas/empresas: gere a base com python -m bench.dataset")
+        self.with_pdf = [t for t in self.tasks if t["has_pdf"]] or self.tasks
+        self.obr = [t for t in self.tasks if t["tipo"] == "OBR"] or self.tasks
+        self.words = sorted({w for c in self.companies for w in str(c["nome"]).split() if len(w) > 3 and not w.isdigit()})
+
+
+def _task(ctx: Context, rng: random.Random) -> Dict[str, object]:
+    return rng.choice(ctx.tasks)
+
+
+def _recent(ctx: Context, rng: random.Random) -> str:
+    return rng.choice(ctx.competencias[-3:])
+
+
+def _upload(ctx: Context, rng: random.Random) -> Request:
+    task = rng.choice(ctx.obr)
+    competencia = str(task["competencia"])
+    tributo = str(task["tributo"])
+    lines = guia_lines(str(task["nome"]), str(task["cnpj"]), competencia, tributo, str(task["vencimento"] or ""), rng.uniform(80, 50000))
+    # paginas extras: o texto extraido cresce como em guia com demonstrativo anexo
+    data = synthetic_pdf(lines, pages=rng.choice((1, 1, 2, 4)))
+    name = pdf_filename(competencia, tributo, str(task["nome"]))
+    return Request("POST", f"/tasks/{task['id']}/pdf", files={"file": (name, data, "application/pdf")})
+
+
+def _sync(ctx: Context, rng: random.Random) -> Request:
+    # mes corrente: sincronizar outro mes regrava a competencia marcada e a proxima listagem ressincroniza o atual
+    competencia = ctx.competencias[-1]
+    return Request("POST", "/maintenance/sync-monthly", params={"year": int(competencia[:4]), "month": int(competencia[4:])})
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("tasks_list_competencia", lambda c, r: Request("GET", "/tasks", {"competencia": _recent(c, r)}), weight=3),
+    Scenario(
+        "tasks_list_company",
+        lambda c, r: Request("GET", "/tasks", {"company_id": r.choice(c.companies)["id"]}),
+        weight=2,
+    ),
+    Scenario(
+        "tasks_list_status",
+        lambda c, r: Request("GET", "/tasks", {"status": ["PENDENTE", "EM_ANDAMENTO"], "competencia": _recent(c, r)}),
+    ),
+    Scenario("tasks_upcoming", lambda c, r: Request("GET", "/tasks/upcoming", {"days": r.choice((7, 15, 30))}), weight=2),
+    Scenario("companies_list", lambda c, r: Request("GET", "/companies", {"competencia": _recent(c, r)}), weight=2),
+    Scenario("companies_search", lambda c, r: Request("GET", "/companies", {"query": r.choice(c.words)})),
+    Scenario("search", lambda c, r: Request("GET", "/search", {"q": r.choice(c.words)[:5]}), weight=2),
+    Scenario(
+        "report_summary",
+        lambda c, r: Request(
+            "GET",
+            "/reports/summary",
+            {"group_by": ["status", "tipo"], "competencia_from": c.competencias[max(0, len(c.competencias) - 12)], "competencia_to": c.competencias[-1]},
+        ),
+    ),
+    Scenario("report_summary_all", lambda c, r: Request("GET", "/reports/summary")),
+    Scenario("export_tasks_csv", lambda c, r: Request("GET", "/exports/tasks.csv", {"competencia": _recent(c, r)}), weight=0.5),
+    Scenario("export_tasks_xlsx", lambda c, r: Request("GET", "/exports/tasks.xlsx"), weight=0.1),
+    Scenario("task_logs", lambda c, r: Request("GET", f"/tasks/{_task(c, r)['id']}/logs")),
+    Scenario("task_comments", lambda c, r: Request("GET", f"/tasks/{_task(c, r)['id']}/comments")),
+    Scenario("notifications", lambda c, r: Request("GET", "/notifications", {"unread_only": r.choice((True, False))})),
+    Scenario("pdf_download", lambda c, r: Request("GET", f"/tasks/{r.choice(c.with_pdf)['id']}/pdf")),
+    Scenario(
+        "task_status",
+        lambda c, r: Request("PATCH", f"/tasks/{_task(c, r)['id']}/status", json={"status": r.choice(("EM_ANDAMENTO", "CONCLUIDA"))}),
+        writes=True,
+        roles=("admin", "collab"),
+    ),
+    Scenario(
+        "task_comment",
+        lambda c, r: Request("POST", f"/tasks/{_task(c, r)['id']}/comments", json={"text": "Conferir guia (bench)"}),
+        writes=True,
+        weight=0.5,
+        roles=("admin", "manager"),
+    ),
+    Scenario("pdf_upload", _upload, writes=True, roles=("admin", "collab")),
+    Scenario("sync_monthly", _sync, writes=True, roles=("admin",), weight=0.1),
+]
+
+
+def select(names: Optional[List[str]] = None, *, read_only: bool = False, role: Optional[str] = None) -> List[Scenario]:
+    known = {s.name: s for s in SCENARIOS}
+    if names:
+        missing = [n for n in names if n not in known]
+        if missing:
+            raise ValueError(f"cenario desconhecido: {', '.join(missing)} (disponiveis: {', '.join(known)})")
+        chosen = [known[n] for n in names]
+    else:
+        chosen = list(SCENARIOS)
+    return [s for s in chosen if not (read_only and s.writes) and (role is None or not s.roles or role in s.roles)]
@@ -5,4 +5,4 @@ if (!(Test-Path ".venv")) {
 }
 
 .\.venv\Scripts\python.exe -m pip install -r requirements.txt
-.\.venv\Scripts\python.exe -m uvicorn app.main:app --reload --port 8000
+.\.venv\Scripts\python.exe -m app.serve --reload --port 8000
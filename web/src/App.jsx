@@ -2445,8 +2445,17 @@ function Dashboard({ userId, company, onBack, userRole, competenciaScope, initia
 
 
 
+function competenciaRange(scope) {
+  const quarterMap = { T1: [1, 3], T2: [4, 6], T3: [7, 9], T4: [10, 12] };
+  const [first, last] = quarterMap[scope.period] || [1, 12];
+  const fmt = (m) => `${scope.year}${String(m).padStart(2, "0")}`;
+  return { competencia_from: fmt(first), competencia_to: fmt(last) };
+}
+
 function ReportsPage({ userId, refreshTick }) {
-  const [tasks, setTasks] = useState([]);
+  const [competencias, setCompetencias] = useState([]);
+  const [summaryRows, setSummaryRows] = useState([]);
+  const [tasksForCompany, setTasksForCompany] = useState([]);
   const [companies, setCompanies] = useState([]);
   const [year, setYear] = useState(new Date().getFullYear());
   const [period, setPeriod] = useState("ANUAL");
@@ -2456,9 +2465,9 @@ function ReportsPage({ userId, refreshTick }) {
   useEffect(() => {
     if (!userId) return;
     api
-      .listTasks({ user_id: userId })
-      .then(setTasks)
-      .catch(() => setTasks([]));
+      .reportSummary({ user_id: userId, group_by: ["competencia"] })
+      .then((out) => setCompetencias((out?.rows || []).map((r) => r.competencia)))
+      .catch(() => setCompetencias([]));
     api
       .listCompanies(userId)
       .then(setCompanies)
@@ -2467,13 +2476,13 @@ function ReportsPage({ userId, refreshTick }) {
 
   const years = useMemo(() => {
     const set = new Set();
-    tasks.forEach((t) => {
-      const parsed = parseCompetencia(t.competencia);
+    competencias.forEach((c) => {
+      const parsed = parseCompetencia(c);
       if (parsed) set.add(parsed.year);
     });
     if (set.size === 0) set.add(new Date().getFullYear());
     return Array.from(set).sort((a, b) => b - a);
-  }, [tasks]);
+  }, [competencias]);
 
   useEffect(() => {
     if (!years.includes(year) && years.length) {
@@ -2487,16 +2496,34 @@ function ReportsPage({ userId, refreshTick }) {
   }, [year, period]);
 
   const scopeValue = useMemo(() => ({ year, period }), [year, period]);
-  const filtered = useMemo(() => tasks.filter((t) => inScope(t.competencia, scopeValue)), [tasks, scopeValue]);
+
+  useEffect(() => {
+    if (!userId) return;
+    api
+      .reportSummary({ user_id: userId, group_by: ["status", "company_id"], ...competenciaRange(scopeValue) })
+      .then((out) => setSummaryRows(out?.rows || []))
+      .catch(() => setSummaryRows([]));
+  }, [userId, refreshTick, scopeValue]);
+
+  useEffect(() => {
+    if (!userId || !selectedStatus || !selectedCompanyId) {
+      setTasksForCompany([]);
+      return;
+    }
+    api
+      .listTasks({ user_id: userId, company_id: selectedCompanyId, status: [selectedStatus] })
+      .then((rows) => setTasksForCompany((rows || []).filter((t) => inScope(t.competencia, scopeValue))))
+      .catch(() => setTasksForCompany([]));
+  }, [userId, selectedStatus, selectedCompanyId, scopeValue]);
 
   const counts = useMemo(() => {
     const out = {};
     STATUSES.forEach((s) => (out[s] = 0));
-    filtered.forEach((t) => {
-      out[t.status] = (out[t.status] || 0) + 1;
+    summaryRows.forEach((r) => {
+      out[r.status] = (out[r.status] || 0) + r.total;
     });
     return out;
-  }, [filtered]);
+  }, [summaryRows]);
 
   const total = STATUSES.reduce((acc, s) => acc + (counts[s] || 0), 0);
   const segments = STATUSES.map((s) => ({
@@ -2511,23 +2538,16 @@ function ReportsPage({ userId, refreshTick }) {
     return m;
   }, [companies]);
 
-  const filteredByStatus = selectedStatus ? filtered.filter((t) => t.status === selectedStatus) : [];
-
   const companyCounts = useMemo(() => {
-    const m = new Map();
-    filteredByStatus.forEach((t) => {
-      m.set(t.company_id, (m.get(t.company_id) || 0) + 1);
-    });
-    return Array.from(m.entries()).map(([companyId, count]) => ({
-      companyId,
-      name: companyMap.get(companyId) || `Empresa ${companyId}`,
-      count,
-    }));
-  }, [filteredByStatus, companyMap]);
-
-  const tasksForCompany = selectedCompanyId
-    ? filteredByStatus.filter((t) => t.company_id === selectedCompanyId)
-    : [];
+    if (!selectedStatus) return [];
+    return summaryRows
+      .filter((r) => r.status === selectedStatus)
+      .map((r) => ({
+        companyId: r.company_id,
+        name: companyMap.get(r.company_id) || `Empresa ${r.company_id}`,
+        count: r.total,
+      }));
+  }, [summaryRows, selectedStatus, companyMap]);
 
   return (
     <div className="page">
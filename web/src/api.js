@@ -67,6 +67,8 @@ export const api = {
         regime
       )}&competencia=${encodeURIComponent(competencia)}`
     ),
+  search: (userId, q, limit = 20) =>
+    request(`/search?user_id=${userId}&q=${encodeURIComponent(q)}&limit=${limit}`),
   createCompany: (payload) => request("/companies", { method: "POST", body: JSON.stringify(payload) }),
   updateCompany: (companyId, userId, payload) =>
     request(`/companies/${companyId}?user_id=${userId}`, { method: "PATCH", body: JSON.stringify(payload) }),
@@ -89,6 +91,19 @@ export const api = {
     return request(`/tasks?${qs.toString()}`);
   },
 
+  reportSummary: (params) => {
+    const qs = new URLSearchParams();
+    Object.entries(params || {}).forEach(([k, v]) => {
+      if (v === undefined || v === null || v === "") return;
+      if (Array.isArray(v)) {
+        v.forEach((item) => qs.append(k, item));
+      } else {
+        qs.append(k, v);
+      }
+    });
+    return request(`/reports/summary?${qs.toString()}`);
+  },
+
   listUpcomingTasks: (userId, days = 7) => request(`/tasks/upcoming?user_id=${userId}&days=${days}`),
   listTaskComments: (taskId, userId) => request(`/tasks/${taskId}/comments?user_id=${userId}`),
   addTaskComment: (taskId, userId, text) =>